@@ -10,6 +10,7 @@ import subprocess
 import sys
 import io
 import crayons
+from agutil import byteSize
 
 def main():
     parent = argparse.ArgumentParser(add_help=False)
@@ -256,6 +257,21 @@ def main():
     )
     info_parser.set_defaults(func=cmd_info)
 
+    storage_parser = subparsers.add_parser(
+        'storage',
+        help="Summarize storage usage in the workspace bucket",
+        description="Summarize storage usage in the workspace bucket, by "
+        "top-level directory, submission, task, and file type",
+        parents=[parent]
+    )
+    storage_parser.set_defaults(func=cmd_storage)
+    storage_parser.add_argument(
+        '-n', '--top',
+        type=int,
+        help="Number of rows to display in each table (Default: 10)",
+        default=10
+    )
+
     finish_parser = subparsers.add_parser(
         'finish',
         help="Finishes an execution and uploads results to firecloud",
@@ -276,6 +292,13 @@ def main():
         action='store_true',
         help="Abort the submission, if it hasn't finished already"
     )
+    finish_parser.add_argument(
+        '--streaming',
+        action='store_true',
+        help="Upload results from workflows which have already finished, even if"
+        " the submission is still running. Each workflow is only uploaded once,"
+        " so this may be run repeatedly"
+    )
 
     ui_parser = subparsers.add_parser(
         'ui',
@@ -524,6 +547,26 @@ def cmd_info(args):
                 print('\t\t'+submission, '(%s)'%entity)
 
 
+def cmd_storage(args):
+    report = args.workspace.storage_report()
+    print("Firecloud Workspace:", '%s/%s' % (args.workspace.namespace, args.workspace.workspace))
+    print("Total:", report['count'], "files (", byteSize(report['size']), ")")
+    if 'change' in report:
+        print("Change since last report:", ('+' if report['change'] >= 0 else '-') + byteSize(abs(report['change'])))
+    for key, title in [
+        ('by_prefix', 'Directory'),
+        ('by_submission', 'Submission'),
+        ('by_task', 'Task'),
+        ('by_extension', 'File Type')
+    ]:
+        print()
+        print("By", title)
+        df = report[key].head(args.top).copy()
+        df['size'] = df['size'].apply(byteSize)
+        if 'change' in df.columns:
+            df['change'] = df['change'].apply(lambda change: ('+' if change >= 0 else '-') + byteSize(abs(change)))
+        print(df.to_string())
+
 def cmd_exec(args):
     etype, expr = args.expression if args.expression is not None else (None, None)
     global_id, submission_id, operation_id = args.workspace.execute(
@@ -554,7 +597,7 @@ def get_operation_status(opid):
 
 def cmd_finish(args):
     print("Note: lapdog-finish is not yet fully implemented")
-    lapdog.complete_execution(args.submission_id)
+    lapdog.complete_execution(args.submission, streaming=args.streaming)
 
 def cmd_service_account(args):
     print("Lapdog Engine Initialization")
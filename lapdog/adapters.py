@@ -14,7 +14,7 @@ import select
 from .cache import cache_fetch, cache_write, cached, cache_path
 from .cloud.utils import generate_default_session
 from dalmatian import getblob, strict_getblob
-from .gateway import Gateway
+from .gateway import get_gateway
 import traceback
 import sys
 import threading
@@ -329,7 +329,7 @@ class SubmissionAdapter(object):
         """
         Constructs the adapter. Requires the bucket id for the workspace and the
         submission id for the submission. To save time, you may also provide the
-        Gateway object for this namespace, otherwise a new Gateway will be constructed.
+        Gateway object for this namespace, otherwise the shared Gateway for the namespace is used.
         Downloads and parses the submission.json file for this submission.
         submission.json files are cached if the submission is done.
         """
@@ -366,7 +366,7 @@ class SubmissionAdapter(object):
             self.identifier = self.data['identifier']
             self.operation = self.data['operation'] if 'operation' in self.data else 'NULL'
             self.raw_workflows = self.data['workflows']
-            self.gateway = Gateway(self.namespace) if gateway is None else gateway
+            self.gateway = get_gateway(self.namespace) if gateway is None else gateway
             self.workflow_mapping = {}
             self.thread = None
             self.workflows = {}
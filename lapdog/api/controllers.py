@@ -22,7 +22,7 @@ from glob import glob
 import yaml
 from .. import firecloud_status
 from ..cache import cached, cache_fetch, cache_write, cache_init, cache_path
-from ..adapters import NoSuchSubmission, Gateway, get_operation_status
+from ..adapters import NoSuchSubmission, get_gateway, get_operation_status
 from ..auth import LapdogToken
 from ..gateway import get_application_default_account, get_proxy_account
 import re
@@ -789,13 +789,14 @@ def cache_size():
 @controller
 def quotas(namespace):
     try:
-        return Gateway(namespace).quota_usage
+        return get_gateway(namespace).quota_usage
     except NameError:
         traceback.print_exc()
         print("No resolution found")
         return {
             'raw': [],
-            'alerts': []
+            'alerts': [],
+            'errors': {}
         }
 
 
@@ -993,6 +994,23 @@ def get_autocomplete_entries(namespace, name, entity):
         if entity in eid
     ]
 
+@cached(600)
+@controller
+def storage_report(namespace, name):
+    ws = get_workspace_object(namespace, name)
+    report = ws.storage_report()
+    return {
+        **{
+            key:report[key]
+            for key in ['timestamp', 'count', 'size', 'previous_timestamp', 'change']
+            if key in report
+        },
+        **{
+            key:json.loads(report[key].reset_index().to_json(orient='records'))
+            for key in ['by_prefix', 'by_submission', 'by_task', 'by_extension']
+        }
+    }, 200
+
 @controller
 def seed_cache(namespace, name):
     ws = get_workspace_object(namespace, name)
@@ -2,9 +2,11 @@ import os
 import base64
 import webbrowser
 import json
+import sys
 import time
 import subprocess
-from threading import RLock
+import traceback
+from threading import RLock, Thread
 from urllib.parse import urlencode
 from hashlib import sha256
 from getpass import getuser
@@ -48,12 +50,19 @@ class LapdogToken(object):
         'openid',
         'https://www.googleapis.com/auth/devstorage.read_write'
     ]
+    # Tokens are refreshed in the background this many seconds before they expire
+    REFRESH_MARGIN = 300
+    # Failed background refreshes are retried with exponential backoff, up to this many seconds apart
+    MAX_REFRESH_BACKOFF = 3600
 
     def __init__(self, account=None):
         """
         Represents a self-refreshing access token for Lapdog APIs, issued by Google.
         Credentials are saved to disk, so each account should only need to login once.
         Access token is valid for 1 hour, but can be refreshed with .refresh()
+        The expiry time is tracked locally, and the token is refreshed on a
+        background thread before it expires. Google's tokeninfo endpoint is only
+        checked when the token is first loaded, or after .invalidate()
         """
         self.account = account if account is not None else get_gcloud_account()
         if not self.account.endswith('@broadinstitute.org'):
@@ -61,8 +70,11 @@ class LapdogToken(object):
         self.token = None
         self.refresh_token = None
         self.ident = None
+        self.expiry = None # Epoch time when the access token expires. None if unknown
+        self._info = None
         self._lock = RLock()
         self._session = None
+        self._refresher = None
 
         path = LapdogToken.path_for_account(self.account)
         try:
@@ -77,10 +89,10 @@ class LapdogToken(object):
             self.auto_login()
 
         if not self.valid:
-            return self.refresh()
-
-        if self.info['email'] != self.account:
+            self.refresh()
+        elif self.info['email'] != self.account:
             raise AccountMismatch("{} != {}".format(self.info['email'], self.account))
+        self._start_refresher()
 
     @staticmethod
     def path_for_account(account):
@@ -101,26 +113,60 @@ class LapdogToken(object):
         )
 
     @staticmethod
-    @cached(10)
-    def _validate(token, account):
-        info = utils.get_token_info(token)
+    def _check_info(info, account):
         return (
             'error' not in info
             and 'audience' in info
             and info['audience'] == utils.OAUTH_CLIENT_ID
             and 'expires_in' in info
-            and info['expires_in'] > 10 # 10s is important. This way token will not expire during current cache window
+            and int(info['expires_in']) > 10
             and 'email' in info
             and info['email'] == account
         )
 
+    @staticmethod
+    @cached(10)
+    def _validate(token, account):
+        return LapdogToken._check_info(utils.get_token_info(token), account)
+
+    def _check(self):
+        """
+        Checks the current token against Google's tokeninfo endpoint and
+        records its expiry time
+        """
+        info = utils.get_token_info(self.token) if self.token is not None else {'error': 'No token'}
+        with self._lock:
+            if LapdogToken._check_info(info, self.account):
+                self._info = info
+                self.expiry = time.time() + int(info['expires_in'])
+            else:
+                self._info = None
+                self.expiry = 0
+
+    @property
+    def expires_in(self):
+        """
+        Seconds until the token expires, according to the locally tracked expiry time
+        """
+        if self.expiry is None:
+            self._check()
+        return self.expiry - time.time()
+
     @property
     def valid(self):
         """
         Checks that the token is valid and not expired
         """
-        return LapdogToken._validate(self.token, self.account)
+        return self.expires_in > 10
 
+    def invalidate(self):
+        """
+        Forgets the local expiry time, so the token is checked against tokeninfo
+        on next use. Call this after a request fails authentication
+        """
+        with self._lock:
+            self.expiry = None
+            self._info = None
 
     @property
     def auto_token(self):
@@ -129,17 +175,52 @@ class LapdogToken(object):
         If token expires in less than 60s, refresh it.
         If token not logged in, raise Authentication Error
         """
-        if not (self.valid and self.info['expires_in'] >= 60):
+        if self.expires_in < 60:
             self.refresh()
         return self.token
 
     @property
-    @cached(10)
     def info(self):
         """
-        Get token info
+        Get token info.
+        This is only fetched once per token, with expires_in kept up to date locally
         """
-        return utils.get_token_info(self.token)
+        if self._info is None:
+            self._check()
+        with self._lock:
+            info = dict(self._info) if self._info is not None else {'error': 'invalid_token'}
+            if self.expiry is not None:
+                info['expires_in'] = int(self.expiry - time.time())
+            return info
+
+    def _start_refresher(self):
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = Thread(target=self._refresh_loop, name='lapdog-token-refresh', daemon=True)
+                self._refresher.start()
+
+    def _refresh_loop(self):
+        """
+        Background loop which refreshes the token before it expires
+        """
+        failures = 0
+        while True:
+            try:
+                # Wake at least once a minute, in case the system was suspended
+                delay = min(60, self.expires_in - LapdogToken.REFRESH_MARGIN)
+                if delay <= 0:
+                    self.refresh()
+                    delay = 0
+                failures = 0
+            except:
+                if not failures:
+                    # Only report the first failure until the token is valid again
+                    traceback.print_exc()
+                    print("Unable to refresh the Lapdog token. Retrying in the background", file=sys.stderr)
+                failures += 1
+                delay = min(60 * 2 ** (failures - 1), LapdogToken.MAX_REFRESH_BACKOFF)
+            if delay > 0:
+                time.sleep(delay)
 
     def manual_login(self):
         """
@@ -294,7 +375,7 @@ class LapdogToken(object):
         """
         Refreshes a token, assuming the client already has a refresh_token
         """
-        if t is not None and self.info['expires_in'] > t:
+        if t is not None and self.expires_in > t:
             # If user specifies a time, only refresh if the token expires in the given window
             return
         response = requests.post(
@@ -311,7 +392,16 @@ class LapdogToken(object):
 
         if response.status_code == 200:
             auth_data = response.json()
-            if LapdogToken._validate(auth_data['access_token'], self.account):
+            if 'expires_in' in auth_data:
+                # The refresh token was already checked against this account,
+                # so trust the expiry time from the response
+                self._save_info(
+                    token=auth_data['access_token'],
+                    refresh=self.refresh_token,
+                    ident=auth_data['id_token'] if 'id_token' in auth_data else None,
+                    expires_in=int(auth_data['expires_in'])
+                )
+            elif LapdogToken._validate(auth_data['access_token'], self.account):
                 self._save_info(
                     token=auth_data['access_token'],
                     refresh=self.refresh_token,
@@ -345,22 +435,30 @@ class LapdogToken(object):
                 )
             return self._session
 
-    def _save_info(self, token, refresh, ident=None):
-        info = utils.get_token_info(token)
+    def _save_info(self, token, refresh, ident=None, expires_in=None):
+        if expires_in is None:
+            info = utils.get_token_info(token)
 
-        if 'error' in info or 'audience' not in info or info['audience'] != utils.OAUTH_CLIENT_ID or 'expires_in' not in info or info['expires_in'] < 10 or 'email' not in info:
-            raise InvalidToken("Invalid token {}".format(repr(info)))
+            if 'error' in info or 'audience' not in info or info['audience'] != utils.OAUTH_CLIENT_ID or 'expires_in' not in info or int(info['expires_in']) < 10 or 'email' not in info:
+                raise InvalidToken("Invalid token {}".format(repr(info)))
+            expires_in = int(info['expires_in'])
+        else:
+            info = None
 
-        with open(LapdogToken.path_for_account(info['email']), 'w') as w:
+        with open(LapdogToken.path_for_account(self.account if info is None else info['email']), 'w') as w:
             json.dump({
                 'access_token': token,
                 'refresh_token': refresh,
                 'id_token': ident
             }, w)
 
-        if info['email'] != self.account:
+        if info is not None and info['email'] != self.account:
             raise AccountMismatch("{} != {}".format(info['email'], self.account))
 
-        self.token = token
-        self.refresh_token = refresh
-        self.ident = ident
+        with self._lock:
+            self.token = token
+            self.refresh_token = refresh
+            self.ident = ident
+            self.expiry = time.time() + expires_in
+            if info is not None:
+                self._info = info
@@ -2,6 +2,9 @@ import os
 import time
 import shutil
 import time
+import weakref
+from collections import OrderedDict
+from threading import Lock
 from functools import lru_cache, partial, wraps
 from hashlib import md5
 
@@ -39,6 +42,48 @@ def cached(timeout, cache_size=4):
 
     return wrapper
 
+class InstanceRegistry(object):
+    """
+    Thread-safe registry of shared instances, keyed by their constructor arguments.
+    The `size` most recently requested instances are kept alive by the registry.
+    Older instances remain registered for as long as anything else still holds
+    a reference to them
+    """
+
+    def __init__(self, factory, size=16):
+        self.factory = factory
+        self.size = size
+        self.instances = weakref.WeakValueDictionary()
+        self.recent = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, *key):
+        """
+        Returns the registered instance for the given arguments, constructing it if needed
+        """
+        with self.lock:
+            instance = self.instances.get(key)
+        if instance is None:
+            # Construct outside the lock, so slow constructors don't block other keys.
+            # If two threads race, the first instance registered wins
+            instance = self.factory(*key)
+            with self.lock:
+                instance = self.instances.setdefault(key, instance)
+        with self.lock:
+            self.recent[key] = instance
+            self.recent.move_to_end(key)
+            while len(self.recent) > self.size:
+                self.recent.popitem(last=False)
+        return instance
+
+    def clear(self):
+        """
+        Forgets all registered instances
+        """
+        with self.lock:
+            self.instances.clear()
+            self.recent.clear()
+
 def cache_type(key):
     def wrapper(func):
         CACHES[key] = func
@@ -122,6 +167,20 @@ def _pointer_type(bucket_id, submission_id, dtype='data', ext=''):
         bucket_id, submission_id, dtype, ext
     )
 
+@cache_type('mop-checkpoint')
+@path_eval
+def _mop_type(bucket_id, dtype='data', ext=''):
+    return 'mop-checkpoint.%s.%s%s' % (
+        bucket_id, dtype, ext
+    )
+
+@cache_type('storage-report')
+@path_eval
+def _storage_report_type(bucket_id, dtype='data', ext=''):
+    return 'storage-report.%s.%s%s' % (
+        bucket_id, dtype, ext
+    )
+
 def cache_path(key):
     if key in CACHES:
         return CACHES[key]
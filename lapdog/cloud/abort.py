@@ -37,7 +37,8 @@ def abort_submission(request):
                 400
             )
 
-        token_info = utils.get_token_info(token)
+        with logger.span('token'):
+            token_info = utils.get_token_info(token)
         if 'error' in token_info:
             return (
                 {
@@ -70,7 +71,8 @@ def abort_submission(request):
 
         session = utils.generate_user_session(token)
 
-        read, write = utils.validate_permissions(session, data['bucket'])
+        with logger.span('permissions'):
+            read, write = utils.validate_permissions(session, data['bucket'], token_info['email'])
         if read is None:
             # Error, write will contain a message
             return (
@@ -101,9 +103,10 @@ def abort_submission(request):
                 400
             )
 
-        submission = utils.fetch_submission_blob(session, data['bucket'], data['submission_id'])
+        with logger.span('submission-file'):
+            submission = utils.fetch_submission_blob(session, data['bucket'], data['submission_id'])
 
-        result, message = utils.validate_submission_file(submission)
+            result, message = utils.validate_submission_file(submission)
         if not result:
             return (
                 {
@@ -116,7 +119,8 @@ def abort_submission(request):
         # 4) Download submission and parse operation
 
         try:
-            submission = json.loads(submission.download_as_string().decode())
+            with logger.span('submission-download'):
+                submission = json.loads(submission.download_as_string().decode())
         except:
             return (
                 {
@@ -135,23 +139,25 @@ def abort_submission(request):
                 400
             )
 
-        signature_blob = utils.getblob(
-            'gs://{bucket}/lapdog-executions/{submission_id}/signature'.format(
-                bucket=data['bucket'],
-                submission_id=data['submission_id']
-            ),
-            credentials=session.credentials
-        )
-        if not signature_blob.exists():
-            return (
-                {
-                    'error': 'No Signature',
-                    'message': 'The submission signature could not be found. Refusing to abort job'
-                },
-                403
+        with logger.span('verify-signature'):
+            signature_blob = utils.getblob(
+                'gs://{bucket}/lapdog-executions/{submission_id}/signature'.format(
+                    bucket=data['bucket'],
+                    submission_id=data['submission_id']
+                ),
+                credentials=session.credentials
             )
+            if not signature_blob.exists():
+                return (
+                    {
+                        'error': 'No Signature',
+                        'message': 'The submission signature could not be found. Refusing to abort job'
+                    },
+                    403
+                )
+            verified = utils.verify_signature(signature_blob, (data['submission_id'] + submission['operation']).encode())
 
-        if not utils.verify_signature(signature_blob, (data['submission_id'] + submission['operation']).encode()):
+        if not verified:
             return (
                 {
                     'error': 'Invalid Signature',
@@ -169,17 +175,18 @@ def abort_submission(request):
             data=data['submission_id']
         )
 
-        utils.sign_object(
-            data['submission_id'].encode(),
-            utils.getblob(
-                'gs://{bucket}/lapdog-executions/{submission_id}/abort-key'.format(
-                    bucket=data['bucket'],
-                    submission_id=data['submission_id']
+        with logger.span('signing'):
+            utils.sign_object(
+                data['submission_id'].encode(),
+                utils.getblob(
+                    'gs://{bucket}/lapdog-executions/{submission_id}/abort-key'.format(
+                        bucket=data['bucket'],
+                        submission_id=data['submission_id']
+                    ),
+                    credentials=session.credentials
                 ),
-                credentials=session.credentials
-            ),
-            core_session.credentials
-        )
+                core_session.credentials
+            )
 
         if 'hard' in data and data['hard']:
             # 6) Abort operation
@@ -189,11 +196,12 @@ def abort_submission(request):
                 operation_id=submission['operation'],
                 severity='NOTICE'
             )
-            response = core_session.post(
-                "https://genomics.googleapis.com/v2alpha1/{operation}:cancel".format(
-                    operation=quote(submission['operation']) # Do not quote slashes here
+            with logger.span('pipeline'):
+                response = core_session.post(
+                    "https://genomics.googleapis.com/v2alpha1/{operation}:cancel".format(
+                        operation=quote(submission['operation']) # Do not quote slashes here
+                    )
                 )
-            )
 
             return response.text, response.status_code
         return (
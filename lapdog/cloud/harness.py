@@ -0,0 +1,860 @@
+"""
+Local harness for the Lapdog cloud functions. This module is never deployed.
+
+Serves create_submission, abort_submission, register, quotas, and insert_resolution
+from a local Flask app. Each function is loaded with its own copy of utils, as
+it would be in a deployed instance. GCS is backed by a local directory, and KMS,
+IAM, tokeninfo, Firecloud, Compute, and the Life Sciences API are answered in memory.
+Every call to a stand-in is counted.
+
+python -m lapdog.cloud.harness serve
+    Serves the functions at http://localhost:4202/<function>
+python -m lapdog.cloud.harness bench -n 200 -c 8
+    Reports cold latency, warm p50/p95/p99 latency, and upstream calls per
+    request for each function
+"""
+import os
+import sys
+import re
+import json
+import time
+import math
+import base64
+import shutil
+import argparse
+import tempfile
+import threading
+import importlib.util
+from types import SimpleNamespace
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256, sha512
+from urllib.parse import urlparse, parse_qs, unquote
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from google.api_core.exceptions import NotFound
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa, padding, utils as crypto_utils
+from flask import Flask, request as flask_request
+from . import __FUNCTION_MAPPING__
+from .utils import ld_acct_in_project, ld_meta_bucket_for_project, OAUTH_CLIENT_ID
+
+HARNESS_FUNCTIONS = [
+    'create_submission',
+    'abort_submission',
+    'register',
+    'quotas',
+    'insert_resolution'
+]
+
+# Function modules import their utils as a top-level module, so loads are serialized
+_IMPORT_LOCK = threading.Lock()
+
+def _generate_key():
+    return rsa.generate_private_key(65537, 2048, default_backend())
+
+def _sign(key, data):
+    return key.sign(
+        data,
+        padding.PSS(
+            mgf=padding.MGF1(hashes.SHA256()),
+            salt_length=32
+        ),
+        crypto_utils.Prehashed(hashes.SHA256())
+    )
+
+def percentile(samples, p):
+    """
+    Nearest-rank percentile of a list of samples
+    """
+    if not len(samples):
+        return None
+    samples = sorted(samples)
+    return samples[max(0, min(len(samples), math.ceil(len(samples) * p / 100)) - 1)]
+
+## GCS stand-ins
+
+class _LocalACL(object):
+    def __init__(self, harness):
+        self.harness = harness
+
+    def all_authenticated(self):
+        return self
+
+    def user(self, email):
+        return self
+
+    def grant_read(self):
+        pass
+
+    def get_entities(self):
+        return []
+
+    def save(self):
+        self.harness.record('storage')
+
+class LocalBlob(object):
+    """
+    Stands in for a GCS blob. Objects are stored as files under the harness storage directory
+    """
+
+    def __init__(self, harness, bucket, name):
+        self.harness = harness
+        self.bucket_name = bucket
+        self.name = name
+        self.size = None
+
+    @property
+    def path(self):
+        return os.path.join(self.harness.storage_dir, self.bucket_name, self.name)
+
+    @property
+    def acl(self):
+        return _LocalACL(self.harness)
+
+    def exists(self):
+        self.harness.record('storage')
+        return os.path.isfile(self.path)
+
+    def reload(self):
+        self.harness.record('storage')
+        if not os.path.isfile(self.path):
+            raise NotFound('gs://{}/{}'.format(self.bucket_name, self.name))
+        self.size = os.path.getsize(self.path)
+
+    def download_as_string(self):
+        self.harness.record('storage')
+        if not os.path.isfile(self.path):
+            raise NotFound('gs://{}/{}'.format(self.bucket_name, self.name))
+        with open(self.path, 'rb') as r:
+            return r.read()
+
+    def upload_from_string(self, data):
+        self.harness.record('storage')
+        self.harness.write_blob(self.bucket_name, self.name, data)
+
+    def delete(self):
+        self.harness.record('storage')
+        if not os.path.isfile(self.path):
+            raise NotFound('gs://{}/{}'.format(self.bucket_name, self.name))
+        os.remove(self.path)
+
+class LocalBucket(object):
+    def __init__(self, harness, name):
+        self.harness = harness
+        self.name = name
+
+    def blob(self, name):
+        return LocalBlob(self.harness, self.name, name)
+
+    def list_blobs(self, prefix=None, fields=None):
+        self.harness.record('storage')
+        root = os.path.join(self.harness.storage_dir, self.name)
+        blobs = [
+            self.blob(os.path.relpath(os.path.join(path, filename), root).replace(os.sep, '/'))
+            for path, dirs, files in os.walk(root)
+            for filename in files
+        ]
+        blobs = [blob for blob in blobs if prefix is None or blob.name.startswith(prefix)]
+        return SimpleNamespace(pages=[blobs])
+
+class LocalStorageClient(object):
+    def __init__(self, harness):
+        self.harness = harness
+
+    def bucket(self, name, user_project=None):
+        return LocalBucket(self.harness, name)
+
+## KMS and logging stand-ins
+
+class LocalKMSClient(object):
+    """
+    Stands in for the KMS client. Each key version gets its own RSA key
+    """
+
+    def __init__(self, harness, credentials=None):
+        self.harness = harness
+
+    def list_crypto_key_versions(self, name):
+        self.harness.record('kms')
+        return [SimpleNamespace(name=name+'/cryptoKeyVersions/1', state=1)]
+
+    def get_public_key(self, version):
+        self.harness.record('kms')
+        return SimpleNamespace(
+            pem=self.harness.signing_key(version).public_key().public_bytes(
+                serialization.Encoding.PEM,
+                serialization.PublicFormat.SubjectPublicKeyInfo
+            ).decode('ascii')
+        )
+
+    def asymmetric_sign(self, version, digest):
+        self.harness.record('kms')
+        return SimpleNamespace(signature=_sign(self.harness.signing_key(version), digest['sha256']))
+
+class LocalLogger(object):
+    def __init__(self, harness):
+        self.harness = harness
+
+    def log_struct(self, info, **kwargs):
+        self.harness.record('logging')
+        self.harness.logs.append(info)
+
+    def log_text(self, text, **kwargs):
+        self.harness.record('logging')
+        self.harness.logs.append(text)
+
+## HTTP stand-ins
+
+class LocalGoogleAdapter(BaseAdapter):
+    """
+    Transport adapter which answers requests to Google and Firecloud APIs from the harness
+    """
+
+    def __init__(self, harness):
+        super().__init__()
+        self.harness = harness
+
+    def send(self, request, **kwargs):
+        status, body = self.harness.route(request.method, request.url, request.headers, request.body)
+        response = requests.Response()
+        response.status_code = status
+        response.url = request.url
+        response.request = request
+        response.encoding = 'utf-8'
+        response.headers = CaseInsensitiveDict()
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+            response.headers['Content-Type'] = 'application/json'
+        response._content = body.encode() if isinstance(body, str) else body
+        return response
+
+    def close(self):
+        pass
+
+class LocalSession(requests.Session):
+    """
+    Stands in for an AuthorizedSession. Requests are answered by the harness
+    """
+
+    def __init__(self, harness, credentials=None, **kwargs):
+        super().__init__()
+        self.credentials = credentials
+        self._default_project = harness.project
+        adapter = LocalGoogleAdapter(harness)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+class _LocalRequests(object):
+    """
+    Stands in for the requests module, so module-level requests are answered by the harness
+    """
+
+    def __init__(self, session):
+        self._session = session
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+    def request(self, method, url, **kwargs):
+        return self._session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def options(self, url, **kwargs):
+        return self.request('OPTIONS', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+class _LocalCredentials(object):
+    def __init__(self, token):
+        self.token = token
+
+class _NoSleep(object):
+    """
+    Stands in for the time module in function code, skipping fixed delays
+    """
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+    def sleep(self, seconds):
+        pass
+
+class LocalHarness(object):
+    """
+    Loads cloud functions locally, with stand-ins for every Google service they use.
+    Storage is kept under storage_dir (a temporary directory by default).
+    The process environment is set up to look like a function in the given project.
+    If skip_sleep is set, fixed delays in function code (such as waiting for new
+    service account keys) are skipped.
+    A test user, workspace, bucket, and submission are created, see scenarios()
+    """
+
+    def __init__(self, storage_dir=None, project='harness-project', skip_sleep=True):
+        self._tempdir = None
+        if storage_dir is None:
+            self._tempdir = tempfile.mkdtemp(prefix='lapdog-harness-')
+            storage_dir = self._tempdir
+        self.storage_dir = storage_dir
+        self.project = project
+        self.skip_sleep = skip_sleep
+        self.calls = Counter()
+        self.logs = deque(maxlen=1000)
+        self.instances = {}
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._sessions = {}
+        os.environ['GCP_PROJECT'] = project
+        os.environ['FUNCTION_REGION'] = 'us-central1'
+        os.environ['FUNCTION_NAME'] = 'lapdog-harness'
+        os.environ['FUNCTION_IDENTITY'] = 'lapdog-functions@{}.iam.gserviceaccount.com'.format(project)
+
+        self.email = 'harness-user@example.com'
+        self.token = 'harness-user-token'
+        self.users = {self.token: self.email}
+        self.namespace = 'harness-namespace'
+        self.billing_projects = {self.namespace}
+        self.workspace = 'harness-workspace'
+        self.bucket = 'harness-bucket'
+        self.submission_id = 'harness-submission'
+        self.operation = 'projects/{}/locations/us-central1/operations/harness-operation'.format(project)
+        self.service_accounts = {ld_acct_in_project(self.email, project)}
+        self.service_account_key = self._service_account_key()
+
+        meta_bucket = ld_meta_bucket_for_project(project)
+        self.write_blob(meta_bucket, 'resolution', self.namespace)
+        self.write_blob(meta_bucket, 'regions', 'us-central1\nus-east1')
+        self.write_blob(meta_bucket, 'auth_key.json', json.dumps(self.service_account_key))
+        self.write_blob(
+            self.bucket,
+            'lapdog-executions/{}/submission.json'.format(self.submission_id),
+            json.dumps({'operation': self.operation})
+        )
+        self.write_blob(
+            self.bucket,
+            'lapdog-executions/{}/signature'.format(self.submission_id),
+            _sign(
+                self.signing_key(
+                    'projects/{}/locations/us/keyRings/lapdog/cryptoKeys/lapdog-sign/cryptoKeyVersions/1'.format(project)
+                ),
+                sha256((self.submission_id + self.operation).encode()).digest()
+            )
+        )
+
+    def close(self):
+        """
+        Removes the temporary storage directory, if one was created
+        """
+        if self._tempdir is not None:
+            shutil.rmtree(self._tempdir, ignore_errors=True)
+            self._tempdir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _service_account_key(self):
+        return {
+            'type': 'service_account',
+            'project_id': self.project,
+            'private_key_id': 'harness',
+            'private_key': _generate_key().private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption()
+            ).decode(),
+            'client_email': 'lapdog-worker@{}.iam.gserviceaccount.com'.format(self.project),
+            'client_id': '0',
+            'token_uri': 'https://oauth2.googleapis.com/token'
+        }
+
+    def record(self, service):
+        with self._lock:
+            self.calls[service] += 1
+
+    def snapshot(self):
+        """
+        Returns a copy of the upstream call counts
+        """
+        with self._lock:
+            return Counter(self.calls)
+
+    def signing_key(self, version):
+        with self._lock:
+            if version not in self._keys:
+                self._keys[version] = _generate_key()
+            return self._keys[version]
+
+    def write_blob(self, bucket, name, data):
+        path = os.path.join(self.storage_dir, bucket, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(tmp, 'wb') as w:
+            w.write(data.encode() if isinstance(data, str) else data)
+        os.replace(tmp, path)
+
+    def blob(self, gs_path, credentials=None, user_project=None):
+        if not gs_path.startswith('gs://'):
+            raise ValueError("Getblob path must start with gs://")
+        bucket, _, name = gs_path[5:].partition('/')
+        return LocalBlob(self, bucket, name)
+
+    def session(self, credentials=None, **kwargs):
+        return LocalSession(self, credentials)
+
+    def default_session(self, scopes=None):
+        # Pooled per scope set, like utils.generate_default_session
+        key = frozenset(scopes) if scopes is not None else None
+        with self._lock:
+            if key not in self._sessions:
+                self._sessions[key] = LocalSession(self, _LocalCredentials('harness-default-token'))
+            return self._sessions[key]
+
+    ## Loading functions
+
+    def load(self, function):
+        """
+        Loads a fresh (cold) instance of the given function and returns its entrypoint.
+        Any previously loaded instance of the function is replaced
+        """
+        path = os.path.dirname(__file__)
+        with _IMPORT_LOCK:
+            original = sys.modules.pop('utils', None)
+            original_path = [*sys.path]
+            try:
+                spec = importlib.util.spec_from_file_location('utils', os.path.join(path, 'utils.py'))
+                utils = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(utils)
+                self._patch_utils(utils)
+                sys.modules['utils'] = utils
+                # Loaded without a parent package, so the module imports utils
+                # as a top-level module, just like a deployed main.py
+                spec = importlib.util.spec_from_file_location(
+                    'lapdog_harness_' + function,
+                    os.path.join(path, __FUNCTION_MAPPING__[function])
+                )
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+            finally:
+                sys.path[:] = original_path
+                sys.modules.pop('utils', None)
+                if original is not None:
+                    sys.modules['utils'] = original
+        if hasattr(module, 'AuthorizedSession'):
+            module.AuthorizedSession = self.session
+        if self.skip_sleep and hasattr(module, 'time'):
+            module.time = _NoSleep()
+        self.instances[function] = getattr(module, function)
+        return self.instances[function]
+
+    def _patch_utils(self, utils):
+        utils.getblob = self.blob
+        utils._getblob_client = lambda credentials=None: LocalStorageClient(self)
+        utils.kms = SimpleNamespace(KeyManagementServiceClient=lambda credentials=None: LocalKMSClient(self, credentials))
+        utils.AuthorizedSession = self.session
+        utils.generate_default_session = self.default_session
+        utils.requests = _LocalRequests(self.session())
+        utils._logging_client = lambda project: SimpleNamespace(logger=lambda name: LocalLogger(self))
+
+    def invoke(self, function, request):
+        """
+        Calls the given function with a Flask request. Loads the function if necessary
+        """
+        if function not in self.instances:
+            self.load(function)
+        return self.instances[function](request)
+
+    ## Upstream API stand-ins
+
+    def route(self, method, url, headers, body):
+        """
+        Answers a request to an upstream API. Returns (status code, body)
+        """
+        parsed = urlparse(url)
+        target = parsed.netloc + parsed.path
+        try:
+            data = json.loads(body) if body else None
+        except (ValueError, TypeError):
+            data = None
+        for route_method, pattern, service, handler in self.routes():
+            match = re.fullmatch(pattern, target)
+            if route_method == method and match:
+                self.record(service)
+                return handler(*[unquote(group) for group in match.groups()], query=parse_qs(parsed.query), headers=headers, data=data)
+        self.record('unknown')
+        return 501, {'error': {'message': 'No harness stand-in for {} {}'.format(method, url)}}
+
+    def routes(self):
+        return [
+            ('GET', r'www\.googleapis\.com/oauth2/v1/tokeninfo', 'tokeninfo', self._tokeninfo),
+            ('GET', r'us-central1-a-graubert\.cloudfunctions\.net/ld-master-switch', 'master-switch', lambda **kwargs: (200, 'OK')),
+            ('GET', r'iam\.googleapis\.com/v1/projects/([^/]+)/serviceAccounts/([^/:]+)', 'iam', self._get_service_account),
+            ('POST', r'iam\.googleapis\.com/v1/projects/([^/]+)/serviceAccounts', 'iam', self._create_service_account),
+            ('POST', r'iam\.googleapis\.com/v1/projects/([^/]+)/serviceAccounts/([^/:]+):setIamPolicy', 'iam', lambda *args, **kwargs: (200, {})),
+            ('POST', r'iam\.googleapis\.com/v1/projects/([^/]+)/serviceAccounts/([^/:]+)/keys', 'iam', self._create_key),
+            ('POST', r'cloudresourcemanager\.googleapis\.com/v1/projects/([^/:]+):getIamPolicy', 'resourcemanager', self._get_project_policy),
+            ('POST', r'cloudresourcemanager\.googleapis\.com/v1/projects/([^/:]+):setIamPolicy', 'resourcemanager', lambda *args, **kwargs: (200, {})),
+            ('GET', r'storage\.googleapis\.com/storage/v1/b/([^/]+)/iam/testPermissions', 'storage', self._test_permissions),
+            ('GET', r'api\.firecloud\.org/api/workspaces/([^/]+)/([^/]+)', 'firecloud', self._get_workspace),
+            ('GET', r'api\.firecloud\.org/api/profile/billing', 'firecloud', self._get_billing),
+            ('POST', r'api\.firecloud\.org/register/profile', 'firecloud', lambda **kwargs: (200, {})),
+            ('GET', r'api\.firecloud\.org/api/groups', 'firecloud', lambda **kwargs: (200, [])),
+            ('POST', r'api\.firecloud\.org/api/groups/([^/]+)', 'firecloud', lambda *args, **kwargs: (201, {})),
+            ('PUT', r'api\.firecloud\.org/api/groups/([^/]+)/member/([^/]+)', 'firecloud', lambda *args, **kwargs: (204, '')),
+            ('POST', r'lifesciences\.googleapis\.com/v2beta/projects/([^/]+)/locations/([^/]+)/pipelines:run', 'lifesciences', self._run_pipeline),
+            ('POST', r'genomics\.googleapis\.com/v2alpha1/(.+):cancel', 'genomics', lambda *args, **kwargs: (200, {})),
+            ('GET', r'www\.googleapis\.com/compute/v1/projects/([^/]+)', 'compute', self._get_quotas),
+            ('GET', r'www\.googleapis\.com/compute/v1/projects/([^/]+)/regions/([^/]+)', 'compute', self._get_quotas),
+        ]
+
+    def _tokeninfo(self, query, headers, data):
+        token = query['access_token'][0] if 'access_token' in query else None
+        if token is None and 'Authorization' in headers:
+            token = headers['Authorization'][7:]
+        if token not in self.users:
+            return 400, {'error': 'invalid_token', 'error_description': 'Invalid Value'}
+        return 200, {
+            'issued_to': OAUTH_CLIENT_ID,
+            'audience': OAUTH_CLIENT_ID,
+            'email': self.users[token],
+            'verified_email': True,
+            'expires_in': 3599,
+            'scope': ' '.join([
+                'email',
+                'profile',
+                'openid',
+                'https://www.googleapis.com/auth/devstorage.read_write',
+                'https://www.googleapis.com/auth/cloud-platform'
+            ])
+        }
+
+    def _get_service_account(self, project, account, **kwargs):
+        if account in self.service_accounts:
+            return 200, {'email': account}
+        return 404, {'error': {'code': 404, 'message': 'Not Found'}}
+
+    def _create_service_account(self, project, data, **kwargs):
+        email = '{}@{}.iam.gserviceaccount.com'.format(data['accountId'], project)
+        self.service_accounts.add(email)
+        return 200, {'email': email}
+
+    def _create_key(self, project, account, **kwargs):
+        return 200, {
+            'privateKeyData': base64.b64encode(json.dumps(self.service_account_key).encode()).decode()
+        }
+
+    def _get_project_policy(self, project, **kwargs):
+        return 200, {
+            'bindings': [
+                {
+                    'role': 'roles/owner',
+                    'members': ['user:' + email for email in self.users.values()]
+                }
+            ]
+        }
+
+    def _test_permissions(self, bucket, **kwargs):
+        return 200, {
+            'permissions': [
+                'storage.objects.list',
+                'storage.objects.get',
+                'storage.objects.create',
+                'storage.objects.delete'
+            ]
+        }
+
+    def _get_workspace(self, namespace, workspace, **kwargs):
+        if namespace == self.namespace and workspace == self.workspace:
+            return 200, {'workspace': {'bucketName': self.bucket}}
+        return 404, {'message': 'Workspace not found'}
+
+    def _get_billing(self, **kwargs):
+        with self._lock:
+            return 200, [
+                {'projectName': namespace, 'role': 'Owner'}
+                for namespace in sorted(self.billing_projects)
+            ]
+
+    def _run_pipeline(self, project, region, **kwargs):
+        return 200, {'name': 'projects/{}/locations/{}/operations/harness-operation'.format(project, region)}
+
+    def _get_quotas(self, project, region=None, **kwargs):
+        return 200, {
+            'quotas': [
+                {'metric': 'CPUS', 'limit': 24.0, 'usage': 16.0},
+                {'metric': 'DISKS_TOTAL_GB', 'limit': 4096.0, 'usage': 512.0},
+                {'metric': 'IN_USE_ADDRESSES', 'limit': 8.0, 'usage': 1.0}
+            ]
+        }
+
+    def scenarios(self):
+        """
+        Returns {function: (method, json payload, headers)} for a successful request to each function.
+        insert_resolution only succeeds once per namespace, see prepare()
+        """
+        headers = {
+            'Authorization': 'Bearer ' + self.token,
+            'Content-Type': 'application/json'
+        }
+        return {
+            'create_submission': (
+                'POST',
+                {
+                    'bucket': self.bucket,
+                    'namespace': self.namespace,
+                    'workspace': self.workspace,
+                    'submission_id': self.submission_id,
+                },
+                headers
+            ),
+            'abort_submission': (
+                'DELETE',
+                {
+                    'bucket': self.bucket,
+                    'submission_id': self.submission_id,
+                },
+                headers
+            ),
+            'register': (
+                'POST',
+                {
+                    'bucket': self.bucket,
+                    'namespace': self.namespace,
+                    'workspace': self.workspace,
+                },
+                headers
+            ),
+            'quotas': ('POST', {}, headers),
+            'insert_resolution': (
+                'POST',
+                {
+                    'namespace': self.namespace,
+                    'project': self.project,
+                },
+                headers
+            ),
+        }
+
+    def prepare(self, function, worker=0):
+        """
+        Returns (method, json payload, headers) for a request to the function
+        which will succeed, even if the same request was already made.
+        insert_resolution requests use a separate namespace for each worker, and
+        that namespace's resolution is removed first. Requests from different
+        workers may run concurrently
+        """
+        method, payload, headers = self.scenarios()[function]
+        if function == 'insert_resolution':
+            namespace = '{}-{}'.format(self.namespace, worker)
+            with self._lock:
+                self.billing_projects.add(namespace)
+            path = os.path.join(self.storage_dir, 'lapdog-resolutions', sha512(namespace.encode()).hexdigest())
+            if os.path.isfile(path):
+                os.remove(path)
+            payload = {**payload, 'namespace': namespace}
+        return method, payload, headers
+
+def create_app(harness):
+    """
+    Creates a Flask app serving each harness function at /<function>.
+    Upstream call counts are available at /_harness/calls
+    """
+    app = Flask('lapdog-harness')
+
+    @app.route('/_harness/calls')
+    def calls():
+        return dict(harness.snapshot())
+
+    @app.route('/<function>', methods=['GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'])
+    def call(function):
+        if function not in HARNESS_FUNCTIONS:
+            return 'Unknown function', 404
+        return harness.invoke(function, flask_request)
+
+    return app
+
+def _timed_request(app, function, method, payload, headers):
+    client = app.test_client()
+    start = time.perf_counter()
+    response = client.open('/' + function, method=method, json=payload, headers=headers)
+    return time.perf_counter() - start, response.status_code
+
+def _timed_requests(app, harness, function, worker, n):
+    # Requests are prepared outside of the timed section
+    samples = []
+    for i in range(n):
+        method, payload, headers = harness.prepare(function, worker)
+        samples.append(_timed_request(app, function, method, payload, headers))
+    return samples
+
+def benchmark(harness, functions=None, n=100, concurrency=8):
+    """
+    Benchmarks each function against the harness.
+    Each function is loaded cold and timed on its first request, then sent n
+    requests from `concurrency` threads. Every request is prepared to succeed
+    (see LocalHarness.prepare).
+    Returns {function: report}, with latencies in seconds and upstream calls
+    per warm request, by service
+    """
+    app = create_app(harness)
+    reports = {}
+    for function in (functions if functions is not None else HARNESS_FUNCTIONS):
+        harness.load(function)
+        method, payload, headers = harness.prepare(function)
+        before = harness.snapshot()
+        cold, cold_status = _timed_request(app, function, method, payload, headers)
+        cold_calls = harness.snapshot() - before
+        before = harness.snapshot()
+        with ThreadPoolExecutor(concurrency) as executor:
+            samples = [
+                sample
+                for worker_samples in executor.map(
+                    lambda worker: _timed_requests(
+                        app,
+                        harness,
+                        function,
+                        worker,
+                        (n // concurrency) + (worker < n % concurrency)
+                    ),
+                    range(concurrency)
+                )
+                for sample in worker_samples
+            ]
+        calls = harness.snapshot() - before
+        latencies = [latency for latency, status in samples]
+        reports[function] = {
+            'cold': cold,
+            'cold_status': cold_status,
+            'cold_calls': sum(cold_calls.values()),
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'statuses': dict(Counter(status for latency, status in samples)),
+            'calls': {
+                service: count / n
+                for service, count in sorted(calls.items())
+            }
+        }
+    return reports
+
+def print_report(reports, file=sys.stdout):
+    print(
+        '{:<20}{:>10}{:>10}{:>10}{:>10}{:>12}  {}'.format(
+            'function', 'cold(ms)', 'p50(ms)', 'p95(ms)', 'p99(ms)', 'calls/req', 'statuses'
+        ),
+        file=file
+    )
+    for function, report in reports.items():
+        print(
+            '{:<20}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}{:>12.2f}  {}'.format(
+                function,
+                1000 * report['cold'],
+                1000 * report['p50'],
+                1000 * report['p95'],
+                1000 * report['p99'],
+                sum(report['calls'].values()),
+                ', '.join('{}x{}'.format(status, count) for status, count in sorted(report['statuses'].items()))
+            ),
+            file=file
+        )
+        print(
+            '{:<20}{}'.format(
+                '',
+                ', '.join('{}={:.2f}'.format(service, count) for service, count in report['calls'].items())
+            ),
+            file=file
+        )
+
+def cmd_serve(args):
+    with LocalHarness(args.storage, skip_sleep=not args.sleep) as harness:
+        for function in HARNESS_FUNCTIONS:
+            harness.load(function)
+        print("Serving", ', '.join(HARNESS_FUNCTIONS), "at http://localhost:{}/<function>".format(args.port))
+        print("Test user token:", harness.token)
+        create_app(harness).run(port=args.port, threaded=True)
+
+def cmd_bench(args):
+    for function in args.functions:
+        if function not in HARNESS_FUNCTIONS:
+            sys.exit("Unknown function: " + function)
+    with LocalHarness(args.storage, skip_sleep=not args.sleep) as harness:
+        print_report(benchmark(harness, args.functions if len(args.functions) else None, args.requests, args.concurrency))
+
+def main():
+    parser = argparse.ArgumentParser(
+        'lapdog-harness',
+        description="Local harness for the Lapdog cloud functions"
+    )
+    parser.add_argument(
+        '-s', '--storage',
+        help="Directory to store GCS objects in. Defaults to a temporary directory",
+        default=None
+    )
+    parser.add_argument(
+        '--sleep',
+        action='store_true',
+        help="Keep fixed delays in function code, instead of skipping them"
+    )
+    subparsers = parser.add_subparsers(metavar='<subcommand>')
+
+    serve_parser = subparsers.add_parser(
+        'serve',
+        help="Serve the functions from a local Flask app",
+        description="Serve the functions from a local Flask app"
+    )
+    serve_parser.set_defaults(func=cmd_serve)
+    serve_parser.add_argument(
+        '-p', '--port',
+        type=int,
+        help="Port to serve on. Default: 4202",
+        default=4202
+    )
+
+    bench_parser = subparsers.add_parser(
+        'bench',
+        help="Report latency and upstream calls for each function",
+        description="Report latency and upstream calls for each function"
+    )
+    bench_parser.set_defaults(func=cmd_bench)
+    bench_parser.add_argument(
+        'functions',
+        nargs='*',
+        help="Functions to benchmark ({}). Default: all".format(', '.join(HARNESS_FUNCTIONS)),
+        default=[]
+    )
+    bench_parser.add_argument(
+        '-n', '--requests',
+        type=int,
+        help="Number of warm requests per function. Default: 100",
+        default=100
+    )
+    bench_parser.add_argument(
+        '-c', '--concurrency',
+        type=int,
+        help="Number of concurrent requests. Default: 8",
+        default=8
+    )
+
+    args = parser.parse_args()
+    try:
+        func = args.func
+    except AttributeError:
+        parser.print_usage()
+        sys.exit("You must provide a valid subcommand")
+    func(args)
+
+if __name__ == '__main__':
+    main()
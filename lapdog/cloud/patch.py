@@ -14,6 +14,7 @@ from .. import __version__
 from ..gateway import resolve_project_for_namespace, CORE_PERMISSIONS, FUNCTIONS_PERMISSIONS, ADMIN_PERMISSIONS, PET_PERMISSIONS, USER_PERMISSIONS, LAPDOG_SERVICES
 from ..lapdog import WorkspaceManager
 from dalmatian import getblob
+from agutil.parallel import parallelize
 import sys
 import crayons
 import traceback
@@ -60,6 +61,9 @@ __REDACTIONS=[
     'update-v3'
 ]
 
+# Cloud functions are deployed concurrently, up to this many at a time
+DEPLOY_WORKERS = 4
+
 __ENDPOINTS__ = {
     'submit': 'create_submission',
     'abort': 'abort_submission',
@@ -305,9 +309,11 @@ def __project_admin_apply_patch(namespace):
         }
     if len(deployments):
         print("Deploying", len(deployments), "functions")
-        for func, ver in deployments.items():
-            print("Deploying endpoint", func, ver)
-            _deploy(__ENDPOINTS__[func], func, functions_account, project)
+        deploy_all(
+            [(__ENDPOINTS__[func], func, ver) for func, ver in deployments.items()],
+            functions_account,
+            project
+        )
     else:
         print(crayons.green("No updates"))
     print(crayons.normal("Phase 7/7:", bold=True), "Redact Insecure Cloud API Endpoints")
@@ -327,8 +333,37 @@ def __project_admin_apply_patch(namespace):
     print(crayons.normal("%d insecure endpoints detected"%len(redactions), bold=True))
     for redaction in redactions:
         print(crayons.red("Redacting "+redaction))
-        endpoint, version = redaction.split('-')
-        _deploy('redacted', endpoint, functions_account, project, version)
+    deploy_all(
+        [('redacted', *redaction.split('-')) for redaction in redactions],
+        functions_account,
+        project
+    )
+
+def deploy_all(deployments, service_account, project):
+    """
+    Deploys a list of (function, endpoint, version) cloud functions concurrently.
+    Prints the status of each deployment once all have finished.
+    Raises a ValueError if any deployment failed
+    """
+    @parallelize(DEPLOY_WORKERS)
+    def deploy(function, endpoint, version):
+        try:
+            _deploy(function, endpoint, service_account, project, version)
+        except:
+            return traceback.format_exc()
+
+    if not len(deployments):
+        return
+    errors = [*deploy(*zip(*deployments))]
+    for (function, endpoint, version), error in zip(deployments, errors):
+        if error is None:
+            print(crayons.green("Deployed {}-{}".format(endpoint, version)), '({})'.format(function))
+        else:
+            print(crayons.red("Failed to deploy {}-{}".format(endpoint, version)), '({})'.format(function))
+            print(error, file=sys.stderr)
+    failures = sum(error is not None for error in errors)
+    if failures:
+        raise ValueError("{} of {} cloud function deployments failed".format(failures, len(deployments)))
 
 def patch_role(session, url, title, permissions):
     url = "{}/{}".format(url, title)
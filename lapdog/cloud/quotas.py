@@ -6,6 +6,57 @@ except ImportError:
     sys.path.append(os.path.dirname(__file__))
     import utils
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+def _fetch_quotas(session, project, region=None):
+    """
+    Fetches quota usage for the project, or one of its regions.
+    Returns (quotas, error message)
+    """
+    url = 'https://www.googleapis.com/compute/v1/projects/{project}'.format(project=project)
+    if region is not None:
+        url += '/regions/{region}'.format(region=region)
+    try:
+        response = session.get(url)
+        if response.status_code != 200:
+            return [], '(%d) : %s' % (
+                response.status_code,
+                response.text
+            )
+        return [
+            {
+                **quota,
+                **{
+                    'percent':  ('%0.2f%%' % (100 * quota['usage'] / quota['limit'])) if quota['limit'] > 0 else '0.00%'
+                },
+                **({'metric': region+'.'+quota['metric']} if region is not None else {})
+            }
+            for quota in response.json()['quotas']
+        ], None
+    except:
+        return [], traceback.format_exc()
+
+@utils.instance_cache(30)
+def collect_quotas(project):
+    """
+    Fetches project and regional quota usage. Regions are queried concurrently.
+    Returns (quotas, {region: error message}). Project errors are keyed as 'global'.
+    Cached for 30s. Callers should invalidate the cache if there were any errors
+    """
+    session = utils.generate_default_session(scopes=['https://www.googleapis.com/auth/cloud-platform'])
+    regions = [None] + list(utils.enabled_regions())
+    with ThreadPoolExecutor(min(len(regions), 16)) as executor:
+        results = list(executor.map(
+            lambda region: _fetch_quotas(session, project, region),
+            regions
+        ))
+    quotas = []
+    errors = {}
+    for region, (region_quotas, error) in zip(regions, results):
+        quotas += region_quotas
+        if error is not None:
+            errors['global' if region is None else region] = error
+    return quotas, errors
 
 @utils.cors('POST')
 def quotas(request):
@@ -26,7 +77,8 @@ def quotas(request):
                 400
             )
 
-        token_info = utils.get_token_info(token)
+        with logger.span('token'):
+            token_info = utils.get_token_info(token)
         if 'error' in token_info:
             return (
                 {
@@ -49,7 +101,8 @@ def quotas(request):
         # 2) Check service account
         default_session = utils.generate_default_session(scopes=['https://www.googleapis.com/auth/cloud-platform'])
         account_email = utils.ld_acct_in_project(token_info['email'])
-        response = utils.query_service_account(default_session, account_email)
+        with logger.span('service-account'):
+            response = utils.query_service_account(default_session, account_email)
         if response.status_code >= 400:
             return (
                 {
@@ -68,63 +121,24 @@ def quotas(request):
             )
 
         # 3) Query quota usage
-        project_usage = default_session.get(
-            'https://www.googleapis.com/compute/v1/projects/{project}'.format(
-                project=os.environ.get('GCP_PROJECT')
-            )
-        )
-        if project_usage.status_code != 200:
+        with logger.span('quotas'):
+            quotas, errors = collect_quotas(os.environ.get('GCP_PROJECT'))
+        if len(errors):
+            # Only complete results are reused by later requests
+            collect_quotas.invalidate()
+        if 'global' in errors:
             return (
                 {
                     'error': 'Invalid response from Google',
-                    'message': '(%d) : %s' % (
-                        project_usage.status_code,
-                        project_usage.text
-                    )
+                    'message': errors['global']
                 },
                 400
             )
-        quotas = [
-            {
-                **quota,
-                **{
-                    'percent':  ('%0.2f%%' % (100 * quota['usage'] / quota['limit'])) if quota['limit'] > 0 else '0.00%'
-                }
-            }
-            for quota in project_usage.json()['quotas']
-        ]
-        for region_name in utils.enabled_regions():
-            region_usage = default_session.get(
-                'https://www.googleapis.com/compute/v1/projects/{project}/regions/{region}'.format(
-                    project=os.environ.get('GCP_PROJECT'),
-                    region=region_name
-                )
-            )
-            if region_usage.status_code != 200:
-                return (
-                    {
-                        'error': 'Invalid response from Google',
-                        'message': '(%d) : %s' % (
-                            region_usage.status_code,
-                            region_usage.text
-                        )
-                    },
-                    400
-                    )
-            quotas += [
-                {
-                    **quota,
-                    **{
-                        'percent':  ('%0.2f%%' % (100 * quota['usage'] / quota['limit'])) if quota['limit'] > 0 else '0.00%',
-                        'metric': region_name+'.'+quota['metric']
-                    }
-                }
-                for quota in region_usage.json()['quotas']
-            ]
         return (
             {
                 'raw': quotas,
-                'alerts': [quota for quota in quotas if quota['limit'] > 0 and quota['usage']/quota['limit'] >= 0.5]
+                'alerts': [quota for quota in quotas if quota['limit'] > 0 and quota['usage']/quota['limit'] >= 0.5],
+                'errors': errors
             },
             200
         )
@@ -42,7 +42,8 @@ def register(request):
                 400
             )
 
-        token_info = utils.get_token_info(token)
+        with logger.span('token'):
+            token_info = utils.get_token_info(token)
         if 'error' in token_info:
             return (
                 {
@@ -89,7 +90,8 @@ def register(request):
                 severity='DEBUG'
             )
 
-        read, write = utils.validate_permissions(session, data['bucket'])
+        with logger.span('permissions'):
+            read, write = utils.validate_permissions(session, data['bucket'], token_info['email'])
         if read is None:
             # Error, write will contain a message
             return (
@@ -119,11 +121,12 @@ def register(request):
                 },
                 400
             )
-        core_session = utils.generate_core_session()
+        with logger.span('bucket-signature'):
+            core_session = utils.generate_core_session()
 
-        result, message = utils.authenticate_bucket(
-            data['bucket'], data['namespace'], data['workspace'], fc_auth if fc_auth is not None else session, core_session
-        )
+            result, message = utils.authenticate_bucket(
+                data['bucket'], data['namespace'], data['workspace'], fc_auth if fc_auth is not None else session, core_session, token_info['email']
+            )
         if not result:
             return (
                 {
@@ -138,7 +141,8 @@ def register(request):
 
         default_session = utils.generate_default_session(scopes=['https://www.googleapis.com/auth/cloud-platform'])
         account_email = utils.ld_acct_in_project(token_info['email'])
-        response = utils.query_service_account(default_session, account_email)
+        with logger.span('service-account'):
+            response = utils.query_service_account(default_session, account_email)
         if response.status_code == 404:
             account_name = account_email.split('@')[0]
             logger.log(
@@ -238,13 +242,14 @@ def register(request):
             severity="INFO"
         )
 
-        status, response = utils.update_iam_policy(
-            default_session,
-            {
-                'serviceAccount:'+account_email: 'Pet_account',
-                'user:'+token_info['email']: 'Lapdog_user'
-            }
-        )
+        with logger.span('project-bindings'):
+            status, response = utils.update_iam_policy(
+                default_session,
+                {
+                    'serviceAccount:'+account_email: 'Pet_account',
+                    'user:'+token_info['email']: 'Lapdog_user'
+                }
+            )
 
         if not status:
             return (
@@ -262,12 +267,13 @@ def register(request):
             service_account=account_email
         )
 
-        response = default_session.post(
-            'https://iam.googleapis.com/v1/projects/{project}/serviceAccounts/{email}/keys'.format(
-                project=os.environ.get('GCP_PROJECT'),
-                email=quote(account_email)
+        with logger.span('account-key'):
+            response = default_session.post(
+                'https://iam.googleapis.com/v1/projects/{project}/serviceAccounts/{email}/keys'.format(
+                    project=os.environ.get('GCP_PROJECT'),
+                    email=quote(account_email)
+                )
             )
-        )
         if response.status_code >= 400:
             return (
                 {
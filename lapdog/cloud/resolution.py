@@ -32,7 +32,8 @@ def insert_resolution(request):
 
         token = utils.extract_token(request.headers, data)
 
-        token_info = utils.get_token_info(token)
+        with logger.span('token'):
+            token_info = utils.get_token_info(token)
         if 'error' in token_info:
             return (
                 {
@@ -63,23 +64,24 @@ def insert_resolution(request):
 
         user_session = utils.generate_user_session(token)
 
-        while True:
-            response = user_session.get(
-                'https://api.firecloud.org/api/profile/billing'
-            )
-
-            if response.status_code == 200:
-                break
-            print(response.status_code, response.text, file=sys.stderr)
-            if response.status_code == 404:
-                return (
-                    {
-                        'error': "User not found",
-                        'message': "You are not registered yet with firecloud"
-                    },
-                    404
+        with logger.span('billing-projects'):
+            while True:
+                response = user_session.get(
+                    'https://api.firecloud.org/api/profile/billing'
                 )
-            time.sleep(5)
+
+                if response.status_code == 200:
+                    break
+                print(response.status_code, response.text, file=sys.stderr)
+                if response.status_code == 404:
+                    return (
+                        {
+                            'error': "User not found",
+                            'message': "You are not registered yet with firecloud"
+                        },
+                        404
+                    )
+                time.sleep(5)
 
 
         projects = {proj['projectName']:proj for proj in response.json()}
@@ -110,11 +112,12 @@ def insert_resolution(request):
                 400
             )
 
-        response = user_session.post(
-            'https://cloudresourcemanager.googleapis.com/v1/projects/{project}:getIamPolicy'.format(
-                project=data['project']
+        with logger.span('project-policy'):
+            response = user_session.post(
+                'https://cloudresourcemanager.googleapis.com/v1/projects/{project}:getIamPolicy'.format(
+                    project=data['project']
+                )
             )
-        )
 
         if response.status_code == 403:
             return (
@@ -38,7 +38,8 @@ def create_submission(request):
                 400
             )
 
-        token_info = utils.get_token_info(token)
+        with logger.span('token'):
+            token_info = utils.get_token_info(token)
         if 'error' in token_info:
             return (
                 {
@@ -59,10 +60,11 @@ def create_submission(request):
             )
 
         # 1.b) Verify the user has a pet account
-        response = utils.query_service_account(
-            utils.generate_default_session(scopes=['https://www.googleapis.com/auth/cloud-platform']),
-            utils.ld_acct_in_project(token_info['email'])
-        )
+        with logger.span('service-account'):
+            response = utils.query_service_account(
+                utils.generate_default_session(scopes=['https://www.googleapis.com/auth/cloud-platform']),
+                utils.ld_acct_in_project(token_info['email'])
+            )
         if response.status_code != 200:
             return (
                 {
@@ -94,7 +96,8 @@ def create_submission(request):
                 severity='DEBUG'
             )
 
-        read, write = utils.validate_permissions(session, data['bucket'])
+        with logger.span('permissions'):
+            read, write = utils.validate_permissions(session, data['bucket'], token_info['email'])
         if read is None:
             # Error, write will contain a message
             return (
@@ -124,11 +127,12 @@ def create_submission(request):
                 },
                 400
             )
-        core_session = utils.generate_core_session()
+        with logger.span('bucket-signature'):
+            core_session = utils.generate_core_session()
 
-        result, message = utils.authenticate_bucket(
-            data['bucket'], data['namespace'], data['workspace'], fc_auth if fc_auth is not None else session, core_session
-        )
+            result, message = utils.authenticate_bucket(
+                data['bucket'], data['namespace'], data['workspace'], fc_auth if fc_auth is not None else session, core_session, token_info['email']
+            )
         if not result:
             return (
                 {
@@ -154,9 +158,10 @@ def create_submission(request):
                 400
             )
 
-        submission = utils.fetch_submission_blob(session, data['bucket'], data['submission_id'])
+        with logger.span('submission-file'):
+            submission = utils.fetch_submission_blob(session, data['bucket'], data['submission_id'])
 
-        result, message = utils.validate_submission_file(submission)
+            result, message = utils.validate_submission_file(submission)
         if not result:
             return (
                 {
@@ -283,19 +288,20 @@ def create_submission(request):
             url=papi_url,
             severity='NOTICE'
         )
-        response = utils.generate_default_session(
-            [
-                "https://www.googleapis.com/auth/cloud-platform",
-                "https://www.googleapis.com/auth/compute",
-                "https://www.googleapis.com/auth/genomics"
-            ]
-        ).post(
-            papi_url,
-            headers={
-                'Content-Type': 'application/json'
-            },
-            json=pipeline
-        )
+        with logger.span('pipeline'):
+            response = utils.generate_default_session(
+                [
+                    "https://www.googleapis.com/auth/cloud-platform",
+                    "https://www.googleapis.com/auth/compute",
+                    "https://www.googleapis.com/auth/genomics"
+                ]
+            ).post(
+                papi_url,
+                headers={
+                    'Content-Type': 'application/json'
+                },
+                json=pipeline
+            )
         try:
             if response.status_code == 200:
                 operation = response.json()['name']
@@ -307,17 +313,18 @@ def create_submission(request):
                     data=(data['submission_id'] + operation)
                 )
 
-                utils.sign_object(
-                    (data['submission_id'] + operation).encode(),
-                    utils.getblob(
-                        'gs://{bucket}/lapdog-executions/{submission_id}/signature'.format(
-                            bucket=data['bucket'],
-                            submission_id=data['submission_id']
+                with logger.span('signing'):
+                    utils.sign_object(
+                        (data['submission_id'] + operation).encode(),
+                        utils.getblob(
+                            'gs://{bucket}/lapdog-executions/{submission_id}/signature'.format(
+                                bucket=data['bucket'],
+                                submission_id=data['submission_id']
+                            ),
+                            credentials=session.credentials
                         ),
-                        credentials=session.credentials
-                    ),
-                    core_session.credentials
-                )
+                        core_session.credentials
+                    )
 
                 return operation, 200
         except:
@@ -1,7 +1,8 @@
 from google.cloud import kms_v1 as kms, storage, logging
 import google.auth
+import google.api_core.exceptions
 from google.cloud.logging.resource import Resource as LogResource
-from google.auth.transport.requests import AuthorizedSession
+from google.auth.transport.requests import AuthorizedSession, Request
 import google.oauth2.service_account
 import google.oauth2.credentials
 from cryptography.hazmat.primitives import hashes, serialization
@@ -9,16 +10,21 @@ from cryptography.exceptions import InvalidSignature
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.asymmetric import ec, padding, utils
 import requests
+from requests.adapters import HTTPAdapter
 from hashlib import md5, sha256
 import os
 import json
 from urllib.parse import quote
 import time
+import threading
+import datetime
 from functools import lru_cache, wraps
+from contextlib import contextmanager
+from collections import OrderedDict
 import traceback
 
 __API_VERSION__ = {
-    'submit': 'v11',
+    'submit': 'v12',
     'abort': 'v3',
     'register': 'v6',
     'signature': 'v3',
@@ -39,7 +45,7 @@ __API_VERSION__ = {
 # This function will deploy new cloud functions and run any other arbitrary code
 # Such as updating iam policy bindings or role permissions
 
-__CROMWELL_TAG__ = 'v0.17.0'
+__CROMWELL_TAG__ = 'v0.18.0'
 
 GCP_ZONES = {
     'asia-east1':	('a', 'b', 'c'),
@@ -67,6 +73,96 @@ UPDATE_IMAGE_TAG = 'v1'
 
 OAUTH_CLIENT_ID = '1057449931000-0mn07vdb6u3nhrvjkvr80qqbri0pvq7o.apps.googleusercontent.com'
 AUTHENTICATION_URL = 'https://us-central1-broad-cga-aarong-gtex.cloudfunctions.net/oauth-{}'.format(__API_VERSION__['oauth'])
+MASTER_SWITCH_URL = "https://us-central1-a-graubert.cloudfunctions.net/ld-master-switch"
+
+def instance_cache(ttl):
+    """
+    Caches the results of the decorated function for ttl seconds, keyed by its arguments.
+    Cloud function instances are reused between requests, so warm invocations
+    skip the work until the value expires.
+    Call func.invalidate() to drop all cached values early
+    """
+    def wrapper(func):
+        cache = {}
+        lock = threading.Lock()
+
+        @wraps(func)
+        def call(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            with lock:
+                if key in cache and time.monotonic() - cache[key][0] < ttl:
+                    return cache[key][1]
+            result = func(*args, **kwargs)
+            with lock:
+                cache[key] = (time.monotonic(), result)
+            return result
+
+        def invalidate():
+            with lock:
+                cache.clear()
+
+        call.invalidate = invalidate
+        return call
+    return wrapper
+
+class DecisionCache(object):
+    """
+    Bounded cache of positive authorization decisions, kept between requests
+    by warm function instances.
+    Entries expire after ttl seconds, and only the newest size entries are kept.
+    Never store negative decisions, so that newly granted access is seen
+    immediately and failures are always rechecked
+    """
+
+    def __init__(self, ttl=60, size=1024):
+        self.ttl = ttl
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the cached decision for the key, or None
+        """
+        with self.lock:
+            if key in self.entries:
+                timestamp, value = self.entries[key]
+                if time.monotonic() - timestamp < self.ttl:
+                    return value
+                del self.entries[key]
+        return None
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+# Positive decisions about users, buckets, and service accounts. Keys are prefixed by check type
+DECISION_CACHE = DecisionCache(60)
+
+@instance_cache(30)
+def master_switch_enabled():
+    """
+    Checks that the Lapdog Master Switch is on.
+    Cached for 30s, so disabling the switch takes effect within 30s.
+    A disabled result is never reused (see cors), so a transient failure
+    doesn't lock out the function instance
+    """
+    try:
+        response = requests.get(MASTER_SWITCH_URL, timeout=10)
+        return response.status_code == 200 and response.text == "OK"
+    except requests.RequestException:
+        traceback.print_exc()
+        return False
+
+# Tracks the CloudLogger of the request being handled by this thread
+_REQUEST_STATE = threading.local()
 
 def cors(*methods):
     """
@@ -94,8 +190,8 @@ def cors(*methods):
                 return ('Not allowed', 405, {'Allow': ', '.join(methods)})
             elif 'Origin' in request.headers and not request.headers['Origin'].startswith('http://localhost'):
                 return ('Forbidden', 403)
-            response = requests.get("https://us-central1-a-graubert.cloudfunctions.net/ld-master-switch")
-            if response.status_code != 200 or response.text != "OK":
+            if not master_switch_enabled():
+                master_switch_enabled.invalidate()
                 return (
                     (
                         "The Lapdog Master Switch has been disabled."
@@ -105,7 +201,17 @@ def cors(*methods):
                     ),
                     510
                 )
-            result = list(func(request))
+            _REQUEST_STATE.logger = None
+            status = 500
+            try:
+                result = list(func(request))
+                status = result[1] if len(result) > 1 else 200
+            finally:
+                # The request's CloudLogger (if any) emits one timing entry for all its spans
+                logger = getattr(_REQUEST_STATE, 'logger', None)
+                _REQUEST_STATE.logger = None
+                if logger is not None:
+                    logger.log_spans(status)
             if isinstance(result[0], dict):
                 result[0] = json.dumps(result[0])
             return tuple(result)
@@ -225,13 +331,96 @@ def generate_user_session(token):
         google.oauth2.credentials.Credentials(token)
     )
 
-def generate_default_session(scopes=None):
-    credentials, project = google.auth.default(scopes=scopes)
-    session = AuthorizedSession(credentials)
-    session._default_project = project
-    return session
+# Default sessions are shared process-wide, keyed by their scope set
+# Each holds a connection pool large enough for our parallel workers
+SESSION_POOL_SIZE = 32
+# Credentials are refreshed this many seconds before they expire
+SESSION_REFRESH_MARGIN = 300
+_SESSION_POOL = {}
+_SESSION_POOL_LOCK = threading.Lock()
+_SESSION_REFRESHER = None
+
+def _in_cloud_function():
+    # Set by the cloud functions runtime (and the local harness)
+    return 'FUNCTION_NAME' in os.environ or 'FUNCTION_TARGET' in os.environ
+
+def _serialize_refresh(credentials):
+    """
+    Wraps the refresh method of shared credentials with a lock, so that request
+    threads and the background refresher never refresh them concurrently.
+    A refresh which had to wait for another one to finish is skipped
+    """
+    lock = threading.Lock()
+    refresh = credentials.refresh
+    refreshes = [0]
 
+    def locked_refresh(request):
+        seen = refreshes[0]
+        with lock:
+            if refreshes[0] == seen:
+                refresh(request)
+                refreshes[0] += 1
+
+    credentials.refresh = locked_refresh
+    return credentials
+
+def _refresh_sessions():
+    """
+    Background loop which refreshes pooled credentials shortly before they expire,
+    so requests don't stall on a token refresh
+    """
+    request = Request()
+    while True:
+        with _SESSION_POOL_LOCK:
+            sessions = [*_SESSION_POOL.values()]
+        delay = 60
+        for session in sessions:
+            credentials = session.credentials
+            try:
+                if credentials.expiry is None and credentials.token is not None:
+                    # Credentials which never expire
+                    continue
+                if credentials.expiry is not None:
+                    remaining = (credentials.expiry - datetime.datetime.utcnow()).total_seconds() - SESSION_REFRESH_MARGIN
+                    if remaining > 0:
+                        delay = min(delay, remaining)
+                        continue
+                credentials.refresh(request)
+            except:
+                traceback.print_exc()
+        time.sleep(max(delay, 5))
+
+def generate_default_session(scopes=None):
+    """
+    Returns an AuthorizedSession for the application default credentials.
+    Sessions are pooled per scope set, so connections and credentials are
+    reused across calls. Do not close the returned session.
+    Outside of cloud functions, credentials are refreshed in the background
+    before they expire. Function instances refresh them when a request needs it
+    """
+    global _SESSION_REFRESHER
+    key = frozenset(scopes) if scopes is not None else None
+    with _SESSION_POOL_LOCK:
+        if key not in _SESSION_POOL:
+            credentials, project = google.auth.default(scopes=scopes)
+            session = AuthorizedSession(_serialize_refresh(credentials))
+            adapter = HTTPAdapter(pool_connections=SESSION_POOL_SIZE, pool_maxsize=SESSION_POOL_SIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session._default_project = project
+            _SESSION_POOL[key] = session
+        if _SESSION_REFRESHER is None and not _in_cloud_function():
+            _SESSION_REFRESHER = threading.Thread(target=_refresh_sessions, name='lapdog-session-refresh', daemon=True)
+            _SESSION_REFRESHER.start()
+        return _SESSION_POOL[key]
+
+@instance_cache(300)
 def generate_core_session():
+    """
+    Returns an AuthorizedSession for the lapdog-worker core service account.
+    Cached for 5 minutes, so a rotated auth_key.json is picked up within 5 minutes.
+    Call generate_core_session.invalidate() if the session is rejected
+    """
     ld_project = os.environ.get('GCP_PROJECT')
     account = 'lapdog-worker@{}.iam.gserviceaccount.com'.format(ld_project)
     t = int(time.time())
@@ -248,10 +437,21 @@ def generate_core_session():
         ])
     )
 
-def authenticate_bucket(bucket, namespace, workspace, session, core_session):
+def authenticate_bucket(bucket, namespace, workspace, session, core_session, account=None):
     """
-    Used internally to authenticate a bucket for lapdog use
+    Used internally to authenticate a bucket for lapdog use.
+    If the requesting account is provided, successful checks are cached briefly
     """
+    key = ('signature', account, namespace, workspace, bucket)
+    result = DECISION_CACHE.get(key) if account is not None else None
+    if result is not None:
+        return result
+    result = _authenticate_bucket(bucket, namespace, workspace, session, core_session)
+    if account is not None and result[0]:
+        DECISION_CACHE.put(key, result)
+    return result
+
+def _authenticate_bucket(bucket, namespace, workspace, session, core_session):
     workspace_blob = getblob(
         'gs://{bucket}/DO_NOT_DELETE_LAPDOG_WORKSPACE_SIGNATURE'.format(
             bucket=bucket
@@ -296,20 +496,52 @@ def authenticate_bucket(bucket, namespace, workspace, session, core_session):
         'Workspace authentication token had an invalid signature'
     )
 
-def get_crypto_keys(name, credentials):
+@lru_cache()
+def _kms_client(credentials):
+    return kms.KeyManagementServiceClient(credentials=credentials)
+
+@instance_cache(600)
+def _enabled_key_versions(name, credentials):
     return sorted(
-        (key.name for key in kms.KeyManagementServiceClient(credentials=credentials).list_crypto_key_versions(name) if key.state == 1),
+        (key.name for key in _kms_client(credentials).list_crypto_key_versions(name) if key.state == 1),
         key=lambda name:int(name.split('/')[-1]),
         reverse=True
     )
 
+def get_crypto_keys(name, credentials, refresh=False):
+    """
+    Lists the enabled versions of a KMS key, newest first.
+    The list is cached for 10 minutes, unless refresh is set
+    """
+    if refresh:
+        _enabled_key_versions.invalidate()
+    return _enabled_key_versions(name, credentials)
+
+@lru_cache(maxsize=64)
+def _get_public_key(version):
+    """
+    Downloads and parses the public key of a KMS key version.
+    Key versions never change, so these are kept for the life of the instance
+    """
+    return serialization.load_pem_public_key(
+        _kms_client(None).get_public_key(version).pem.encode('ascii'),
+        default_backend()
+    )
+
 def _get_signature(data, keypath, credentials):
-    return kms.KeyManagementServiceClient(
-        credentials=credentials
-    ).asymmetric_sign(
-        get_crypto_keys(keypath, credentials)[0],
-        {'sha256': sha256(data).digest()}
-    ).signature
+    digest = {'sha256': sha256(data).digest()}
+    try:
+        return _kms_client(credentials).asymmetric_sign(
+            get_crypto_keys(keypath, credentials)[0],
+            digest
+        ).signature
+    except (google.api_core.exceptions.GoogleAPICallError, IndexError):
+        # The cached newest version may have been disabled or destroyed since
+        # the list was fetched. Retry once with a fresh list
+        return _kms_client(credentials).asymmetric_sign(
+            get_crypto_keys(keypath, credentials, refresh=True)[0],
+            digest
+        ).signature
 
 def sign_object(data, blob, credentials, keypath=None):
     if keypath is None:
@@ -321,26 +553,47 @@ def verify_signature(blob, data, keypath=None, credentials=None, _is_blob=True):
         keypath = 'projects/{ld_project}/locations/us/keyRings/lapdog/cryptoKeys/lapdog-sign'.format(ld_project=os.environ.get('GCP_PROJECT'))
     if credentials is None:
         credentials = generate_default_session().credentials
-    for key in get_crypto_keys(keypath, credentials):
-        try:
-            serialization.load_pem_public_key(
-                kms.KeyManagementServiceClient().get_public_key(key).pem.encode('ascii'),
-                default_backend()
-            ).verify(
-                blob.download_as_string() if _is_blob else blob,
-                sha256(data).digest(),
-                padding.PSS(
-                    mgf=padding.MGF1(hashes.SHA256()),
-                    salt_length=32
-                ),
-                utils.Prehashed(hashes.SHA256())
-            )
-            return True
-        except InvalidSignature:
-            pass
+    signature = blob.download_as_string() if _is_blob else blob
+    digest = sha256(data).digest()
+    checked = set()
+    # Try the cached key versions (newest first), then refresh the list in case
+    # the signature came from a version we haven't seen yet
+    for refresh in (False, True):
+        for key in get_crypto_keys(keypath, credentials, refresh=refresh):
+            if key in checked:
+                continue
+            checked.add(key)
+            try:
+                _get_public_key(key).verify(
+                    signature,
+                    digest,
+                    padding.PSS(
+                        mgf=padding.MGF1(hashes.SHA256()),
+                        salt_length=32
+                    ),
+                    utils.Prehashed(hashes.SHA256())
+                )
+                return True
+            except InvalidSignature:
+                pass
     return False
 
-def validate_permissions(session, bucket):
+def validate_permissions(session, bucket, account=None):
+    """
+    Checks that the session can read and write to the bucket.
+    Returns (read, write), or (None, message) if the check could not be made.
+    If the session's account is provided, full permissions are cached briefly
+    """
+    key = ('permissions', account, bucket)
+    result = DECISION_CACHE.get(key) if account is not None else None
+    if result is not None:
+        return result
+    result = _validate_permissions(session, bucket)
+    if account is not None and result == (True, True):
+        DECISION_CACHE.put(key, result)
+    return result
+
+def _validate_permissions(session, bucket):
     try:
         response = session.get(
             "https://storage.googleapis.com/storage/v1/b/{bucket}"
@@ -416,12 +669,22 @@ def check_user_service_account(account, session=None):
     return None
 
 def query_service_account(session, account):
-    return session.get(
-        'https://iam.googleapis.com/v1/projects/{project}/serviceAccounts/{account}'.format(
-            project=os.environ.get('GCP_PROJECT'),
-            account=quote(account)
+    """
+    Fetches a service account in this project.
+    Responses for existing accounts are cached briefly
+    """
+    key = ('service-account', account)
+    response = DECISION_CACHE.get(key)
+    if response is None:
+        response = session.get(
+            'https://iam.googleapis.com/v1/projects/{project}/serviceAccounts/{account}'.format(
+                project=os.environ.get('GCP_PROJECT'),
+                account=quote(account)
+            )
         )
-    )
+        if response.status_code == 200:
+            DECISION_CACHE.put(key, response)
+    return response
 
 def update_iam_policy(session, grants, project=None):
     """
@@ -472,7 +735,12 @@ def update_iam_policy(session, grants, project=None):
     )
     return response.status_code == 200, response
 
+@instance_cache(300)
 def enabled_regions(project=None):
+    """
+    Lists the compute regions enabled for the given lapdog engine project.
+    Cached for 5 minutes. Call enabled_regions.invalidate() after changing the regions
+    """
     blob = getblob('gs://{bucket}/regions'.format(bucket=ld_meta_bucket_for_project(project)))
     try:
         if blob.exists():
@@ -481,9 +749,16 @@ def enabled_regions(project=None):
         traceback.print_exc()
     return ['us-central1']
 
+@lru_cache()
+def _logging_client(project):
+    # Clients refresh their own credentials, so they are kept for the life of the instance
+    return logging.Client(project)
+
 class CloudLogger(object):
     def __init__(self, function_name=None, function_region=None, function_project=None):
-        self.logger = logging.Client(function_project).logger('lapdog-api-logging%2Fcloud-functions')
+        self.start = time.monotonic()
+        self.spans = []
+        self.logger = _logging_client(function_project).logger('lapdog-api-logging%2Fcloud-functions')
         self.resource = LogResource(
             type='cloud_function',
             labels={
@@ -518,8 +793,44 @@ class CloudLogger(object):
             },
             severity='DEBUG'
         )
+        _REQUEST_STATE.logger = self
         return self
 
+    @contextmanager
+    def span(self, name):
+        """
+        Times one stage of handling a request.
+        Durations are not logged individually. The cors wrapper logs every span
+        of the request in a single entry once the request finishes
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.spans.append((name, time.monotonic() - start))
+
+    def log_spans(self, status=None):
+        """
+        Logs the total request duration and the duration of each span
+        """
+        try:
+            self.log(
+                json={
+                    'message': "Request timing ({})".format(
+                        self.resource.labels['function_name']
+                    ),
+                    'status': status,
+                    'total_ms': round(1000 * (time.monotonic() - self.start), 1),
+                    'spans': [
+                        {'name': name, 'ms': round(1000 * duration, 1)}
+                        for name, duration in self.spans
+                    ]
+                },
+                severity='INFO'
+            )
+        except:
+            traceback.print_exc()
+
     def log_exception(self, message='Unhandled Exception'):
         self.log(
             message=message,
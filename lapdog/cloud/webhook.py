@@ -12,6 +12,10 @@ import json
 import time
 import datetime
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+# Resolutions are downloaded and updated concurrently, up to this many at a time
+UPDATE_WORKERS = 16
 
 @utils.cors("POST")
 def update(request):
@@ -215,11 +219,16 @@ def webhook(request):
 
         # 2) Get all resolved namespaces and update the iam policy for the signing key
         default_session = utils.generate_default_session()
-        resolutions = [
-            blob.download_as_string().decode()
+        blobs = [
+            blob
             for page in utils._getblob_client(default_session.credentials).bucket('lapdog-resolutions').list_blobs(fields='items/name,nextPageToken').pages
             for blob in page
         ]
+        with ThreadPoolExecutor(UPDATE_WORKERS) as executor:
+            resolutions = list(executor.map(
+                lambda blob: blob.download_as_string().decode(),
+                blobs
+            ))
 
         policy = default_session.get(
             'https://cloudkms.googleapis.com/v1/projects/broad-cga-aarong-gtex/locations/global/keyRings/lapdog:getIamPolicy'
@@ -269,62 +278,23 @@ def webhook(request):
         )
         signature = utils._get_signature(json.dumps(update_payload).encode(), utils.UPDATE_KEY_PATH, default_session.credentials)
         max_version = int(utils.__API_VERSION__['update'][1:])
-        for resolution in resolutions:
-            updated = False
-            for version in range(max_version, (data['__min_version__'] if '__min_version__' in data else 0), -1):
-                try:
-                    update_url = 'https://us-central1-{project}.cloudfunctions.net/update-v{version}'.format(
-                        project=resolution,
-                        version=version
-                    )
-                    if default_session.options(update_url).status_code == 204:
-                        logger.log(
-                            "Triggering update",
-                            project=resolution
-                        )
-                        response = default_session.post(
-                            update_url,
-                            headers={
-                                'Content-Type': 'application/json',
-                                'X-Lapdog-Signature': signature.hex()
-                            },
-                            json=update_payload
-                        )
-                        failed = max(failed, response.status_code)
-                        status['results'].append({
-                            'project': resolution,
-                            'status': 'OK' if response.status_code == 200 else 'Failed',
-                            'message': response.text,
-                            'code': response.status_code
-                        })
-                        logger.log(
-                            "Update triggered",
-                            project=resolution,
-                            version=version,
-                            status=response.status_code,
-                            message=response.text,
-                            severity='INFO'
-                        )
-                        updated = True
-                        break
-                except:
-                    logger.log_exception("Failed to update project", project=resolution)
-                    failed = max(failed, 500)
-                    status['results'].append({
-                        'project': resolution,
-                        'status': 'Error',
-                        'message': traceback.format_exc(),
-                        'code': 0
-                    })
-                    updated = True
-                    break
-            if not updated:
-                status['results'].append({
-                    'project': resolution,
-                    'status': 'Error',
-                    'message': "The target endpoint does not support any self-update endpoint versions",
-                    'code': 0
-                })
+        min_version = data['__min_version__'] if '__min_version__' in data else 0
+        with ThreadPoolExecutor(UPDATE_WORKERS) as executor:
+            results = list(executor.map(
+                lambda resolution: trigger_project_update(
+                    default_session,
+                    logger,
+                    resolution,
+                    update_payload,
+                    signature,
+                    max_version,
+                    min_version
+                ),
+                resolutions
+            ))
+        for result, code in results:
+            failed = max(failed, code)
+            status['results'].append(result)
 
         return status, failed
     except:
@@ -334,6 +304,60 @@ def webhook(request):
             'message': traceback.format_exc()
         }, 500
 
+def trigger_project_update(session, logger, resolution, update_payload, signature, max_version, min_version):
+    """
+    Triggers the self-update endpoint of a single lapdog engine project.
+    Endpoint versions are checked from newest to oldest.
+    Returns the status entry for the project, and the status code it contributes
+    """
+    for version in range(max_version, min_version, -1):
+        try:
+            update_url = 'https://us-central1-{project}.cloudfunctions.net/update-v{version}'.format(
+                project=resolution,
+                version=version
+            )
+            if session.options(update_url).status_code == 204:
+                logger.log(
+                    "Triggering update",
+                    project=resolution
+                )
+                response = session.post(
+                    update_url,
+                    headers={
+                        'Content-Type': 'application/json',
+                        'X-Lapdog-Signature': signature.hex()
+                    },
+                    json=update_payload
+                )
+                logger.log(
+                    "Update triggered",
+                    project=resolution,
+                    version=version,
+                    status=response.status_code,
+                    message=response.text,
+                    severity='INFO'
+                )
+                return {
+                    'project': resolution,
+                    'status': 'OK' if response.status_code == 200 else 'Failed',
+                    'message': response.text,
+                    'code': response.status_code
+                }, response.status_code
+        except:
+            logger.log_exception("Failed to update project", project=resolution)
+            return {
+                'project': resolution,
+                'status': 'Error',
+                'message': traceback.format_exc(),
+                'code': 0
+            }, 500
+    return {
+        'project': resolution,
+        'status': 'Error',
+        'message': "The target endpoint does not support any self-update endpoint versions",
+        'code': 0
+    }, 200
+
 def trigger_update(ref, _minimum_version=1):
     """
     Admins: Use to easily trigger the self-update webhook
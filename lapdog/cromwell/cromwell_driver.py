@@ -150,7 +150,7 @@ class CromwellDriver(object):
             'http://localhost:8000/api/workflows/v1/{0}/abort'.format(workflow_id)
         ).json()
 
-    def batch(self, submission_id, wdl, inputs, options, batch_limit, query_limit):
+    def batch(self, submission_id, wdl, inputs, options, batch_limit, query_limit, on_complete=None):
         logging.info("Starting batch request. Waiting for cromwell to start...")
         self.logger.log(
             "Beginning batch request",
@@ -332,7 +332,7 @@ class CromwellDriver(object):
                     self.batch_submission = False
 
 
-                    output += [
+                    chunk_output = [
                         {
                             'workflow_id':job['id'],
                             'workflow_status':job['status'],
@@ -341,6 +341,16 @@ class CromwellDriver(object):
                         }
                         for job in status_json
                     ]
+                    output += chunk_output
+
+                    if on_complete is not None:
+                        # Publish finished workflows now, so results can be uploaded
+                        # before the whole submission completes
+                        try:
+                            on_complete(chunk_output)
+                        except:
+                            self.logger.log_exception()
+                            traceback.print_exc()
 
                     self.check_cromwell()
 
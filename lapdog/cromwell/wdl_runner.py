@@ -114,6 +114,13 @@ class Runner(object):
                 runtime = submission_data['runtime'] if 'runtime' in submission_data else None
                 self.driver.start(runtime['memory'] if runtime is not None else 3)
                 logging.info("Starting batch request")
+                partial_outputs = []
+                def publish_partial_output(chunk_output):
+                    filename = 'partial-%d.json' % len(partial_outputs)
+                    with open(filename, 'w') as w:
+                        json.dump(chunk_output, w, indent=2)
+                    file_util.gsutil_cp([filename], self.args.output_dir+'/partial/')
+                    partial_outputs.append(filename)
                 # logging.info("SUBMITTING JOB " + repr((
                 #     self.args.batch,
                 #     self.args.wdl,
@@ -128,7 +135,8 @@ class Runner(object):
                     self.args.workflow_inputs,
                     self.args.workflow_options,
                     runtime['batch_limit'] if runtime is not None else 250,
-                    runtime['query_limit'] if runtime is not None else 100
+                    runtime['query_limit'] if runtime is not None else 100,
+                    publish_partial_output
                 )
                 logging.info("Copying execution output file")
                 with open('workflows.json', 'w') as w:
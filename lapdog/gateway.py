@@ -10,7 +10,7 @@ from firecloud import api as fc
 import requests
 import subprocess
 from hashlib import md5, sha512
-from .cache import cached, cache_fetch, cache_write
+from .cache import cached, cache_fetch, cache_write, InstanceRegistry
 import time
 import warnings
 import contextlib
@@ -245,6 +245,15 @@ def get_user_session():
                 warnings.warn("Unable to check Lapdog global alerts during startup")
         return _GLOBAL_LD_TOKEN_INTERNAL.authorized_session
 
+def invalidate_user_session():
+    """
+    Forces the Lapdog API token to be checked again before its next use.
+    Call this after a request fails authentication
+    """
+    with _GLOBAL_LD_LOCK_INTERNAL:
+        if isinstance(_GLOBAL_LD_TOKEN_INTERNAL, LapdogToken):
+            _GLOBAL_LD_TOKEN_INTERNAL.invalidate()
+
 @contextlib.contextmanager
 def capture(display=True):
     """
@@ -333,6 +342,47 @@ def resolve_project_for_namespace(namespace):
             traceback.print_exc()
     return resolution
 
+# How long (in seconds) verified endpoints, gateway existence, and registration
+# are trusted before being checked again
+GATEWAY_STATE_TTL = 3600
+_GATEWAY_STATE = {} # project -> {name: time verified}
+_GATEWAY_STATE_LOCK = RLock()
+
+def _load_gateway_state(project):
+    with _GATEWAY_STATE_LOCK:
+        if project not in _GATEWAY_STATE:
+            state = cache_fetch('gateway', 'state', project=project)
+            try:
+                _GATEWAY_STATE[project] = json.loads(state) if state is not None else {}
+            except ValueError:
+                _GATEWAY_STATE[project] = {}
+        return _GATEWAY_STATE[project]
+
+def check_gateway_state(project, name):
+    """
+    Returns True if the named fact about the project's gateway (such as
+    'exists', 'registered:<account>', or 'endpoint:submit-v1') was verified recently.
+    Verified facts are kept in memory and in the offline disk cache
+    """
+    with _GATEWAY_STATE_LOCK:
+        verified = _load_gateway_state(project).get(name)
+        return verified is not None and time.time() - verified < GATEWAY_STATE_TTL
+
+def set_gateway_state(project, name, verified=True):
+    """
+    Records that the named fact about the project's gateway was just verified,
+    or forgets it if verified is False
+    """
+    with _GATEWAY_STATE_LOCK:
+        state = _load_gateway_state(project)
+        if verified:
+            state[name] = time.time()
+        elif name in state:
+            del state[name]
+        else:
+            return
+        cache_write(json.dumps(state), 'gateway', 'state', project=project)
+
 class Gateway(object):
     """
     Acts as an interface between local lapdog and any resources behind the project's API
@@ -757,15 +807,23 @@ class Gateway(object):
         # Once deployed, lapdog gateways will start reporting that the Engine is active
         _deploy('existence', 'existence', functions_account, custom_lapdog_project)
 
+    @staticmethod
+    def _registration_state():
+        # Registration belongs to the logged in account, not just the project
+        return 'registered:' + get_gcloud_account()
+
     @property
     def registered(self):
         """
         Property. Verifies that the current user is registered with this gateway
         """
-        response = get_user_session().post(
-            self.get_endpoint('query'),
-        )
-        return response.status_code == 200
+        if self.project is not None and check_gateway_state(self.project, self._registration_state()):
+            return True
+        response = self.call_endpoint('post', 'query')
+        if response.status_code == 200:
+            set_gateway_state(self.project, self._registration_state())
+            return True
+        return False
 
     def register(self, workspace, bucket):
         """
@@ -777,8 +835,9 @@ class Gateway(object):
         session = generate_default_session()
         get_token_info(session)
         warnings.warn("[BETA] Gateway Register")
-        response = get_user_session().post(
-            self.get_endpoint('register'),
+        response = self.call_endpoint(
+            'post',
+            'register',
             headers={
                 'Content-Type': 'application/json',
                 'X-Fc-Auth': session.credentials.token
@@ -792,6 +851,7 @@ class Gateway(object):
         if response.status_code != 200:
             print("(%d) : %s" % (response.status_code, response.text), file=sys.stderr)
             raise ValueError("Gateway failed to register user")
+        set_gateway_state(self.project, self._registration_state())
         return response.text # your account email
 
     def create_submission(self, workspace, bucket, submission_id, workflow_options=None, use_cache=True, memory=3, private=False, region=None, _cache_size=None):
@@ -819,8 +879,9 @@ class Gateway(object):
             if blob.exists():
                 blob.reload()
                 _cache_size = blob.size
-        response = get_user_session().post(
-            self.get_endpoint('submit'),
+        response = self.call_endpoint(
+            'post',
+            'submit',
             headers={
                 'Content-Type': 'application/json',
                 'X-Fc-Auth': session.credentials.token,
@@ -865,6 +926,9 @@ class Gateway(object):
                 submission_id
             )
             return True, operation
+        if response.status_code in {401, 403}:
+            # Registration may have been revoked
+            set_gateway_state(self.project, self._registration_state(), False)
         return False, response
 
 
@@ -880,8 +944,9 @@ class Gateway(object):
         then deletes all workflow machines, then finally the cromwell machine.
         """
         warnings.warn("[BETA] Gateway Abort Submission")
-        response = get_user_session().delete(
-            self.get_endpoint('abort'),
+        response = self.call_endpoint(
+            'delete',
+            'abort',
             headers={'Content-Type': 'application/json'},
             json={
                 'bucket': bucket,
@@ -895,7 +960,8 @@ class Gateway(object):
     def get_endpoint(self, endpoint, _version=None):
         """
         1) Generates the appropriate url for a given endpoint in this project
-        2) Checks that the endpoint exists by submitting an OPTIONS request
+        2) Checks that the endpoint exists by submitting an OPTIONS request,
+           unless it was already checked recently (see GATEWAY_STATE_TTL)
         3) Returns the full endpoint url
         """
         if self.project is None:
@@ -909,8 +975,12 @@ class Gateway(object):
             endpoint=quote(endpoint),
             version=_version
         )
+        state = 'endpoint:{}-{}'.format(endpoint, _version)
+        if check_gateway_state(self.project, state):
+            return endpoint_url
         response = get_user_session().options(endpoint_url)
         if response.status_code == 204:
+            set_gateway_state(self.project, state)
             return endpoint_url
         if response.status_code == 200 or response.status_code == 404:
             print("Lapdog Engine Project", self.project, "for namespace", self.namespace, "does not support api version", _version, file=sys.stderr)
@@ -923,15 +993,47 @@ class Gateway(object):
             ))
         raise ValueError("Unexpected status (%d) when checking for endpoint:" % response.status_code, response.text)
 
+    def invalidate_endpoint(self, endpoint, _version=None):
+        """
+        Forgets that the given endpoint was verified, so that the next request checks it again
+        """
+        if _version is None:
+            _version = __API_VERSION__[endpoint]
+        set_gateway_state(self.project, 'endpoint:{}-{}'.format(endpoint, _version), False)
+        if endpoint == 'existence':
+            set_gateway_state(self.project, 'exists', False)
+
+    def call_endpoint(self, method, endpoint, **kwargs):
+        """
+        Sends a request to the given endpoint using the Lapdog API session.
+        If the endpoint is missing or redacted (404 or 410), it is checked again
+        and the request is retried once.
+        If the request is unauthorized (401), the token is checked again and the
+        request is retried once
+        """
+        response = getattr(get_user_session(), method)(self.get_endpoint(endpoint), **kwargs)
+        if response.status_code in {404, 410}:
+            self.invalidate_endpoint(endpoint)
+            response = getattr(get_user_session(), method)(self.get_endpoint(endpoint), **kwargs)
+        if response.status_code == 401:
+            invalidate_user_session()
+            response = getattr(get_user_session(), method)(self.get_endpoint(endpoint), **kwargs)
+        return response
+
     @property
     def exists(self):
         """
         Property. Checks that the current Gateway actually exists.
         Checks that a specific internal endpoint exists and returns the expected response
         """
+        if self.project is not None and check_gateway_state(self.project, 'exists'):
+            return True
         try:
-            response = get_user_session().get(self.get_endpoint('existence'))
-            return response.status_code == 200 and response.text == 'OK'
+            response = self.call_endpoint('get', 'existence')
+            if response.status_code == 200 and response.text == 'OK':
+                set_gateway_state(self.project, 'exists')
+                return True
+            return False
         except ValueError:
             return False
 
@@ -941,9 +1043,7 @@ class Gateway(object):
         Property. Connects to the Gateway to fetch the current quota usage
         """
         warnings.warn("[BETA] Gateway Quotas")
-        response = get_user_session().post(
-            self.get_endpoint('quotas'),
-        )
+        response = self.call_endpoint('post', 'quotas')
         if response.status_code == 200:
             return response.json()
         print("Quota error (%d) : %s" % (response.status_code, response.text), file=sys.stderr)
@@ -999,9 +1099,19 @@ class Gateway(object):
         acl = blob.acl
         acl.all_authenticated().grant_read()
         acl.save()
+        enabled_regions.invalidate()
 
     def __repr__(self):
         return '<lapdog.Gateway {}{}>'.format(
             self.namespace,
             ' ({})'.format(self.project) if self.project is not None else ''
         )
+
+_GATEWAYS = InstanceRegistry(Gateway, 32)
+
+def get_gateway(namespace):
+    """
+    Returns the shared Gateway for the given namespace.
+    Each Gateway is constructed once per process and reused, as long as it stays in use
+    """
+    return _GATEWAYS.get(namespace)
@@ -4,16 +4,16 @@ import dalmatian as dog
 import firecloud.api
 from dalmatian import getblob, copyblob, moveblob, strict_getblob, ConfigNotFound, ConfigNotUnique
 import contextlib
+import copy
 import csv
 from google.cloud import storage
 from agutil.parallel import parallelize, parallelize2
 from agutil import status_bar, byteSize, cmd as execute_command
-from threading import Lock, Thread, RLock
+from threading import Lock, Thread, RLock, Condition, get_ident
 import sys
 import re
 import tempfile
 import time
-import subprocess
 import requests
 import fnmatch
 from collections import namedtuple
@@ -25,10 +25,13 @@ import crayons
 from io import StringIO
 from . import adapters
 from .adapters import get_operation_status, mtypes, NoSuchSubmission, CommandReader, build_input_key
-from .cache import cache_init, cache_path
+from .cache import cache_init, cache_path, cache_fetch, cache_write, InstanceRegistry
+from .transfer import TransferEngine, rewrite
+from .store import WorkspaceStore, PersistentCache, _copy_on_write
 from .cloud.utils import ld_acct_in_project
-from .gateway import Gateway, creation_success_pattern, get_gcloud_account, get_application_default_account, capture, get_proxy_account
+from .gateway import Gateway, get_gateway, creation_success_pattern, get_gcloud_account, get_application_default_account, capture, get_proxy_account
 from itertools import repeat
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from socket import gethostname
 from math import ceil
@@ -45,8 +48,6 @@ import pickle
 # ==============================================================================
 
 # Shim copyblob: adds random backoff to rewrite
-import random
-
 def copyblob(src, dest, credentials=None, user_project=None, max_backoff_time=5):
     """
     Copy blob from src -> dest
@@ -56,21 +57,7 @@ def copyblob(src, dest, credentials=None, user_project=None, max_backoff_time=5)
         src = getblob(src, credentials, user_project)
     if isinstance(dest, str):
         dest = getblob(dest, credentials, user_project)
-    token, progress, total = dest.rewrite(src)
-    n = 0
-    while token is not None:
-        try:
-            token, progress, total = dest.rewrite(src, token)
-            if n > 0:
-                # After a successful block, if we encountered failures, sleep 1 second
-                time.sleep(1)
-        except (storage.blob.exceptions.InternalServerError, storage.blob.exceptions.TooManyRequests):
-            backoff = (2**n) + random.random()
-            if backoff <= max_backoff_time:
-                time.sleep(backoff)
-                n += 1
-            else:
-                raise
+    rewrite(src, dest, max_backoff_time)
     return dest.exists()
 # ==============================================================================
 
@@ -128,13 +115,14 @@ def prune_cache():
     print("Kept", byteSize(kept), "of active cache entries")
     return deleted
 
-def complete_execution(submission_id):
+def complete_execution(submission_id, streaming=False, chunk_size=1000):
     """
     Checks a GCP job status and returns results to firecloud, if possible
+    See WorkspaceManager.complete_execution
     """
     if submission_id.startswith('lapdog/'):
         ns, ws, sid = base64.b64decode(submission_id[7:].encode()).decode().split('/')
-        return WorkspaceManager("{}/{}".format(ns, ws)).complete_execution(sid)
+        return get_workspace_manager(ns, ws).complete_execution(sid, streaming, chunk_size)
     raise TypeError("Global complete_execution can only operate on lapdog global ids")
 
 def get_submission(submission_id):
@@ -143,7 +131,7 @@ def get_submission(submission_id):
     """
     if submission_id.startswith('lapdog/'):
         ns, ws, sid = base64.b64decode(submission_id[7:].encode()).decode().split('/')
-        return WorkspaceManager("{}/{}".format(ns, ws)).get_submission(sid)
+        return get_workspace_manager(ns, ws).get_submission(sid)
     raise TypeError("Global get_submission can only operate on lapdog global ids")
 
 def get_adapter(submission_id):
@@ -152,7 +140,7 @@ def get_adapter(submission_id):
     """
     if submission_id.startswith('lapdog/'):
         ns, ws, sid = base64.b64decode(submission_id[7:].encode()).decode().split('/')
-        return WorkspaceManager("{}/{}".format(ns, ws)).get_adapter(sid)
+        return get_workspace_manager(ns, ws).get_adapter(sid)
     raise TypeError("Global get_adapter can only operate on lapdog global ids")
 
 def firecloud_status():
@@ -181,6 +169,270 @@ def _load_submissions(wm, path):
             traceback.print_exc()
     return path, None
 
+@parallelize(5)
+def _get_call_failures(entity, status, call, operation):
+    error = None
+    if operation is not None:
+        try:
+            error = get_operation_status(operation).get('error', None)
+        except:
+            error = traceback.format_exc()
+    return entity, status, call, operation, error
+
+def _compile_patterns(patterns):
+    """
+    Compiles a list of glob patterns into a single matcher.
+    The matcher takes a series of blob names and a series of their basenames
+    and returns a boolean array of which blobs matched any pattern.
+    Patterns without a / are also checked against the basename
+    """
+    full_pattern = '|'.join(fnmatch.translate(pattern) for pattern in patterns)
+    base_pattern = '|'.join(fnmatch.translate(pattern) for pattern in patterns if '/' not in pattern)
+
+    def matcher(names, basenames):
+        result = np.zeros(len(names), dtype=bool)
+        if len(full_pattern):
+            result |= names.str.match(full_pattern).values.astype(bool)
+        if len(base_pattern):
+            result |= basenames.str.match(base_pattern).values.astype(bool)
+        return result
+
+    return matcher
+
+def _prefetch(iterable):
+    """
+    Iterates over the given iterable, fetching the next item in a background
+    thread while the caller works on the current one
+    """
+    iterator = iter(iterable)
+    done = object()
+    with ThreadPoolExecutor(1) as executor:
+        future = executor.submit(next, iterator, done)
+        while True:
+            item = future.result()
+            if item is done:
+                return
+            future = executor.submit(next, iterator, done)
+            yield item
+
+def _list_blob_prefixes(bucket, prefix):
+    """
+    Lists one level of the bucket under the given prefix.
+    Returns a list of (name, size) for objects directly under the prefix,
+    and a list of the sub-prefixes
+    """
+    iterator = bucket.list_blobs(
+        prefix=prefix,
+        delimiter='/',
+        fields='items/name,items/size,prefixes,nextPageToken'
+    )
+    records = [(blob.name, blob.size) for page in iterator.pages for blob in page]
+    return records, sorted(iterator.prefixes)
+
+@parallelize(8)
+def _list_blob_sizes(bucket, prefix):
+    return [
+        (blob.name, blob.size)
+        for page in bucket.list_blobs(prefix=prefix, fields='items/name,items/size,nextPageToken').pages
+        for blob in page
+    ]
+
+def _get_entity_page(wm, etype, page, page_size, fields=None):
+    return wm.call_with_timeout(
+        dog.DEFAULT_LONG_TIMEOUT,
+        wm._get_entities_query,
+        etype,
+        page,
+        page_size=page_size,
+        fields=fields
+    )
+
+def _upsert_entities(table, updates):
+    """
+    Merges updates into an entity table, mostly in place.
+    Missing rows and columns are added, then each updated column is written
+    with a single vectorized assignment. Null values in updates are skipped,
+    like DataFrame.update.
+    Returns the updated table, which is a new object only if rows were added
+    """
+    rows = updates.index.difference(table.index)
+    if len(rows):
+        table = table.reindex(table.index.append(rows).rename(table.index.name))
+    for col in updates.columns.difference(table.columns):
+        table[col] = pd.Series(np.nan, index=table.index, dtype=object)
+    for col in updates.columns:
+        values = updates[col].dropna()
+        if not len(values):
+            continue
+        if isinstance(table[col].dtype, pd.CategoricalDtype):
+            # New values may not be categories. Callers re-encode the column afterwards
+            table[col] = table[col].astype(object)
+        if table[col].dtype == values.dtype or table[col].dtype == object:
+            table.loc[values.index, col] = values
+        else:
+            # Let pandas pick a dtype which can hold both
+            table[col] = values.combine_first(table[col])
+    return table
+
+def _map_cells(df, func):
+    """
+    Applies func to every cell of the dataframe.
+    DataFrame.applymap was renamed to DataFrame.map in pandas 2.1
+    """
+    if hasattr(pd.DataFrame, 'map'):
+        return df.map(func)
+    return df.applymap(func)
+
+try:
+    # Raises an ImportError if pyarrow is not installed
+    _ARROW_STRING = pd.StringDtype('pyarrow')
+except (ImportError, AttributeError):
+    _ARROW_STRING = None
+
+def _compact_entities(table, columns=None):
+    """
+    Re-encodes columns of a cached entity table in place, to save memory.
+    Columns which only hold strings become categoricals if values repeat (at most
+    one distinct value for every two entities) or, if pyarrow is installed,
+    arrow-backed strings. Columns holding lists or mixed values are left alone.
+    Returns the table
+    """
+    for col in (table.columns if columns is None else columns):
+        values = table[col]
+        if isinstance(values.dtype, pd.CategoricalDtype) or not (values.dtype == object or pd.api.types.is_string_dtype(values.dtype)):
+            continue
+        present = values.dropna()
+        if not len(present) or not (present.map(type) == str).all():
+            continue
+        if present.nunique() * 2 <= len(present):
+            table[col] = values.astype('category')
+        elif _ARROW_STRING is not None and values.dtype != _ARROW_STRING:
+            table[col] = values.astype(_ARROW_STRING)
+    return table
+
+def _expand_entities(table, deep=False):
+    """
+    Returns a copy of an entity table with the columns encoded by _compact_entities
+    decoded back to plain object columns, with missing values as NaN.
+    Other columns share their data with the table, unless deep is True
+    """
+    table = table.copy(deep=deep)
+    for col, dtype in table.dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype) or (_ARROW_STRING is not None and dtype == _ARROW_STRING):
+            values = table[col].astype(object)
+            # Arrow strings mark missing values with pd.NA
+            table[col] = values.where(values.notna(), np.nan)
+    return table
+
+# =============
+# Offline operation replay helpers
+# =============
+
+class _PendingAttributeUpdate(object):
+    """
+    Queued update_entity_attributes call.
+    Consecutive queued updates to the same entity type are merged into one upload
+    """
+    def __init__(self, hound, func, etype, attrs):
+        self.hound = hound
+        self.reason = hound.get_current_reason() if hound is not None else None
+        self.func = func
+        self.etype = etype
+        self.attrs = attrs
+
+    def __call__(self):
+        if self.hound is not None:
+            with self.hound.with_reason(self.reason):
+                return self.func(self.etype, self.attrs)
+        return self.func(self.etype, self.attrs)
+
+    def merge(self, other):
+        """
+        Returns a single update equivalent to running this update, then other.
+        Returns None if the updates cannot be merged
+        """
+        if not (isinstance(other, _PendingAttributeUpdate) and other.etype == self.etype and other.reason == self.reason):
+            return None
+        # Uploads skip null values, so upserting matches running them in order.
+        # Object columns keep integers from being cast to floats by added rows
+        merged = copy.copy(self)
+        merged.attrs = _upsert_entities(self.attrs.astype(object), other.attrs)
+        return merged
+
+def _replay_group(key):
+    """
+    Operations on keys in the same group may depend on each other (for instance,
+    samples reference participants) so each group is replayed in order
+    """
+    if key is None:
+        return None
+    prefix = key.split(':')[0]
+    if prefix in {'entities', 'entity_types'}:
+        return 'entities'
+    if prefix in {'config', 'configs'}:
+        return 'configs'
+    return prefix
+
+def _coalesce_operations(operations):
+    """
+    Sorts queued (key, setter, getter) operations into replay groups.
+    Consecutive setters in a group are merged where possible, and only the last
+    getter for each key is kept, since getters only run after all setters.
+    Returns {group: [(index, key, setter)]}, {key: (index, getter)}
+    """
+    groups = {}
+    getters = {}
+    for index, (key, setter, getter) in enumerate(operations):
+        if setter is not None:
+            group = groups.setdefault(_replay_group(key), [])
+            merged = group[-1][2].merge(setter) if len(group) and isinstance(group[-1][2], _PendingAttributeUpdate) else None
+            if merged is not None:
+                group[-1] = (group[-1][0], key, merged)
+            else:
+                group.append((index, key, setter))
+        if getter is not None:
+            getters[key] = (index, getter)
+    return groups, getters
+
+def _check_response(response):
+    if isinstance(response, requests.Response) and response.status_code >= 400:
+        raise dog.APIException("Request failed while replaying offline operations", response)
+    return response
+
+@parallelize(4)
+def _replay_operations(wm, operations):
+    """
+    Replays a group of queued setters in order.
+    After the first failure, the rest of the group is skipped so that it is not
+    applied out of order.
+    Returns a list of (index, key, setter, exception) for each setter which failed
+    or was skipped (with no exception)
+    """
+    failures = []
+    with wm.lock.delegate():
+        for index, key, setter in operations:
+            if len(failures):
+                failures.append((index, key, setter, None))
+                continue
+            try:
+                _check_response(setter())
+            except Exception as e:
+                traceback.print_exc()
+                failures.append((index, key, setter, e))
+    return failures
+
+@parallelize(8)
+def _replay_getter(wm, index, key, getter):
+    with wm.lock.delegate():
+        try:
+            response = _check_response(getter())
+            if isinstance(response, requests.Response):
+                response = response.json()
+            return index, key, getter, response, None
+        except Exception as e:
+            traceback.print_exc()
+            return index, key, getter, None, e
+
 # =============
 # Preflight helper classes
 # =============
@@ -202,10 +454,106 @@ PreflightSuccess = namedtuple(
 # Operator Cache Helper Decorators
 # =============
 
+# Default freshness windows for operator cache keys, in seconds, by key prefix.
+# While live, cached values younger than this are returned without contacting FireCloud.
+# None means the value never goes stale (versioned WDLs cannot change)
+CACHE_TTL = {
+    'config': 30,
+    'configs': 30,
+    'entity_types': 30,
+    'entities': 30,
+    'workspace': 30,
+    'wdl': None,
+    'method_version': 60,
+}
+
+class _ReadWriteLock(object):
+    """
+    Reentrant readers/writer lock.
+    Any number of threads may hold the shared side at once, but the exclusive
+    side is only held by one thread, with no readers.
+    The thread holding the exclusive side may also take the shared side,
+    as may any worker threads it delegates to.
+    Using the lock as a context manager takes the exclusive side
+    """
+    def __init__(self):
+        self._condition = Condition(Lock())
+        self._readers = {}
+        self._writer = None
+        self._writer_depth = 0
+        self._delegates = set()
+
+    def acquire_shared(self):
+        ident = get_ident()
+        with self._condition:
+            while not (self._writer is None or self._writer == ident or ident in self._delegates):
+                self._condition.wait()
+            self._readers[ident] = self._readers.get(ident, 0) + 1
+
+    def release_shared(self):
+        ident = get_ident()
+        with self._condition:
+            self._readers[ident] -= 1
+            if not self._readers[ident]:
+                del self._readers[ident]
+                self._condition.notify_all()
+
+    def acquire_exclusive(self):
+        ident = get_ident()
+        with self._condition:
+            if self._writer == ident:
+                self._writer_depth += 1
+                return
+            if ident in self._readers:
+                raise RuntimeError("Cannot take the exclusive lock while holding the shared lock")
+            while not (self._writer is None and not len(self._readers)):
+                self._condition.wait()
+            self._writer = ident
+            self._writer_depth = 1
+
+    def release_exclusive(self):
+        with self._condition:
+            self._writer_depth -= 1
+            if not self._writer_depth:
+                self._writer = None
+                self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def shared(self):
+        self.acquire_shared()
+        try:
+            yield
+        finally:
+            self.release_shared()
+
+    @contextlib.contextmanager
+    def delegate(self):
+        """
+        Lets the calling thread take the shared side on behalf of the thread
+        holding the exclusive side. Only use in worker threads which the
+        exclusive holder is waiting on
+        """
+        ident = get_ident()
+        with self._condition:
+            self._delegates.add(ident)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._delegates.discard(ident)
+
+    def __enter__(self):
+        self.acquire_exclusive()
+        return self
+
+    def __exit__(self, *args):
+        self.release_exclusive()
+
 def _synchronized(func):
     """
-    Synchronizes access to the function using the instance's lock.
-    Use if the function touches the operator cache
+    Synchronizes access to the function using the exclusive side of the instance's lock.
+    Use if the function touches the entire operator cache.
+    Functions which only touch specific cache keys should use _synchronized_on instead
     """
     @wraps(func)
     def call_with_lock(self, *args, **kwargs):
@@ -213,6 +561,69 @@ def _synchronized(func):
             return func(self, *args, **kwargs)
     return call_with_lock
 
+def _synchronized_on(*keys):
+    """
+    Decorator factory.
+    Synchronizes access to the function using the locks for the given cache keys.
+    Other functions may run concurrently, as long as they do not touch the same keys.
+    If a key is callable, call it on all the provided args and kwargs to generate
+    a key (or a list of keys).
+    Locks are always taken in sorted order to avoid deadlocks.
+    This only holds if a decorated function never calls another decorated
+    function which needs keys it does not already hold. Resolve anything which
+    needs other keys first, then call a decorated internal function
+    """
+
+    def decorator(func):
+
+        @wraps(func)
+        def call_with_lock(self, *args, **kwargs):
+            _keys = set()
+            for key in keys:
+                if callable(key):
+                    key = key(self, *args, **kwargs)
+                if isinstance(key, str):
+                    _keys.add(key)
+                else:
+                    _keys.update(key)
+            _keys = sorted(_keys)
+            with contextlib.ExitStack() as stack:
+                stack.enter_context(self.lock.shared())
+                for _key in _keys:
+                    stack.enter_context(self.key_lock(_key))
+                try:
+                    return func(self, *args, **kwargs)
+                finally:
+                    # Write back changed keys while their locks are still held
+                    self._persist(_keys)
+
+        return call_with_lock
+
+    return decorator
+
+def _journaled(func):
+    """
+    Use to decorate a method which may queue offline operations.
+    If the on-disk snapshot is enabled, calls which queued operations are
+    recorded in its journal, so that the operations can be queued again if
+    the process exits before they are replayed
+    """
+
+    @wraps(func)
+    def call_and_record(self, *args, **kwargs):
+        queued = len(self.pending_operations)
+        result = func(self, *args, **kwargs)
+        if self._store is not None and not self._restoring and len(self.pending_operations) > queued:
+            groups = {_replay_group(key) for key, setter, getter in self.pending_operations[queued:]}
+            try:
+                self._store.append_journal((func.__name__, args, kwargs, [*groups]))
+            except:
+                traceback.print_exc()
+                warnings.warn("Unable to journal offline operation: {}".format(func.__name__))
+        return result
+
+    return call_and_record
+
 def _read_from_cache(key, message=None):
     """
     Decorator factory.
@@ -229,8 +640,11 @@ def _read_from_cache(key, message=None):
     If the key is callable, call it on all the provided args and kwargs to generate a key
 
     Use if your function is a relatively straightforward getter. Just decorate with
-    this and _synchronized, and then build your function to fetch a result from firecloud.
+    this and _synchronized_on, and then build your function to fetch a result from firecloud.
     Combine with tentative_json in your function for best results
+
+    If the cached value is still fresh (see WorkspaceManager.cache_ttl), the
+    live update is skipped entirely
     """
 
     def decorator(func):
@@ -243,14 +657,17 @@ def _read_from_cache(key, message=None):
             else:
                 _key = key
             # Next, if the workspace is live, attempt a live update
-            if self.live:
+            # unless the cached value is still within its freshness window
+            if self.live and not self.cache_is_fresh(_key):
                 # Call with timeout
                 try:
                     with self.timeout(_key):
                         result = func(self, *args, **kwargs)
                         if _key in self.dirty:
                             self.dirty.remove(_key)
+                        self._dirty_columns.pop(_key, None)
                         self.cache[_key] = result
+                        self._cache_timestamps[_key] = time.monotonic()
                 except requests.ReadTimeout:
                     pass
                 except dog.APIException as e:
@@ -312,10 +729,13 @@ class WorkspaceManager(dog.WorkspaceManager):
     Any features from dalmatian which are not explicitly upgraded by lapdog will
     still be accessible via inheritance
     """
-    def __init__(self, reference, timezone='America/New_York', *, workspace_seed_url="http://localhost:4201"):
+    def __init__(self, reference, timezone='America/New_York', *, workspace_seed_url="http://localhost:4201", persist=False):
         """
         workspace_seed_url controls the url that will be queried to attempt to pre-populate the operator cache with data from
         a running lapdog UI. set to None to disable this feature
+        persist enables an on-disk snapshot of the operator cache, kept in the lapdog cache directory.
+        Cached values are loaded from the snapshot as they are needed, and queued offline operations
+        are restored the next time a persistent WorkspaceManager is created for this workspace
         Returns a Workspace object
         """
         super().__init__(
@@ -323,35 +743,94 @@ class WorkspaceManager(dog.WorkspaceManager):
             timezone
         )
         self.pending_operations = []
-        self.cache = {}
+        self._store = WorkspaceStore(self.namespace, self.workspace) if persist else None
+        self._restoring = False
+        self.cache = PersistentCache(self._store) if persist else {}
         self.dirty = set()
+        self._dirty_columns = {}
+        self.cache_ttl = {**CACHE_TTL}
+        self._cache_timestamps = {}
         self.live = True
-        self.lock = RLock()
+        self.lock = _ReadWriteLock()
+        self._key_locks = {}
+        self._key_locks_lock = Lock()
         self._last_result = None
         self._webcache_ = False
-        if workspace_seed_url is not None:
+        # The seed request, gateway, and submission cache are only set up when first used
+        self._seed_url = workspace_seed_url
+        self._seed_lock = Lock()
+        self._gateway = None
+        self._gateway_lock = Lock()
+        self._submissions = None
+        self._submission_cache_lock = Lock()
+        if self._store is not None:
+            self._restore()
+
+    @property
+    def cache(self):
+        """
+        The operator cache.
+        The first time it is used, attempts to pre-populate it from a running lapdog UI
+        """
+        if self._seed_url is not None:
+            self._seed_cache()
+        return self._cache
+
+    @cache.setter
+    def cache(self, cache):
+        self._cache = cache
+
+    def _seed_cache(self):
+        with self._seed_lock:
+            workspace_seed_url, self._seed_url = self._seed_url, None
+            if workspace_seed_url is None:
+                return
             try:
-                self.cache = {
-                    key:pickle.loads(base64.b64decode(value.encode()))
-                    for key, value in requests.get(
-                        workspace_seed_url+"/api/v1/workspaces/{namespace}/{workspace}/cache/seed".format(
-                            namespace=self.namespace,
-                            workspace=self.workspace
-                        )
-                    ).json().items()
-                }
+                for key, value in requests.get(
+                    workspace_seed_url+"/api/v1/workspaces/{namespace}/{workspace}/cache/seed".format(
+                        namespace=self.namespace,
+                        workspace=self.workspace
+                    )
+                ).json().items():
+                    self._cache[key] = pickle.loads(base64.b64decode(value.encode()))
             except requests.ConnectionError:
                 pass # UI probably not running; ignore
             except:
                 traceback.print_exc()
                 warnings.warn("Failed to pre-seed workspace cache from running Lapdog UI")
-        self.gateway = Gateway(self.namespace)
-        self._submission_cache = {}
+
+    @property
+    def gateway(self):
+        """
+        Initializes the Gateway for the workspace's namespace, if it is None
+        """
+        if self._gateway is None:
+            with self._gateway_lock:
+                if self._gateway is None:
+                    self._gateway = get_gateway(self.namespace)
+        return self._gateway
+
+    @gateway.setter
+    def gateway(self, gateway):
+        self._gateway = gateway
+
+    @property
+    def _submission_cache(self):
+        """
+        Initializes the submission cache from submissions saved in the offline disk cache, if it is None
+        """
+        if self._submissions is None:
+            with self._submission_cache_lock:
+                if self._submissions is None:
+                    self._submissions = self._load_submission_cache()
+        return self._submissions
+
+    def _load_submission_cache(self):
         try:
             bucket_id = self.get_bucket_id()
             target_prefix = 'submission-json.{}'.format(bucket_id)
             pointer_prefix = 'submission-ptr.{}'.format(bucket_id)
-            self._submission_cache = {
+            return {
                 k:v
                 for k,v in _load_submissions(
                     repeat(self),
@@ -362,11 +841,10 @@ class WorkspaceManager(dog.WorkspaceManager):
                 )
                 if v is not None
             }
-
         except:
             traceback.print_exc()
             print("Warning: Unable to prepopulate workspace submission cache. Workspace may not exist", file=sys.stderr)
-            self.sync()
+            return {}
 
     # ========================
     # Operator Cache Internals
@@ -395,47 +873,227 @@ class WorkspaceManager(dog.WorkspaceManager):
         """
         Attempts to switch the WorkspaceManager into online mode
         Queued operations are replayed through the firecloud api
+        Consecutive attribute updates to the same entity type are merged into a
+        single upload, and each cache key is only fetched once, after all of its
+        operations. Independent groups of operations are replayed concurrently,
+        but operations within a group keep their order.
         If any operations fail, they are re-queued
         WorkspaceManager returns to online mode if all queued operations finish
         """
+        self.live = True # Always ensure live pathways are enabled during sync
+        groups, getters = _coalesce_operations(self.pending_operations)
         failures = []
         exceptions = []
-        for key, setter, getter in self.pending_operations:
-            self.live = True # Always ensure live pathways are enabled during sync
-            try:
-                if setter is not None:
-                    response = setter()
-                    if isinstance(response, requests.Response) and response.status_code >= 400:
-                        raise dog.APIException(r)
-            except Exception as e:
-                failures.append((key, setter, getter))
-                exceptions.append(e)
-                traceback.print_exc()
+        blocked = set()
+        for group_failures in _replay_operations(repeat(self), groups.values()):
+            for index, key, setter, exception in group_failures:
+                failures.append((index, (key, setter, None)))
+                blocked.add(_replay_group(key))
+                if exception is not None:
+                    exceptions.append(exception)
+        # Only fetch keys once everything they depend on was replayed
+        ready = []
+        for key, (index, getter) in getters.items():
+            if _replay_group(key) in blocked:
+                failures.append((index, (key, None, getter)))
             else:
-                try:
-                    if getter is not None:
-                        response = getter()
-                        if isinstance(response, requests.Response):
-                            if response.status_code >= 400:
-                                raise dog.APIException(r)
-                            else:
-                                response = response.json()
-                        if key is not None:
-                            self.cache[key] = response
-                            if key in self.dirty:
-                                self.dirty.remove(key)
-                except Exception as e:
-                    failures.append((key, None, getter))
-                    exceptions.append(e)
-                    traceback.print_exc()
-        self.pending_operations = [item for item in failures]
+                ready.append((index, key, getter))
+        if len(ready):
+            for index, key, getter, response, exception in _replay_getter(repeat(self), *zip(*ready)):
+                if exception is not None:
+                    failures.append((index, (key, None, getter)))
+                    exceptions.append(exception)
+                elif key is not None:
+                    if isinstance(response, pd.DataFrame):
+                        response = _compact_entities(response)
+                    self.cache[key] = response
+                    self._cache_timestamps[key] = time.monotonic()
+                    if key in self.dirty:
+                        self.dirty.remove(key)
+                    self._dirty_columns.pop(key, None)
+        self.pending_operations = [operation for index, operation in sorted(failures, key=lambda failure: failure[0])]
         self.live = not len(self.pending_operations)
+        if self._store is not None:
+            # Journal entries are kept if any operations in their groups are still queued
+            remaining = {_replay_group(key) for key, setter, getter in self.pending_operations}
+            self._store.write_journal([
+                entry for entry in self._store.read_journal()
+                if len(remaining.intersection(entry[3]))
+            ])
+            self._persist()
         if len(exceptions):
             print("There were", len(exceptions), "exceptions while attempting to sync with firecloud")
         return self.live, exceptions
 
     sync = go_live
 
+    def _touch(self, key):
+        """
+        Marks a cache key as modified locally
+        """
+        self.dirty.add(key)
+        if self._store is not None:
+            self.cache.touch(key)
+
+    def _persist(self, keys=None):
+        """
+        Writes changed cache keys (default: all changed keys) back to the on-disk
+        snapshot, if enabled. Writes happen in the background
+        """
+        if self._store is None or not len(self.cache.flush(keys)):
+            return
+        wall, now = time.time(), time.monotonic()
+        self._store.save_state({
+            'dirty': sorted(self.dirty.copy()),
+            # Fetch times are saved as wall-clock times so freshness windows carry over
+            'fetched': {
+                key: wall - (now - timestamp)
+                for key, timestamp in self._cache_timestamps.copy().items()
+            }
+        })
+
+    def _restore(self):
+        """
+        Restores state and queued offline operations from the on-disk snapshot
+        """
+        state = self._store.load_state()
+        wall, now = time.time(), time.monotonic()
+        for key in state.get('dirty', []):
+            if key in self.cache.unloaded:
+                self.dirty.add(key)
+        for key, fetched in state.get('fetched', {}).items():
+            if key in self.cache.unloaded and key not in self.dirty:
+                self._cache_timestamps[key] = now - (wall - fetched)
+        entries = self._store.read_journal()
+        if not len(entries):
+            return
+        print(
+            crayons.red("WARNING:", bold=False),
+            "Restoring {} offline operations from a previous session. Call 'WorkspaceManager.sync()' to replay them".format(len(entries)),
+            file=sys.stderr
+        )
+        self.live = False
+        self._restoring = True
+        try:
+            # The snapshot already includes the cache changes, so replaying each
+            # call offline just queues its operations again. Journaled methods
+            # must not contact FireCloud while restoring
+            for method, args, kwargs, groups in entries:
+                try:
+                    getattr(self, method)(*args, **kwargs)
+                except:
+                    traceback.print_exc()
+                    warnings.warn("Unable to restore offline operation: {}. It must be repeated manually".format(method))
+        finally:
+            self._restoring = False
+
+    def key_lock(self, key):
+        """
+        Returns the lock for the given operator cache key
+        """
+        with self._key_locks_lock:
+            if key not in self._key_locks:
+                self._key_locks[key] = RLock()
+            return self._key_locks[key]
+
+    def cache_is_fresh(self, key):
+        """
+        Returns True if the cached value for the given key was fetched from
+        FireCloud within the freshness window for that type of key.
+        Dirty keys (modified locally since the last fetch) are never fresh.
+        Set freshness windows in WorkspaceManager.cache_ttl (seconds, by key prefix).
+        A freshness window of 0 disables this behavior for that key type
+        """
+        if key not in self.cache or self.cache[key] is None or key in self.dirty or key not in self._cache_timestamps:
+            return False
+        ttl = self.cache_ttl.get(key.split(':')[0], 0)
+        return ttl is None or time.monotonic() - self._cache_timestamps[key] < ttl
+
+    def invalidate(self, key=None):
+        """
+        Marks the given cache key as stale, so that the next read will fetch a
+        live value (if the workspace is live).
+        If no key is given, the entire cache is marked stale.
+        The cached values are kept, in case the next fetch fails
+        """
+        if key is None:
+            self._cache_timestamps = {}
+        elif key in self._cache_timestamps:
+            del self._cache_timestamps[key]
+
+    def _mark_columns_dirty(self, key, columns):
+        """
+        Marks an entity table as modified locally, and records which columns changed.
+        Column tracking only starts from a clean table. If the table was already
+        modified in some untracked way, the next refresh downloads the whole table
+        """
+        if key not in self.dirty:
+            self._dirty_columns[key] = set(columns)
+        elif key in self._dirty_columns:
+            self._dirty_columns[key].update(columns)
+        self._touch(key)
+
+    def _update_entity_type(self, etype):
+        """
+        Updates the cached entity_types entry to match the cached entity table
+        """
+        key = 'entities:'+etype
+        if 'entity_types' not in self.cache or self.cache['entity_types'] is None:
+            self.cache['entity_types'] = {}
+        self.cache['entity_types'][etype] = {
+            'attributeNames': [*self.cache[key].columns],
+            'count': len(self.cache[key]),
+            'idName': etype+'_id'
+        }
+        self._touch('entity_types')
+
+    def _update_cached_entities(self, etype, updates):
+        """
+        Upserts a table of new or changed entities into the cache
+        """
+        key = 'entities:'+etype
+        if key not in self.cache or self.cache[key] is None:
+            self.cache[key] = _compact_entities(updates.copy())
+            # Nothing was cached, so a refresh has to download everything
+            self._dirty_columns.pop(key, None)
+            self._touch(key)
+        else:
+            self.cache[key] = _compact_entities(_upsert_entities(self.cache[key], updates), updates.columns)
+            self._mark_columns_dirty(key, updates.columns)
+        self._update_entity_type(etype)
+
+    def _refresh_entities(self, etype):
+        """
+        Confirms local changes to an entity table with FireCloud.
+        If the changes since the last fetch are limited to known columns, only
+        those columns are downloaded and merged into the cached table.
+        Otherwise, the whole table is downloaded
+        """
+        key = 'entities:'+etype
+        columns = self._dirty_columns.get(key)
+        if not (self.live and key in self.dirty and columns and self.cache.get(key) is not None):
+            # The caller just made a change, so the cached copy can't be considered fresh
+            self.invalidate(key)
+            return self._get_entities_internal(etype)
+        try:
+            with self.timeout(key):
+                fetched = self._fetch_entities(etype, fields=sorted(columns))
+        except requests.ReadTimeout:
+            return self.cache[key]
+        # The query always returns every entity, so this also picks up added or deleted rows
+        table = self.cache[key].reindex(fetched.index)
+        for col in sorted(columns):
+            if col in fetched.columns:
+                table[col] = fetched[col]
+            elif col in table.columns:
+                del table[col]
+        self.cache[key] = table
+        self.dirty.discard(key)
+        del self._dirty_columns[key]
+        self._cache_timestamps[key] = time.monotonic()
+        self._update_entity_type(etype)
+        return table
+
     def timeout_for_key(self, key):
         """
         Gets an appropriate request timeout based on a given cache key
@@ -532,7 +1190,7 @@ class WorkspaceManager(dog.WorkspaceManager):
     # Workspace Getters and Internals
     # ================================================
 
-    @_synchronized
+    @_synchronized_on(lambda self, reference: 'config:{}'.format(reference))
     @_read_from_cache(lambda self, reference: 'config:{}'.format(reference))
     def get_config(self, reference):
         """
@@ -544,7 +1202,7 @@ class WorkspaceManager(dog.WorkspaceManager):
         """
         return super().get_config(reference)
 
-    @_synchronized
+    @_synchronized_on('entity_types')
     @_read_from_cache('entity_types')
     def get_entity_types(self):
         """
@@ -553,18 +1211,98 @@ class WorkspaceManager(dog.WorkspaceManager):
         """
         return super().get_entity_types()
 
-    @_synchronized
+    @_synchronized_on(lambda self, etype, page_size=1000: "entities:{}".format(etype))
     @_read_from_cache(lambda self, etype, page_size=1000: "entities:{}".format(etype))
-    def get_entities(self, etype, page_size=1000):
+    def _get_entities_cached(self, etype, page_size=1000):
+        # The freshly downloaded table is owned by the cache
+        # so there is no need to copy it here
+        return self._fetch_entities(etype, page_size)
+
+    def _get_entities_query(self, etype, page, page_size=1000, fields=None):
         """
-        Paginated query replacing get_entities_tsv()
+        Wrapper for firecloud.api.get_entities_query
+        Optionally provide a list of attribute names to only download those attributes
+        """
+        response = firecloud.api.get_entities_query(
+            self.namespace,
+            self.workspace,
+            etype,
+            page=page,
+            page_size=page_size,
+            fields=','.join(fields) if fields is not None else None
+        )
+        if response.status_code == 200:
+            return response.json()
+        raise dog.APIException("Unable to query {}s".format(etype), response)
+
+    def _fetch_entities(self, etype, page_size=1000, workers=8, target_time=5, fields=None):
+        """
+        Downloads all entities of the given type.
+        The first page reports the total number of entities. The page size for
+        the remaining pages is scaled so that each request takes roughly
+        target_time seconds, then they are fetched concurrently.
+        Optionally provide a list of attribute names to only download those attributes.
+        Every entity is included, even if it has none of the requested attributes
+        """
+        start = time.monotonic()
+        response = self._get_entities_query(etype, 1, page_size=page_size, fields=fields)
+        elapsed = time.monotonic() - start
+        total = response['resultMetadata']['filteredCount']
+        pages = [response['results']]
+        if total > page_size:
+            # Pages are indexed by page number, so the first new page may
+            # overlap the first page. Overlapping entities are de-duplicated below
+            new_size = int(min(max(page_size * target_time / max(elapsed, 0.1), 100), 10000))
+            first_page = (page_size // new_size) + 1
+            last_page = ceil(total / new_size)
+            pages += [
+                response['results']
+                for response in status_bar.iter(
+                    parallelize(workers)(_get_entity_page)(
+                        repeat(self),
+                        repeat(etype),
+                        range(first_page, last_page + 1),
+                        repeat(new_size),
+                        repeat(fields)
+                    ),
+                    last_page - first_page + 1,
+                    prepend="Downloading {}s... ".format(etype)
+                )
+            ]
+        records = {
+            entity['name']:entity['attributes']
+            for page in pages
+            for entity in page
+        }
+        df = pd.DataFrame.from_dict(records, orient='index')
+        if len(df) < len(records):
+            # Entities without any attributes are dropped by from_dict
+            df = df.reindex([*records])
+        df.index.name = etype+'_id'
+        # convert JSON to lists; assumes that values are stored in 'items'
+        return _compact_entities(_map_cells(df, lambda x: x['items'] if isinstance(x, dict) and 'items' in x else x))
+
+    def get_entities(self, etype, page_size=1000, copy=False):
         """
-        # This method override is just to gain the operator cache's
-        # synchonization and cacheing
-        return super().get_entities(etype, page_size).copy()
+        Paginated query replacing get_entities_tsv()
+        By default, returns a view of the cached table. With pandas copy-on-write,
+        the view shares its data with the operator cache and costs the same
+        regardless of table size. Modifying it copies the modified data instead
+        of changing the cache. Otherwise, the table's data is copied, so that
+        neither the view nor the cache can change the other.
+        Cached tables store repetitive string columns as categoricals, which
+        compare and use .str like regular columns, but only accept values which
+        are already categories.
+        Set copy=True to get an independent, mutable copy of the table, with
+        compact columns decoded to plain object columns
+        """
+        df = self._get_entities_cached(etype, page_size)
+        if copy:
+            return _expand_entities(df, deep=True)
+        return df.copy(deep=not _copy_on_write())
 
     # This cache entry covers bucket_id and attributes
-    @_synchronized
+    @_synchronized_on('workspace')
     @_read_from_cache('workspace')
     def get_workspace_metadata(self):
         """
@@ -572,22 +1310,31 @@ class WorkspaceManager(dog.WorkspaceManager):
         """
         return super().get_workspace_metadata()
 
-    @_synchronized
+    @_synchronized_on(lambda self, repo, namespace, name: 'method_version:{}/{}'.format(namespace, name))
     def _get_method_version_internal(self, repo, namespace, name):
         # Offline wdl versions are a little complicated
         # 1) Dockstore methods can't be uploaded in dalmatian, so they're not cached:
         if repo == 'dockstore':
-            return dog.get_dockstore_method_version("dockstore.org/{}/{}".format(namespace, name))['name']
+            key = 'method_version:dockstore.org/{}/{}'.format(namespace, name)
+            if not self.cache_is_fresh(key):
+                self.cache[key] = dog.get_dockstore_method_version("dockstore.org/{}/{}".format(namespace, name))['name']
+                self._cache_timestamps[key] = time.monotonic()
+            return self.cache[key]
         # 2) If we uploaded a wdl in offline mode, it will be marked as -1
         # The offline WDL should always take priority
         identifier = '{}/{}'.format(namespace, name)
         if 'wdl:{}/-1'.format(identifier) in self.cache:
             return -1
+        key = 'method_version:{}'.format(identifier)
+        if self.live and self.cache_is_fresh(key):
+            return self.cache[key]
         if self.live:
             # But if we're live, we can just query the latest version. Easy peasy
             try:
                 with self.timeout(dog.DEFAULT_LONG_TIMEOUT):
-                    return int(dog.get_method_version(identifier))
+                    self.cache[key] = int(dog.get_method_version(identifier))
+                    self._cache_timestamps[key] = time.monotonic()
+                    return self.cache[key]
             except requests.ReadTimeout:
                 pass
             except dog.APIException as e:
@@ -605,7 +1352,7 @@ class WorkspaceManager(dog.WorkspaceManager):
         # No offline versions. :(
         self.fail("Unable to determine latest method version: {}".format(identifier))
 
-    @_synchronized
+    @_synchronized_on(lambda self, qualified_reference: 'wdl:{}'.format(qualified_reference))
     @_read_from_cache(lambda self, qualified_reference: 'wdl:{}'.format(qualified_reference))
     def _get_wdl_internal(self, qualified_reference):
         """
@@ -642,7 +1389,7 @@ class WorkspaceManager(dog.WorkspaceManager):
                 raise TypeError("Method reference in invalid format: {}".format(reference))
         return self._get_wdl_internal('/'.join(str(component) for component in data))
 
-    @_synchronized
+    @_synchronized_on('configs')
     @_read_from_cache('configs')
     def list_configs(self):
         """
@@ -655,7 +1402,6 @@ class WorkspaceManager(dog.WorkspaceManager):
     # ================================================
 
 
-    @_synchronized
     def update_config(self, config, wdl=None, synopsis=None):
         """
         Create or update a method configuration (separate API calls)
@@ -701,6 +1447,12 @@ class WorkspaceManager(dog.WorkspaceManager):
                 config['methodRepoMethod'] = dog.get_dockstore_method_version(
                     config['methodRepoMethod']['methodPath']
                 )['methodRepoMethod']
+        # The method version is resolved before taking the config locks
+        self._update_config_internal(config)
+
+    @_synchronized_on(lambda self, config: 'config:{}/{}'.format(config['namespace'], config['name']), 'configs')
+    @_journaled
+    def _update_config_internal(self, config):
         if self.live:
             if config['methodRepoMethod']['methodVersion'] == -1:
                 # Wdl was uploaded offline, so we really shouldn't upload this config
@@ -715,7 +1467,7 @@ class WorkspaceManager(dog.WorkspaceManager):
         if 'configs' not in self.cache:
             # Store the config listing in the cache too so it shows up for list_configs
             self.cache['configs'] = []
-        self.dirty.add('configs')
+        self._touch('configs')
         if identifier not in {'{}/{}'.format(c['namespace'], c['name']) for c in self.cache['configs']}:
             # New config
             # Append to configs cache entry since we know cache was just populated above
@@ -742,7 +1494,7 @@ class WorkspaceManager(dog.WorkspaceManager):
             ]
         if not self.live:
             self.pending_operations.append((
-                None, # Dont worry about a getter. The config entry is exactly as it will appear in FC
+                'configs', # Dont worry about a getter. The config entry is exactly as it will appear in FC
                 partial_with_hound_context(self.hound, super().update_config, config),
                 None
             ))
@@ -753,7 +1505,8 @@ class WorkspaceManager(dog.WorkspaceManager):
             ))
 
 
-    @_synchronized
+    @_synchronized_on(lambda self, etype, *args, **kwargs: 'entities:{}'.format(etype), 'entity_types')
+    @_journaled
     def upload_entities(self, etype, df, index=True):
         """
         index: True if DataFrame index corresponds to ID
@@ -773,25 +1526,7 @@ class WorkspaceManager(dog.WorkspaceManager):
             with self.upload_context():
                 super().upload_entities(etype, df, index)
         if index:
-            if key not in self.cache or self.cache[key] is None:
-                self.cache[key] = df
-            else:
-                # 1) Outer join using new columns only. This will add new rows and columns
-                self.cache[key] = self.cache[key].join(
-                    df[[col for col in df.columns if col not in self.cache[key].columns]],
-                    how='outer'
-                )
-                # 2) Update. This will overrwrite existing columns that have new values
-                self.cache[key].update(df)
-            self.dirty.add(key)
-            if 'entity_types' not in self.cache:
-                self.cache['entity_types'] = {}
-            self.cache['entity_types'][etype] = {
-                'attributeNames': [*self.cache[key].columns],
-                'count': len(self.cache[key]),
-                'idName': etype+'_id'
-            }
-            self.dirty.add('entity_types')
+            self._update_cached_entities(etype, df)
         if not self.live:
             self.pending_operations.append((
                 key,
@@ -805,21 +1540,22 @@ class WorkspaceManager(dog.WorkspaceManager):
                 getter
             ))
             self.pending_operations.append((
-                'entitiy_types',
+                'entity_types',
                 None,
                 self.get_entity_types
             ))
         else:
             try:
                 # Try to trigger an update
-                self._get_entities_internal(etype)
+                self._refresh_entities(etype)
             except dog.APIException:
                 pass
         if not (self.live or index):
             warnings.warn("Entity may not be present in cache until next online sync")
 
 
-    @_synchronized
+    @_synchronized_on(lambda self, etype, *args, **kwargs: 'entities:{}'.format(etype), 'entity_types')
+    @_journaled
     def update_entity_attributes(self, etype, attrs):
         """
         Create or update entity attributes
@@ -853,36 +1589,13 @@ class WorkspaceManager(dog.WorkspaceManager):
             with self.upload_context():
                 super().update_entity_attributes(etype, attrs)
         key = 'entities:'+etype
-        if key not in self.cache or self.cache[key] is None:
-            self.cache[key] = attrs
-        else:
-            if isinstance(attrs, pd.Series):
-                df = pd.DataFrame(attrs).T
-            else:
-                df = attrs.copy()
-            # 1) Outer join using new columns only. This will add new rows and columns
-            self.cache[key] = self.cache[key].join(
-                df[[col for col in df.columns if col not in self.cache[key].columns]],
-                how='outer'
-            )
-            # 2) Update. This will overrwrite existing columns that have new values
-            self.cache[key].update(df)
-        self.dirty.add(key)
-        if 'entity_types' not in self.cache:
-            self.cache['entity_types'] = {}
-        self.cache['entity_types'][etype] = {
-            'attributeNames': [*self.cache[key].columns],
-            'count': len(self.cache[key]),
-            'idName': etype+'_id'
-        }
-        self.dirty.add('entity_types')
+        self._update_cached_entities(etype, attrs)
         if not self.live:
             # If we were already offline, or the attempted upload switched us offline:
             self.pending_operations.append((
                 key,
-                partial_with_hound_context(
+                _PendingAttributeUpdate(
                     self.hound,
-                    self._df_upload_translation_layer,
                     super().update_entity_attributes,
                     etype,
                     attrs
@@ -897,11 +1610,12 @@ class WorkspaceManager(dog.WorkspaceManager):
         else:
             # If we're still online, attempt a fetch to confirm w/ firecloud
             try:
-                self._get_entities_internal(etype)
+                self._refresh_entities(etype)
             except dog.APIException:
                 pass
 
-    @_synchronized
+    @_synchronized_on(lambda self, etype, *args, **kwargs: 'entities:{}_set'.format(etype), 'entity_types')
+    @_journaled
     def update_entity_set(self, etype, set_id, member_ids):
         """Create or update an entity set"""
         setter = partial_with_hound_context(
@@ -925,25 +1639,7 @@ class WorkspaceManager(dog.WorkspaceManager):
                 setter() #
         key = 'entities:%s_set' % etype
         updates = pd.DataFrame(index=pd.Index([set_id], name=etype+"_set_id"), data={etype+'s':[[*member_ids]]})
-        if key not in self.cache or self.cache[key] is None:
-            self.cache[key] = updates
-        else:
-            # 1) Outer join using new columns only. This will add new rows and columns
-            self.cache[key] = self.cache[key].join(
-                updates[[col for col in updates.columns if col not in self.cache[key].columns]],
-                how='outer'
-            )
-            # 2) Update. This will overrwrite existing columns that have new values
-            self.cache[key].update(updates)
-        self.dirty.add(key)
-        if 'entity_types' not in self.cache:
-            self.cache['entity_types'] = {}
-        self.cache['entity_types'][etype+'_set'] = {
-            'attributeNames': [*self.cache[key].columns],
-            'count': len(self.cache[key]),
-            'idName': etype+'_set_id'
-        }
-        self.dirty.add('entity_types')
+        self._update_cached_entities(etype+'_set', updates)
         if not self.live:
             # offline. Add operations
             self.pending_operations.append((
@@ -958,11 +1654,12 @@ class WorkspaceManager(dog.WorkspaceManager):
             ))
         else:
             try:
-                self._get_entities_internal(etype+'_set')
+                self._refresh_entities(etype+'_set')
             except dog.APIException:
                 pass
 
-    @_synchronized
+    @_synchronized_on('workspace')
+    @_journaled
     def update_attributes(self, attr_dict=None, **kwargs):
         """
         Set or update workspace attributes. Wrapper for API 'set' call
@@ -1005,7 +1702,7 @@ class WorkspaceManager(dog.WorkspaceManager):
                 }
             else:
                 self.cache['workspace']['workspace']['attributes'].update(attr_dict)
-            self.dirty.add('workspace')
+            self._touch('workspace')
 
         if not self.live:
             self.pending_operations.append((
@@ -1024,7 +1721,8 @@ class WorkspaceManager(dog.WorkspaceManager):
                 pass
         return attr_dict
 
-    @_synchronized
+    @_synchronized_on('entities:participant', 'entity_types')
+    @_journaled
     def upload_participants(self, participant_ids):
         """Upload a list of participants IDs"""
         if self.live:
@@ -1033,25 +1731,7 @@ class WorkspaceManager(dog.WorkspaceManager):
         offline_df = pd.DataFrame(index=np.unique(participant_ids))
         offline_df.index.name = 'participant_id'
         key = 'entities:participant'
-        if key not in self.cache or self.cache[key] is None:
-            self.cache[key] = offline_df
-        else:
-            # 1) Outer join using new columns only. This will add new rows and columns
-            self.cache[key] = self.cache[key].join(
-                offline_df[[col for col in offline_df.columns if col not in self.cache[key].columns]],
-                how='outer'
-            )
-            # 2) Update. This will overrwrite existing columns that have new values
-            self.cache[key].update(offline_df)
-        self.dirty.add(key)
-        if 'entity_types' not in self.cache:
-            self.cache['entity_types'] = {}
-        self.cache['entity_types']['participant'] = {
-            'attributeNames': [*self.cache[key].columns],
-            'count': len(self.cache[key]),
-            'idName': 'participant_id'
-        }
-        self.dirty.add('entity_types')
+        self._update_cached_entities('participant', offline_df)
         if not self.live:
             self.pending_operations.append((
                 key,
@@ -1065,12 +1745,17 @@ class WorkspaceManager(dog.WorkspaceManager):
             ))
         else:
             try:
-                self._get_entities_internal('participant')
+                self._refresh_entities('participant')
             except dog.APIException:
                 pass
 
 
-    @_synchronized
+    @_synchronized_on(
+        'entities:participant',
+        'entity_types',
+        lambda self, etype, *args, **kwargs: ['entities:{}'.format(etype), 'entities:{}_set'.format(etype)]
+    )
+    @_journaled
     def update_participant_entities(self, etype, target_set=None):
         """
         Attach entities (samples or pairs) to participants.
@@ -1081,10 +1766,11 @@ class WorkspaceManager(dog.WorkspaceManager):
         if self.live:
             with self.upload_context():
                 super().update_participant_entities(etype, target_set)
+        # Decode the participant column, so unused categories aren't grouped below
         if etype=='sample':
-            df = self.get_samples()[['participant']]
+            df = _expand_entities(self.get_samples()[['participant']])
         elif etype=='pair':
-            df = self.get_pairs()[['participant']]
+            df = _expand_entities(self.get_pairs()[['participant']])
         else:
             raise ValueError('Entity type {} not supported'.format(etype))
 
@@ -1114,25 +1800,7 @@ class WorkspaceManager(dog.WorkspaceManager):
         # We can't just run update_participant_attributes, because if that goes through,
         # then we'll have broken attributes in Firecloud
         key = 'entities:participant'
-        if key not in self.cache or self.cache[key] is None:
-            self.cache[key] = offline_df
-        else:
-            # 1) Outer join using new columns only. This will add new rows and columns
-            self.cache[key] = self.cache[key].join(
-                df[[col for col in df.columns if col not in self.cache[key].columns]],
-                how='outer'
-            )
-            # 2) Update. This will overrwrite existing columns that have new values
-            self.cache[key].update(df)
-        self.dirty.add(key)
-        if 'entity_types' not in self.cache:
-            self.cache['entity_types'] = {}
-        self.cache['entity_types'][etype] = {
-            'attributeNames': [*self.cache[key].columns],
-            'count': len(self.cache[key]),
-            'idName': etype+'_id'
-        }
-        self.dirty.add('entity_types')
+        self._update_cached_entities('participant', offline_df)
         if not self.live:
             self.pending_operations.append((
                 key,
@@ -1154,11 +1822,13 @@ class WorkspaceManager(dog.WorkspaceManager):
             ))
         else:
             try:
-                self._get_entities_internal('participant')
+                self._refresh_entities('participant')
             except dog.APIException:
                 pass
 
-    @_synchronized
+    @_synchronized_on(
+        lambda self, method, *args, **kwargs: ['method_version:{}'.format(method), 'wdl:{}/-1'.format(method)]
+    )
     def upload_wdl(self, method, synopsis, path, delete=True):
         """
         Upload a new method to the repository
@@ -1176,8 +1846,15 @@ class WorkspaceManager(dog.WorkspaceManager):
                 )
             version = self.get_method_version('agora', *method.split('/'))
             key = 'wdl:%s/%d' % (method, version)
-            with open(path) as r:
-                self.cache[key] = r.read()
+            # The new version isn't known until now. Its key still sorts after the
+            # keys held above, so taking its lock here keeps the lock order
+            with self.key_lock(key):
+                with open(path) as r:
+                    self.cache[key] = r.read()
+                self._persist([key])
+            # The latest version just changed
+            self.cache['method_version:%s' % method] = version
+            self._cache_timestamps['method_version:%s' % method] = time.monotonic()
             if 'wdl:%s/-1' % (method) in self.cache:
                 # Once we make a successful upload, remove the offline cached WDL
                 # Otherwise the offline wdl would continue to supercede this one as the
@@ -1196,7 +1873,6 @@ class WorkspaceManager(dog.WorkspaceManager):
     # Workspace Deleters and Internals
     # ================================
 
-    @_synchronized
     def delete_config(self, reference):
         """
         Delete workspace configuration
@@ -1204,24 +1880,32 @@ class WorkspaceManager(dog.WorkspaceManager):
         1) reference = "namespace/name"
         2) reference = "name" (if name is unique)
         """
+        # Resolve the reference before taking the config locks
         cfg = self.get_config(reference)
+        self._delete_config_internal(reference, cfg['namespace'], cfg['name'])
+
+    @_synchronized_on(
+        lambda self, reference, namespace, name: ['config:{}'.format(reference), 'config:{}/{}'.format(namespace, name)],
+        'configs'
+    )
+    @_journaled
+    def _delete_config_internal(self, reference, namespace, name):
         if self.live:
             with self.upload_context():
                 super().delete_config(reference)
-        identifier = '{}/{}'.format(cfg['namespace'], cfg['name'])
-        key = 'config:' + identifier
-        if key in self.cache:
-            del self.cache[key]
+        for key in {'config:' + reference, 'config:{}/{}'.format(namespace, name)}:
+            if key in self.cache:
+                del self.cache[key]
         # Only continue to modify cache if successful or 5XX Error failure
         self.cache['configs'] = [*filter(
-            lambda entry: not (entry['namespace'] == cfg['namespace'] and entry['name'] == cfg['name']),
+            lambda entry: not (entry['namespace'] == namespace and entry['name'] == name),
             self.cache['configs']
         )]
-        self.dirty.add('configs')
+        self._touch('configs')
         if not self.live:
             self.pending_operations.append((
-                None,
-                partial(super().delete_config, cfg['namespace'], cfg['name']),
+                'configs',
+                partial(super().delete_config, namespace, name),
                 None
             ))
             self.pending_operations.append((
@@ -1230,7 +1914,8 @@ class WorkspaceManager(dog.WorkspaceManager):
                 self.list_configs
             ))
 
-    @_synchronized
+    @_synchronized_on(lambda self, etype, *args, **kwargs: 'entities:{}'.format(etype), 'entity_types')
+    @_journaled
     def delete_entity_attributes(self, etype, attrs, entity_id=None, delete_files=False, dry_run=False):
         """
         Delete entity attributes and (optionally) their associated data
@@ -1248,42 +1933,43 @@ class WorkspaceManager(dog.WorkspaceManager):
         """
         # Since this is a deletion, try live deletion first
         # Only continue to modify cache if successful or 5XX Error failure
-        with self.upload_context():
-            super().delete_entity_attributes(etype, attrs, entity_id, delete_files, dry_run)
+        # Restored operations were already attempted by the session which queued them
+        if not self._restoring:
+            with self.upload_context():
+                super().delete_entity_attributes(etype, attrs, entity_id, delete_files, dry_run)
         # If we got here, either the deletion went okay, or upload_context silenced a 5XX Error
         key = 'entities:' + etype
         if key in self.cache and not dry_run:
             # only modify cache if it wasn't a dry run
+            table = self.cache[key]
+            rows = columns = []
             if isinstance(attrs, pd.DataFrame):
                 # df version: kill all rowsXcolumns provided
-                for name, row in attrs.iterrows():
-                    if name in self.cache[key].index:
-                        for attr, _ in row.iteritems():
-                            if attr in self.cache[key].columns:
-                                self.cache[key][attr][name] = np.nan
+                rows = attrs.index.intersection(table.index)
+                columns = attrs.columns.intersection(table.columns)
             elif isinstance(attrs, pd.Series):
                 # series version, kill series named attr for all entities on index
-                if attrs.name in self.cache[key].columns:
-                    for name, _ in attrs.iteritems():
-                        if name in self.cache[key].index:
-                            self.cache[key][attrs.name][name] = np.nan
+                if attrs.name in table.columns:
+                    rows = attrs.index.intersection(table.index)
+                    columns = [attrs.name]
             elif isinstance(attrs, list):
                 # list version, kill all attrs listed for provided entity
-                if entity_id in self.cache[key].index:
-                    for attr in attrs:
-                        if attr in self.cache[key].columns:
-                            self.cache[key][attrs.name][name] = np.nan
+                if entity_id in table.index:
+                    rows = [entity_id]
+                    columns = table.columns.intersection(attrs)
+            if len(rows) and len(columns):
+                table.loc[rows, columns] = np.nan
             # Now drop empty rows and columns
-            self.cache[key] = self.cache[key].dropna('index', 'all').dropna('columns', 'all')
-            self.dirty.add(key)
+            self.cache[key] = table.dropna(axis='index', how='all').dropna(axis='columns', how='all')
+            self._mark_columns_dirty(key, columns)
             if self.live:
                 try:
-                    self._get_entities_internal(etype)
+                    self._refresh_entities(etype)
                 except dog.APIException:
                     pass
             else:
                 self.pending_operations.append((
-                    None,
+                    key,
                     partial_with_hound_context(
                         self.hound,
                         super().delete_entity_attributes,
@@ -1292,26 +1978,30 @@ class WorkspaceManager(dog.WorkspaceManager):
                     None
                 ))
 
-    @_synchronized
+    @_synchronized_on(lambda self, etype, *args, **kwargs: 'entities:{}'.format(etype), 'entity_types')
+    @_journaled
     def delete_entity(self, etype, entity_ids):
         """Delete entity or list of entities"""
         # Since this is a deletion, try live deletion first
         # Only continue to modify cache if successful or 5XX Error failure
-        with self.upload_context():
-            super().delete_entity(etype, entity_ids)
+        # Restored operations were already attempted by the session which queued them
+        if not self._restoring:
+            with self.upload_context():
+                super().delete_entity(etype, entity_ids)
         # If we got here, either the deletion went okay, or upload_context silenced a 5XX Error
         key = 'entities:' + etype
         if key in self.cache:
             self.cache[key] = self.cache[key].drop(entity_ids, errors='ignore')
-            self.dirty.add(key)
+            # Any column refresh will also pick up the dropped rows
+            self._mark_columns_dirty(key, [])
         if self.live:
             try:
-                self._get_entities_internal(etype)
+                self._refresh_entities(etype)
             except dog.APIException:
                 pass
         else:
             self.pending_operations.append((
-                None,
+                key,
                 partial_with_hound_context(
                     self.hound,
                     super().delete_entity,
@@ -1364,19 +2054,22 @@ class WorkspaceManager(dog.WorkspaceManager):
         """
 
         bucket_id = self.get_bucket_id()
-        seen = set()
+        engine = TransferEngine()
 
         def copy_to_workspace(value):
             if isinstance(value, str) and value.startswith('gs://'):
                 src = getblob(value)
-                destpath = 'gs://{}/{}'.format(bucket_id, src.name)
-                if not (src.bucket.name == bucket_id or destpath in seen):
-                    try:
-                        copyblob(src, destpath)
-                        seen.add(destpath)
-                        return destpath
-                    except:
-                        print("Failed to copy", value, file=sys.stderr)
+                if src.bucket.name != bucket_id:
+                    destpath = 'gs://{}/{}'.format(bucket_id, src.name)
+                    if destpath in engine.copies and engine.copies[destpath] != value:
+                        # Another bucket already provides this object name. Keep the original reference
+                        warnings.warn("Not copying {} because {} is already being copied to {}".format(
+                            value,
+                            engine.copies[destpath],
+                            destpath
+                        ))
+                        return value
+                    return engine.copy(value, destpath)
             return value
 
         with self.hound.with_reason("<AUTOMATED>: Migrating files into workspace bucket"):
@@ -1384,21 +2077,35 @@ class WorkspaceManager(dog.WorkspaceManager):
             updated_attributes = {
                 key:copy_to_workspace(value) for key,value in attributes.items()
             }
+            entity_dfs = {}
+            for etype in self.get_entity_types():
+                # Compact columns are decoded, so they can take new paths and compare to the updated table
+                entity_df = _expand_entities(self._get_entities_internal(etype)).dropna(axis='columns', how='all')
+                entity_dfs[etype] = (entity_df, _map_cells(entity_df.copy(), copy_to_workspace))
+
+            # Copy everything at once, then put back the original path for any file that failed
+            sources = {**engine.copies}
+            failures = engine.run()
+            def revert_failures(value):
+                if isinstance(value, str) and value in failures:
+                    print("Failed to copy", sources[value], file=sys.stderr)
+                    return sources[value]
+                return value
+
             # To save avoid redundant updates, only post updated attributes
             self.update_attributes({
-                key:value for key,value in updated_attributes.items()
+                key:revert_failures(value) for key,value in updated_attributes.items()
                 if value != attributes[key]
             })
 
-            for etype in self.get_entity_types():
-                entity_df = self._get_entities_internal(etype).dropna(axis='columns', how='all')
-                updated_df = entity_df.copy().applymap(copy_to_workspace)
+            for etype, (entity_df, updated_df) in entity_dfs.items():
+                updated_df = _map_cells(updated_df, revert_failures)
                 update_mask = (entity_df == updated_df).all()
                 # Here's some crazy pandas operations, but ultimately, it just
                 # grabs columns with at least one changed entity
                 self.update_entity_attributes(etype, updated_df[update_mask[~update_mask].index])
 
-    def mop(self, dry_run=False, quiet=False, delete_patterns=None, retain_patterns=None):
+    def mop(self, dry_run=False, quiet=False, delete_patterns=None, retain_patterns=None, resume=False):
         """
         Cleans the workspace bucket of any unused files. By default, mop() retains
         the following file types:
@@ -1414,6 +2121,10 @@ class WorkspaceManager(dog.WorkspaceManager):
         You can include additional files to keep with retain_patterns = [list of globs].
         NOTE: All patterns are first checked against the full blob path.
         Patterns without a / will also be checked just against the blob's basename
+
+        Progress through the bucket is checkpointed in the local cache after each
+        page of objects. If a previous mop was interrupted, set resume=True to
+        continue from the last checkpoint
         """
         reserved_patterns = [
             'lapdog-executions/*/submission.json',
@@ -1438,75 +2149,114 @@ class WorkspaceManager(dog.WorkspaceManager):
             delete_patterns = []
         if retain_patterns is None:
             retain_patterns = []
-        bucket_prefix = "gs://{}/".format(self.get_bucket_id())
+        reserved_matcher = _compile_patterns(reserved_patterns)
+        delete_matcher = _compile_patterns(delete_patterns)
+        retain_matcher = _compile_patterns(retain_patterns)
+        bucket_id = self.get_bucket_id()
+        bucket_prefix = "gs://{}/".format(bucket_id)
         if not quiet:
             print("Loading list of referenced file paths...")
-        referenced_files = {
-            os.path.relpath(value, bucket_prefix) for value in self.get_attributes().values()
-            if isinstance(value, str) and value.startswith(bucket_prefix)
-        }
-
-        def scan_entity_cell(value):
-            if isinstance(value, str) and value.startswith(bucket_prefix):
-                referenced_files.add(os.path.relpath(value, bucket_prefix))
-
-        for etype in self.get_entity_types():
-            self._get_entities_internal(etype).applymap(scan_entity_cell)
+        referenced_files = set()
+        for values in [pd.Series([*self.get_attributes().values()], dtype=object)] + [
+            pd.Series(self._get_entities_internal(etype).values.ravel(), dtype=object)
+            for etype in self.get_entity_types()
+        ]:
+            values = values[values.map(type) == str]
+            values = values[values.str.startswith(bucket_prefix)]
+            referenced_files.update(values.str.slice(len(bucket_prefix)))
 
         deleted_count = 0
         deleted_size = 0
-        deleted_files = []
         retained_count = 0
         retained_size = 0
+        page_token = None
+        # Deleted names are appended to a log, so each checkpoint only rewrites counters
+        deleted_log = cache_path('mop-checkpoint')(bucket_id, dtype='deleted')
+        checkpoint = cache_fetch('mop-checkpoint', bucket_id) if resume else None
+
+        if checkpoint is not None:
+            checkpoint = json.loads(checkpoint)
+            page_token = checkpoint['page_token']
+            deleted_count = checkpoint['deleted_count']
+            deleted_size = checkpoint['deleted_size']
+            retained_count = checkpoint['retained_count']
+            retained_size = checkpoint['retained_size']
+            if not quiet:
+                print("Resuming from previous checkpoint")
+        elif not dry_run and os.path.isfile(deleted_log):
+            os.remove(deleted_log)
 
         if not quiet:
             print("Scanning objects in bucket...")
 
+        engine = TransferEngine(quiet=True)
         try:
-            for page in dog.core._getblob_client(None).bucket(self.get_bucket_id()).list_blobs(fields='items/name,items/size,nextPageToken').pages:
-                for blob in page:
-                    do_continue = False
-                    for pattern in reserved_patterns:
-                        if fnmatch.fnmatch(blob.name, pattern) or ('/' not in pattern and fnmatch.fnmatch(os.path.basename(blob.name), pattern)):
-                            retained_count += 1
-                            retained_size += blob.size
-                            do_continue = True
-                            break
-                    if do_continue:
-                        continue
-                    for pattern in delete_patterns:
-                        if fnmatch.fnmatch(blob.name, pattern) or ('/' not in pattern and fnmatch.fnmatch(os.path.basename(blob.name), pattern)):
-                            deleted_count += 1
-                            deleted_size += blob.size
-                            if not dry_run:
-                                blob.delete()
-                                deleted_files.append(blob.name)
-                            if not quiet:
-                                print("Delete", blob.name)
-                            do_continue = True
-                            break
-                    if do_continue:
-                        continue
-                    for pattern in retain_patterns:
-                        if fnmatch.fnmatch(blob.name, pattern) or ('/' not in pattern and fnmatch.fnmatch(os.path.basename(blob.name), pattern)):
-                            retained_count += 1
-                            retained_size += blob.size
-                            do_continue = True
-                            break
-                    if not (do_continue or blob.name in referenced_files):
-                        deleted_count += 1
-                        deleted_size += blob.size
-                        if not dry_run:
-                            blob.delete()
-                            deleted_files.append(blob.name)
-                        if not quiet:
-                            print("Delete", blob.name)
+            blobs = dog.core._getblob_client(None).bucket(bucket_id).list_blobs(
+                fields='items/name,items/size,nextPageToken',
+                page_token=page_token
+            )
+            # The token is read as each page arrives, since the next page is
+            # listed while the current one is being deleted
+            for page, page_token in _prefetch(
+                ([*page], blobs.next_page_token)
+                for page in blobs.pages
+            ):
+                if not len(page):
+                    continue
+                names = pd.Series([blob.name for blob in page], dtype=object)
+                sizes = np.array([blob.size for blob in page], dtype=np.int64)
+                basenames = names.str.rsplit('/', n=1).str[-1]
+                # Patterns are checked in order: reserved, delete, retain
+                reserved = reserved_matcher(names, basenames)
+                delete = ~reserved & delete_matcher(names, basenames)
+                retain = ~(reserved | delete) & retain_matcher(names, basenames)
+                delete |= ~(reserved | delete | retain) & ~names.isin(referenced_files).values
+                retained = reserved | retain
+                deleted_count += int(delete.sum())
+                deleted_size += int(sizes[delete].sum())
+                retained_count += int(retained.sum())
+                retained_size += int(sizes[retained].sum())
+                if not quiet:
+                    for name in names[delete]:
+                        print("Delete", name)
+                if not dry_run:
+                    for name in names[delete]:
+                        engine.delete(bucket_prefix + name)
+                    failures = engine.run()
+                    if len(failures):
+                        raise ValueError("Failed to delete {} files".format(len(failures)))
+                    with open(deleted_log, 'a') as w:
+                        for name in names[delete]:
+                            w.write(name + '\n')
+                    cache_write(
+                        json.dumps({
+                            'page_token': page_token,
+                            'deleted_count': deleted_count,
+                            'deleted_size': deleted_size,
+                            'retained_count': retained_count,
+                            'retained_size': retained_size
+                        }),
+                        'mop-checkpoint',
+                        bucket_id
+                    )
+            finished = True
         except KeyboardInterrupt:
+            finished = False
             print("Aborted operation")
+            if not dry_run:
+                print("Use mop(resume=True) to continue from the last checkpoint")
         if not quiet:
             print("Deleted", deleted_count, "files (", byteSize(deleted_size), ")")
             print("Retained", retained_count, "files (", byteSize(retained_size), ")")
         if not dry_run:
+            deleted_files = []
+            if os.path.isfile(deleted_log):
+                with open(deleted_log) as r:
+                    deleted_files = r.read().splitlines()
+            if finished:
+                for path in (cache_path('mop-checkpoint')(bucket_id), deleted_log):
+                    if os.path.isfile(path):
+                        os.remove(path)
             self.hound.write_log_entry(
                 'other',
                 'Mopped the workspace bucket. Deleted {} files ({}) : {}'.format(
@@ -1520,6 +2270,72 @@ class WorkspaceManager(dog.WorkspaceManager):
 
 
 
+    def storage_report(self, compare=True):
+        """
+        Summarizes storage usage in the workspace bucket.
+        Returns a dictionary with the total object count and size, as well as
+        dataframes of object count and size:
+        * by_prefix: By top-level directory in the bucket
+        * by_submission: By lapdog submission
+        * by_task: By workflow and task, for all lapdog submissions
+        * by_extension: By file extension
+        The report is saved to the offline cache. If compare is True and a previous
+        report exists, each dataframe gains a 'change' column with the change
+        in size since the previous report
+        """
+        bucket_id = self.get_bucket_id()
+        bucket = dog.core._getblob_client(None).bucket(bucket_id)
+        # Partition the listing by prefix so that it can be run in parallel
+        records, prefixes = _list_blob_prefixes(bucket, '')
+        if 'lapdog-executions/' in prefixes:
+            prefixes.remove('lapdog-executions/')
+            execution_records, execution_prefixes = _list_blob_prefixes(bucket, 'lapdog-executions/')
+            records += execution_records
+            prefixes += execution_prefixes
+        for result in status_bar.iter(
+            _list_blob_sizes(repeat(bucket), prefixes),
+            len(prefixes),
+            prepend="Scanning bucket... "
+        ):
+            records += result
+        objects = pd.DataFrame(records, columns=['name', 'size'])
+        objects['size'] = objects['size'].astype(np.int64)
+        paths = objects['name'].str.extract(
+            r'^lapdog-executions/([0-9a-f]{32})/(?:workspace/([^/]+)/[^/]+/call-([^/]+))?'
+        )
+        objects['submission'] = paths[0]
+        objects['workflow'] = paths[1]
+        objects['task'] = paths[2]
+        objects['prefix'] = objects['name'].str.extract(r'^([^/]+/)')[0].fillna('<root>')
+        objects['extension'] = objects['name'].str.extract(r'[^/]\.([^./]+)$')[0].fillna('<none>')
+
+        def summarize(*columns):
+            return objects.dropna(subset=[*columns]).groupby([*columns])['size'].agg(
+                ['count', 'sum']
+            ).rename(columns={'sum': 'size'}).sort_values('size', ascending=False)
+
+        report = {
+            'timestamp': time.time(),
+            'count': len(objects),
+            'size': int(objects['size'].sum()),
+            'by_prefix': summarize('prefix'),
+            'by_submission': summarize('submission'),
+            'by_task': summarize('workflow', 'task'),
+            'by_extension': summarize('extension'),
+        }
+        previous = cache_fetch('storage-report', bucket_id, decode=False)
+        cache_write(pickle.dumps(report), 'storage-report', bucket_id, decode=False)
+        if compare and previous is not None:
+            previous = pickle.loads(previous)
+            report['previous_timestamp'] = previous['timestamp']
+            report['change'] = report['size'] - previous['size']
+            for key in ['by_prefix', 'by_submission', 'by_task', 'by_extension']:
+                report[key]['change'] = report[key]['size'].sub(
+                    previous[key]['size'],
+                    fill_value=0
+                ).reindex(report[key].index)
+        return report
+
     # ===================================
     # Submission Management and Internals
     # ===================================
@@ -1559,7 +2375,7 @@ class WorkspaceManager(dog.WorkspaceManager):
         """
         if submission_id.startswith('lapdog/'):
             ns, ws, sid = base64.b64decode(submission_id[7:].encode()).decode().split('/')
-            return WorkspaceManager("{}/{}".format(ns, ws)).get_submission(sid)
+            return get_workspace_manager(ns, ws).get_submission(sid)
         elif lapdog_id_pattern.match(submission_id):
             try:
                 adapter = self.get_adapter(submission_id)
@@ -1884,16 +2700,14 @@ class WorkspaceManager(dog.WorkspaceManager):
                 input()
             dest_bucket = authdomain_child.get_bucket_id()
             # Bypass Step 2) Copy all the parsed input data to the bypass workspace
-            copied = set()
+            engine = TransferEngine()
             print("DBG: Copying data")
             def copy_to_bypass(cell):
                 if isinstance(cell, str) and cell.startswith('gs://'):
                     src = getblob(cell)
                     destpath = 'gs://{}/bypass-{}/{}'.format(dest_bucket, submission_id, src.name)
-                    if not (cell == destpath or destpath in copied):
-                        copyblob(src, destpath)
-                        time.sleep(0.5)
-                        copied.add(destpath)
+                    if cell != destpath:
+                        engine.copy(cell, destpath)
                     return destpath
                 elif isinstance(cell, list):
                     return [
@@ -1909,7 +2723,7 @@ class WorkspaceManager(dog.WorkspaceManager):
                 for column in row
             }
             # The fake entity data:
-            bypass_data = pd.DataFrame(
+            bypass_data = _map_cells(pd.DataFrame(
                 [
                     {
                         column_map[key]:val
@@ -1918,7 +2732,10 @@ class WorkspaceManager(dog.WorkspaceManager):
                     for row in workflow_inputs
                 ],
                 index=pd.Index(preflight.workflow_entities, name='{}_id'.format(preflight.config['rootEntityType']))
-            ).applymap(copy_to_bypass)
+            ), copy_to_bypass)
+            failures = engine.run()
+            if len(failures):
+                raise ValueError("Unable to copy {} input files to the bypass workspace".format(len(failures)))
 
             print("DBG: Adding pseudo-entities")
 
@@ -2154,7 +2971,7 @@ class WorkspaceManager(dog.WorkspaceManager):
         """
         if submission_id.startswith('lapdog/'):
             ns, ws, sid = base64.b64decode(submission_id[7:].encode()).decode().split('/')
-            return WorkspaceManager("{}/{}".format(ns, ws)).get_submission_cost(sid)
+            return get_workspace_manager(ns, ws).get_submission_cost(sid)
         elif lapdog_id_pattern.match(submission_id):
             return self.get_adapter(submission_id).cost()
         raise TypeError("get_submission_cost not available for firecloud submissions")
@@ -2165,7 +2982,7 @@ class WorkspaceManager(dog.WorkspaceManager):
         """
         if submission_id.startswith('lapdog/'):
             ns, ws, sid = base64.b64decode(submission_id[7:].encode()).decode().split('/')
-            return WorkspaceManager("{}/{}".format(ns, ws)).build_retry_set(sid)
+            return get_workspace_manager(ns, ws).build_retry_set(sid)
         elif not lapdog_id_pattern.match(submission_id):
             submission = self.get_submission(submission_id)
             workflowEntityType = submission['workflows'][0]['workflowEntity']['entityType']
@@ -2236,26 +3053,21 @@ class WorkspaceManager(dog.WorkspaceManager):
             }
 
 
-    def submission_output_df(self, submission_id):
+    def submission_output_df(self, submission_id, diagnostics=False):
         """
         Checks a GCP job status and returns a dataframe of outputs
+        If diagnostics is True, returns a tuple of (outputs, failures) where
+        failures is a dataframe with one row per call of each failed workflow.
+        Otherwise, failures are printed
         """
         if submission_id.startswith('lapdog/'):
             ns, ws, sid = base64.b64decode(submission_id[7:].encode()).decode().split('/')
-            return WorkspaceManager("{}/{}".format(ns, ws)).submission_output_df(sid)
+            return get_workspace_manager(ns, ws).submission_output_df(sid, diagnostics)
         elif lapdog_id_pattern.match(submission_id):
             submission = self.get_adapter(submission_id)
             status = submission.status
             done = 'done' in status and status['done']
             if done:
-                output_template = self.get_config(
-                    "{}/{}".format(
-                        submission.data['methodConfigurationNamespace'],
-                        submission.data['methodConfigurationName']
-                    )
-                )['outputs']
-
-                output_data = {}
                 try:
                     workflow_metadata = json.loads(getblob(
                         'gs://{bucket_id}/lapdog-executions/{submission_id}/results/workflows.json'.format(
@@ -2265,92 +3077,208 @@ class WorkspaceManager(dog.WorkspaceManager):
                     ).download_as_string())
                 except:
                     raise FileNotFoundError("Unable to locate the tracking file for this submission. It may not have finished")
+                return self._parse_submission_outputs(submission, workflow_metadata, diagnostics)
+        if diagnostics:
+            return pd.DataFrame(), pd.DataFrame(columns=['entity', 'status', 'call', 'operation', 'error'])
+        return pd.DataFrame()
 
+    def _parse_submission_outputs(self, submission, workflow_metadata, diagnostics=False, partial=False):
+        """
+        Builds the output dataframe from a list of workflow metadata produced by
+        the cromwell runner. If partial is True, the metadata is only expected to
+        cover some of the workflows in the submission
+        """
+        output_template = self.get_config(
+            "{}/{}".format(
+                submission.data['methodConfigurationNamespace'],
+                submission.data['methodConfigurationName']
+            )
+        )['outputs']
 
-                workflow_metadata = {
-                    build_input_key(meta['workflow_metadata']['inputs']):meta
-                    for meta in workflow_metadata
-                    if meta['workflow_metadata'] is not None and 'inputs' in meta['workflow_metadata']
+        workflow_metadata = {
+            build_input_key(meta['workflow_metadata']['inputs']):meta
+            for meta in workflow_metadata
+            if meta['workflow_metadata'] is not None and 'inputs' in meta['workflow_metadata']
+        }
+
+        # Resolve the output template once, rather than once per entity
+        output_columns = {
+            k:v[5:]
+            for k,v in output_template.items()
+            if isinstance(v, str) and v.startswith('this.')
+        }
+
+        submission_workflows = {wf['workflowOutputKey']: wf['workflowEntity'] for wf in submission.data['workflows']}
+        if partial:
+            submission_workflows = {k:v for k,v in submission_workflows.items() if k in workflow_metadata}
+        records = {}
+        failed_calls = []
+        for key, entity in status_bar.iter(submission_workflows.items(), prepend="Processing Output... "):
+            if key not in workflow_metadata:
+                print("Entity", entity, "has no output metadata")
+            elif workflow_metadata[key]['workflow_status'] != 'Succeeded':
+                print("Entity", entity, "failed")
+                calls = workflow_metadata[key]['workflow_metadata'].get('calls', {})
+                if not len(calls):
+                    failed_calls.append((entity, workflow_metadata[key]['workflow_status'], None, None))
+                for call, calldata in calls.items():
+                    failed_calls.append((entity, workflow_metadata[key]['workflow_status'], call, calldata.get('jobId')))
+            else:
+                records[entity] = {
+                    output_columns[k]:v
+                    for k,v in workflow_metadata[key]['workflow_output']['outputs'].items()
+                    if k in output_columns
                 }
+        submission_data = pd.DataFrame.from_dict(records, orient='index').sort_index(axis=1)
+        failures = pd.DataFrame(
+            [*_get_call_failures(*zip(*failed_calls))] if len(failed_calls) else [],
+            columns=['entity', 'status', 'call', 'operation', 'error']
+        )
+        if diagnostics:
+            return submission_data, failures
+        for entity, calls in failures.groupby('entity'):
+            print("Entity", entity, "errors:")
+            for call, error in zip(calls['call'], calls['error']):
+                print("Call", call, "failed with error:", error)
+        return submission_data
+
+    def _get_upload_checkpoint(self, submission_id):
+        """
+        Loads the record of which entities from a submission have already been uploaded
+        """
+        blob = getblob(
+            'gs://{bucket_id}/lapdog-executions/{submission_id}/results/uploaded.json'.format(
+                bucket_id=self.get_bucket_id(),
+                submission_id=submission_id
+            )
+        )
+        if blob.exists():
+            checkpoint = json.loads(blob.download_as_string())
+        else:
+            checkpoint = {'batches': [], 'entities': []}
+        return blob, checkpoint
 
-                submission_workflows = {wf['workflowOutputKey']: wf['workflowEntity'] for wf in submission.data['workflows']}
-                submission_data = pd.DataFrame()
-                for key, entity in status_bar.iter(submission_workflows.items(), prepend="Processing Output... "):
-                    if key not in workflow_metadata:
-                        print("Entity", entity, "has no output metadata")
-                    elif workflow_metadata[key]['workflow_status'] != 'Succeeded':
-                        print("Entity", entity, "failed")
-                        print("Errors:")
-                        for call, calldata in workflow_metadata[key]['workflow_metadata']['calls'].items():
-                            print("Call", call, "failed with error:", get_operation_status(calldata['jobId'])['error'])
-                    else:
-                        output_data = workflow_metadata[key]['workflow_output']
-                        entity_data = pd.DataFrame(index=[entity])
-                        for k,v in output_data['outputs'].items():
-                            k = output_template[k]
-                            if k.startswith('this.'):
-                                entity_data[k[5:]] = [v]
-                        submission_data = submission_data.append(entity_data, sort=True)
-                return submission_data
-        return pd.DataFrame()
+    def _upload_submission_outputs(self, upload_target, submission, outputs, chunk_size, checkpoint=None):
+        """
+        Uploads submission outputs to the target workspace, at most chunk_size entities at a time.
+        If a checkpoint is provided, it is updated after each chunk is uploaded
+        """
+        for i in range(0, len(outputs), chunk_size):
+            chunk = outputs.iloc[i:i+chunk_size]
+            upload_target.update_entity_attributes(
+                submission.data['workflowEntityType'],
+                chunk
+            )
+            if checkpoint is not None:
+                blob, data = checkpoint
+                data['entities'] += [*chunk.index]
+                blob.upload_from_string(json.dumps(data))
 
-    def complete_execution(self, submission_id):
+    def complete_execution(self, submission_id, streaming=False, chunk_size=1000):
         """
         Checks a GCP job status and returns results to firecloud, if possible
+        If streaming is True, outputs of workflows which have already finished
+        are uploaded, even if the submission is still running.
+        Uploaded entities are checkpointed in the submission's results directory,
+        so each workflow will only be uploaded once.
+        Results are uploaded at most chunk_size entities at a time
         """
         if submission_id.startswith('lapdog/'):
             ns, ws, sid = base64.b64decode(submission_id[7:].encode()).decode().split('/')
-            return WorkspaceManager("{}/{}".format(ns, ws)).complete_execution(sid)
+            return get_workspace_manager(ns, ws).complete_execution(sid, streaming, chunk_size)
         elif lapdog_id_pattern.match(submission_id):
             submission = self.get_adapter(submission_id)
             status = submission.status
             done = 'done' in status and status['done']
+            bypass = 'AUTHORIZED_DOMAIN' in submission.data and not submission.data['AUTHORIZED_DOMAIN'].endswith(self.workspace)
             if done:
                 submission_outputs = self.submission_output_df(submission_id)
                 print("All workflows completed. Uploading results...")
-                if 'AUTHORIZED_DOMAIN' in submission.data and not submission.data['AUTHORIZED_DOMAIN'].endswith(self.workspace):
-                    upload_target = WorkspaceManager(submission.data['AUTHORIZED_DOMAIN'])
+                if bypass:
+                    upload_target = get_workspace_manager(*submission.data['AUTHORIZED_DOMAIN'].split('/'))
                     print("Copying outputs from job to parent workspace")
                     src_bucket = self.get_bucket_id()
                     dest_bucket = upload_target.get_bucket_id()
-                    subprocess.check_call(
-                        'gsutil -m cp -r gs://{src_bucket}/lapdog-executions/{submission_id} gs://{dest_bucket}/lapdog-executions/{bypass_dir}'.format(
-                            src_bucket=src_bucket,
-                            submission_id=submission_id,
-                            dest_bucket=dest_bucket,
-                            bypass_dir=submission.data['BYPASS_DIRECTORY']
-                        ),
-                        shell=True,
-                        stdout=subprocess.DEVNULL,
-                        stderr=subprocess.DEVNULL
+                    engine = TransferEngine()
+                    engine.copy_prefix(
+                        'gs://{}/lapdog-executions/{}'.format(src_bucket, submission_id),
+                        'gs://{}/lapdog-executions/{}'.format(dest_bucket, submission.data['BYPASS_DIRECTORY'])
                     )
-                    submission_outputs = submission_outputs.applymap(
+                    failures = engine.run()
+                    if len(failures):
+                        raise ValueError("Unable to copy {} files to the parent workspace".format(len(failures)))
+                    submission_outputs = _map_cells(
+                        submission_outputs,
                         lambda cell: cell if not (isinstance(cell, str) and cell.startswith('gs://')) else cell.replace(src_bucket, dest_bucket, 1)
                     )
                     print("Cleaning bucket")
-                    # bucket = storage.Client().bucket(self.get_bucket_id())
-                    # bucket.delete_blobs(blob for blob in bucket.list_blobs(fields='items/name,nextPageToken').pages)
-                    subprocess.check_call(
-                        'gsutil -m rm "gs://{}/lapdog-executions/{}/**"'.format(src_bucket, submission_id),
-                        shell=True,
-                        stdout=subprocess.DEVNULL,
-                        stderr=subprocess.DEVNULL
-                    )
-                    subprocess.check_call(
-                        'gsutil -m rm "gs://{}/bypass-{}/**"'.format(src_bucket, submission.data['BYPASS_DIRECTORY']),
-                        shell=True,
-                        stdout=subprocess.DEVNULL,
-                        stderr=subprocess.DEVNULL
-                    )
+                    engine.delete_prefix('gs://{}/lapdog-executions/{}'.format(src_bucket, submission_id))
+                    engine.delete_prefix('gs://{}/bypass-{}'.format(src_bucket, submission.data['BYPASS_DIRECTORY']))
+                    failures = engine.run()
+                    if len(failures):
+                        raise ValueError("Unable to clean {} files from the bypass workspace".format(len(failures)))
+                    checkpoint = None
                 else:
                     upload_target = self
+                    checkpoint = self._get_upload_checkpoint(submission_id)
+                    if len(checkpoint[1]['entities']):
+                        print("Skipping", len(checkpoint[1]['entities']), "entities which were already uploaded")
+                        submission_outputs = submission_outputs.loc[
+                            ~submission_outputs.index.isin(checkpoint[1]['entities'])
+                        ]
                 with upload_target.hound.with_reason('Uploading results from submission {}'.format(submission_id)):
-                    upload_target.update_entity_attributes(
-                        submission.data['workflowEntityType'],
-                        submission_outputs
-                    )
+                    self._upload_submission_outputs(upload_target, submission, submission_outputs, chunk_size, checkpoint)
                 return True
+            elif streaming:
+                if bypass:
+                    raise ValueError("Streaming uploads are not available for submissions which used an authorized domain bypass")
+                blob, checkpoint = self._get_upload_checkpoint(submission_id)
+                partials = [
+                    partial for partial in dog.core._getblob_client(None).bucket(self.get_bucket_id()).list_blobs(
+                        prefix='lapdog-executions/{}/results/partial/'.format(submission_id)
+                    )
+                    if partial.name not in checkpoint['batches']
+                ]
+                if not len(partials):
+                    print("No new workflows have finished")
+                    if not len(checkpoint['batches']):
+                        print(
+                            "Note: Only submissions launched with the",
+                            "wdl_runner:v0.18.0 image (submit v12) or later",
+                            "publish partial results",
+                            file=sys.stderr
+                        )
+                    return False
+                workflow_metadata = [
+                    meta
+                    for partial in partials
+                    for meta in json.loads(partial.download_as_string())
+                ]
+                submission_outputs = self._parse_submission_outputs(submission, workflow_metadata, partial=True)
+                submission_outputs = submission_outputs.loc[
+                    ~submission_outputs.index.isin(checkpoint['entities'])
+                ]
+                print("Uploading results from", len(submission_outputs), "finished workflows...")
+                with self.hound.with_reason('Uploading partial results from submission {}'.format(submission_id)):
+                    self._upload_submission_outputs(self, submission, submission_outputs, chunk_size, (blob, checkpoint))
+                checkpoint['batches'] += [partial.name for partial in partials]
+                blob.upload_from_string(json.dumps(checkpoint))
+                print("This submission has not finished")
+                return False
             else:
                 print("This submission has not finished")
                 return False
         raise TypeError("complete_execution not available for firecloud submissions")
+
+_WORKSPACE_MANAGERS = InstanceRegistry(
+    lambda namespace, workspace: WorkspaceManager('{}/{}'.format(namespace, workspace)),
+    16
+)
+
+def get_workspace_manager(namespace, workspace):
+    """
+    Returns the shared WorkspaceManager for the given workspace.
+    Used to resolve lapdog global submission ids without building a new
+    WorkspaceManager (and Gateway) for every call
+    """
+    return _WORKSPACE_MANAGERS.get(namespace, workspace)
@@ -0,0 +1,274 @@
+import os
+import json
+import pickle
+import traceback
+import warnings
+from threading import Thread, Lock, Condition
+from urllib.parse import quote, unquote
+import pandas as pd
+from .cache import cache_init
+
+def _copy_on_write():
+    """
+    Returns True if pandas copy-on-write is enabled (always, from pandas 3)
+    """
+    if int(pd.__version__.split('.')[0]) >= 3:
+        return True
+    try:
+        return pd.options.mode.copy_on_write is True
+    except AttributeError:
+        # Option not available before pandas 1.5
+        return False
+
+class WorkspaceStore(object):
+    """
+    On-disk snapshot of a workspace's operator cache.
+    Entity tables are pickled (they hold mixed lists and scalars, which columnar
+    formats can't represent) and all other values are stored as JSON.
+    Offline operations are appended to a journal, so they survive restarts.
+    Cache writes happen in a background thread. Call wait() to block until all
+    scheduled writes have finished
+    """
+
+    def __init__(self, namespace, workspace, path=None):
+        if path is None:
+            path = os.path.join(cache_init(), 'workspaces', namespace, workspace)
+        self.path = path
+        self.cache_dir = os.path.join(path, 'cache')
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.journal_path = os.path.join(path, 'journal.pkl')
+        self.state_path = os.path.join(path, 'state.json')
+        self._pending = {} # path -> (format, value) or None to delete
+        self._condition = Condition(Lock())
+        self._writer = None
+
+    def _key_path(self, key, ext):
+        return os.path.join(self.cache_dir, quote(key, safe='') + ext)
+
+    def keys(self):
+        """
+        Lists the cache keys present on disk
+        """
+        return [
+            unquote(os.path.splitext(filename)[0])
+            for filename in os.listdir(self.cache_dir)
+            if filename.endswith('.json') or filename.endswith('.pkl')
+        ]
+
+    def load(self, key):
+        """
+        Reads the value of a cache key from disk.
+        Raises a KeyError if the key is not on disk
+        """
+        path = self._key_path(key, '.pkl')
+        if os.path.isfile(path):
+            with open(path, 'rb') as r:
+                return pickle.load(r)
+        path = self._key_path(key, '.json')
+        if os.path.isfile(path):
+            with open(path, 'r') as r:
+                return json.load(r)
+        raise KeyError(key)
+
+    def save(self, key, value):
+        """
+        Schedules a write of the given cache value.
+        Tables are pickled later, by the writer thread. With pandas copy-on-write
+        a shallow copy is enough, since later in-place edits copy the data first.
+        Otherwise the table's data is copied now.
+        Other values are serialized immediately
+        """
+        if isinstance(value, pd.DataFrame):
+            self._schedule(self._key_path(key, '.pkl'), ('pickle', value.copy(deep=not _copy_on_write())), self._key_path(key, '.json'))
+        else:
+            try:
+                self._schedule(self._key_path(key, '.json'), ('text', json.dumps(value)), self._key_path(key, '.pkl'))
+            except TypeError:
+                self._schedule(self._key_path(key, '.pkl'), ('bytes', pickle.dumps(value)), self._key_path(key, '.json'))
+
+    def delete(self, key):
+        """
+        Schedules removal of the given cache key
+        """
+        self._schedule(self._key_path(key, '.json'), None)
+        self._schedule(self._key_path(key, '.pkl'), None)
+
+    def save_state(self, state):
+        """
+        Schedules a write of the manager state (dirty keys and fetch times)
+        """
+        self._schedule(self.state_path, ('text', json.dumps(state)))
+
+    def load_state(self):
+        """
+        Reads the manager state, or an empty state if none was saved
+        """
+        if os.path.isfile(self.state_path):
+            try:
+                with open(self.state_path, 'r') as r:
+                    return json.load(r)
+            except ValueError:
+                traceback.print_exc()
+        return {}
+
+    def append_journal(self, entry):
+        """
+        Appends an entry to the journal of offline operations.
+        Unlike cache writes, this is written before returning
+        """
+        with open(self.journal_path, 'ab') as w:
+            pickle.dump(entry, w)
+            w.flush()
+            os.fsync(w.fileno())
+
+    def read_journal(self):
+        """
+        Reads all entries from the journal of offline operations.
+        A partially written final entry is ignored
+        """
+        entries = []
+        if os.path.isfile(self.journal_path):
+            with open(self.journal_path, 'rb') as r:
+                while True:
+                    try:
+                        entries.append(pickle.load(r))
+                    except EOFError:
+                        break
+                    except pickle.UnpicklingError:
+                        warnings.warn("Ignoring a partially written journal entry")
+                        break
+        return entries
+
+    def write_journal(self, entries):
+        """
+        Replaces the journal of offline operations
+        """
+        if not len(entries):
+            if os.path.isfile(self.journal_path):
+                os.remove(self.journal_path)
+            return
+        with open(self.journal_path + '.tmp', 'wb') as w:
+            for entry in entries:
+                pickle.dump(entry, w)
+        os.replace(self.journal_path + '.tmp', self.journal_path)
+
+    def _schedule(self, path, value, replaces=None):
+        with self._condition:
+            self._pending[path] = value
+            if replaces is not None:
+                self._pending[replaces] = None
+            if self._writer is None:
+                # Not a daemon, so the interpreter waits for writes to finish before exiting
+                self._writer = Thread(target=self._write_back, name='lapdog-store-writer')
+                self._writer.start()
+
+    def _write_back(self):
+        while True:
+            with self._condition:
+                if not len(self._pending):
+                    self._writer = None
+                    self._condition.notify_all()
+                    return
+                path, value = self._pending.popitem()
+            try:
+                if value is None:
+                    if os.path.isfile(path):
+                        os.remove(path)
+                    continue
+                fmt, data = value
+                if fmt == 'pickle':
+                    data = pickle.dumps(data)
+                with open(path + '.tmp', 'w' if fmt == 'text' else 'wb') as w:
+                    w.write(data)
+                os.replace(path + '.tmp', path)
+            except:
+                traceback.print_exc()
+                warnings.warn("Failed to write workspace cache snapshot: {}".format(path))
+
+    def wait(self):
+        """
+        Blocks until all scheduled writes have finished
+        """
+        with self._condition:
+            while self._writer is not None:
+                self._condition.wait()
+
+class PersistentCache(dict):
+    """
+    Operator cache backed by a WorkspaceStore.
+    Keys saved on disk are only loaded when first accessed.
+    Changed keys are tracked until they are flushed back to the store
+    """
+
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+        self.unloaded = set(store.keys())
+        self.modified = set()
+        self._load_lock = Lock()
+
+    def _load(self, key):
+        if key in self.unloaded:
+            with self._load_lock:
+                if key in self.unloaded:
+                    try:
+                        super().__setitem__(key, self.store.load(key))
+                    except:
+                        traceback.print_exc()
+                        warnings.warn("Unable to load {} from the workspace cache snapshot".format(key))
+                    self.unloaded.discard(key)
+
+    def __contains__(self, key):
+        self._load(key)
+        return super().__contains__(key)
+
+    def __getitem__(self, key):
+        self._load(key)
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self._load(key)
+        return super().get(key, default)
+
+    def __setitem__(self, key, value):
+        self.unloaded.discard(key)
+        super().__setitem__(key, value)
+        self.modified.add(key)
+
+    def __delitem__(self, key):
+        self._load(key)
+        super().__delitem__(key)
+        self.modified.add(key)
+
+    def __iter__(self):
+        return iter([*super().keys(), *self.unloaded])
+
+    def __len__(self):
+        return super().__len__() + len(self.unloaded)
+
+    def items(self):
+        for key in [*self.unloaded]:
+            self._load(key)
+        return super().items()
+
+    def touch(self, key):
+        """
+        Marks a key as changed in place
+        """
+        self.modified.add(key)
+
+    def flush(self, keys=None):
+        """
+        Schedules writes of the given changed keys (default: all changed keys).
+        Returns the list of keys which were written
+        """
+        flushed = []
+        for key in ([*self.modified] if keys is None else keys):
+            if key in self.modified:
+                self.modified.discard(key)
+                if super().__contains__(key):
+                    self.store.save(key, super().__getitem__(key))
+                else:
+                    self.store.delete(key)
+                flushed.append(key)
+        return flushed
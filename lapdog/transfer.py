@@ -0,0 +1,212 @@
+import sys
+import time
+import random
+import traceback
+import dalmatian as dog
+from agutil import status_bar
+from agutil.parallel import parallelize
+from google.api_core.exceptions import InternalServerError, ServiceUnavailable, TooManyRequests, NotFound
+
+# Errors which indicate that the request should be retried after a short backoff
+RETRY_EXCEPTIONS = (InternalServerError, ServiceUnavailable, TooManyRequests)
+
+def split_path(gs_path):
+    """
+    Splits a gs:// path into (bucket, object name)
+    """
+    if not gs_path.startswith('gs://'):
+        raise ValueError("Path must start with gs://")
+    bucket, _, name = gs_path[5:].partition('/')
+    return bucket, name
+
+def with_backoff(func, *args, max_backoff_time=60, **kwargs):
+    """
+    Calls func(*args, **kwargs), retrying with exponential backoff if GCS
+    responds with a server error or rate limit.
+    Raises the last error once the backoff would exceed max_backoff_time
+    """
+    n = 0
+    while True:
+        try:
+            return func(*args, **kwargs)
+        except RETRY_EXCEPTIONS:
+            backoff = (2**n) + random.random()
+            if backoff > max_backoff_time:
+                raise
+            time.sleep(backoff)
+            n += 1
+
+def rewrite(src, dest, max_backoff_time=60):
+    """
+    Copies the src blob to the dest blob.
+    The rewrite token is kept across retries, so large objects resume from
+    the last completed block after a server error or rate limit
+    """
+    token = None
+    n = 0
+    while True:
+        try:
+            token, progress, total = dest.rewrite(src, token)
+            n = 0
+            if token is None:
+                return dest
+        except RETRY_EXCEPTIONS:
+            backoff = (2**n) + random.random()
+            if backoff > max_backoff_time:
+                raise
+            time.sleep(backoff)
+            n += 1
+
+class TransferEngine(object):
+    """
+    Queues copies and deletions of objects in GCS, then runs them in parallel
+    with a bounded pool of workers.
+    Copying the same source to the same destination more than once is only
+    performed once.
+    May be used as a context manager, in which case all queued transfers are
+    run on exit
+    """
+
+    def __init__(self, workers=16, credentials=None, user_project=None, max_backoff_time=60, quiet=False, batch_size=100):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.user_project = user_project
+        self.max_backoff_time = max_backoff_time
+        self.quiet = quiet
+        self.client = dog.core._getblob_client(credentials)
+        self.copies = {} # dest -> src
+        self.deletions = set()
+        self.failures = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if args[0] is None:
+            self.run()
+
+    def blob(self, gs_path):
+        """
+        Returns a blob object for the given gs:// path, using this engine's client
+        """
+        bucket, name = split_path(gs_path)
+        return self.client.bucket(bucket, self.user_project).blob(name)
+
+    def list_prefix(self, gs_path):
+        """
+        Lists the gs:// paths of all objects under the given prefix
+        """
+        bucket, prefix = split_path(gs_path)
+        return [
+            'gs://{}/{}'.format(bucket, blob.name)
+            for page in self.client.bucket(bucket, self.user_project).list_blobs(
+                prefix=prefix,
+                fields='items/name,nextPageToken'
+            ).pages
+            for blob in page
+        ]
+
+    def copy(self, src, dest):
+        """
+        Queues a copy from src to dest. Returns the destination path
+        """
+        if dest in self.copies and self.copies[dest] != src:
+            raise ValueError("Conflicting copies from {} and {} to {}".format(
+                self.copies[dest],
+                src,
+                dest
+            ))
+        self.copies[dest] = src
+        return dest
+
+    def copy_prefix(self, src, dest):
+        """
+        Queues a copy of every object under the src prefix to the same relative
+        path under the dest prefix. Returns the list of destination paths
+        """
+        src = src.rstrip('/') + '/'
+        dest = dest.rstrip('/') + '/'
+        return [
+            self.copy(path, dest + path[len(src):])
+            for path in self.list_prefix(src)
+        ]
+
+    def delete(self, path):
+        """
+        Queues a deletion of the given path.
+        Deletions are run after all queued copies have finished, and are sent
+        in batch requests of up to batch_size objects
+        """
+        self.deletions.add(path)
+
+    def delete_prefix(self, prefix):
+        """
+        Queues a deletion of every object under the given prefix
+        """
+        for path in self.list_prefix(prefix.rstrip('/') + '/'):
+            self.delete(path)
+
+    def _copy(self, dest, src):
+        try:
+            rewrite(self.blob(src), self.blob(dest), self.max_backoff_time)
+        except:
+            return [(dest, traceback.format_exc())]
+        return [(dest, None)]
+
+    def _delete_one(self, path):
+        try:
+            with_backoff(self.blob(path).delete, max_backoff_time=self.max_backoff_time)
+        except NotFound:
+            pass
+        except:
+            return path, traceback.format_exc()
+        return path, None
+
+    def _delete_batch(self, paths):
+        with self.client.batch():
+            for path in paths:
+                self.blob(path).delete()
+
+    def _delete(self, paths):
+        try:
+            with_backoff(self._delete_batch, paths, max_backoff_time=self.max_backoff_time)
+        except:
+            # A batch fails as a whole if any single deletion failed
+            # So fall back to deleting each object on its own
+            return [self._delete_one(path) for path in paths]
+        return [(path, None) for path in paths]
+
+    def _dispatch(self, func, items, message):
+        if not len(items):
+            return
+        results = parallelize(self.workers)(func)(*zip(*items))
+        if not self.quiet:
+            results = status_bar.iter(results, len(items), prepend=message)
+        for result in results:
+            for path, error in result:
+                if error is not None:
+                    self.failures[path] = error
+
+    def run(self):
+        """
+        Runs all queued copies, then all queued deletions.
+        Returns a dictionary of {path: error} for each transfer which failed.
+        Failed copies are keyed by their destination path
+        """
+        self.failures = {}
+        self._dispatch(self._copy, [*self.copies.items()], "Copying files... ")
+        deletions = sorted(self.deletions)
+        self._dispatch(
+            self._delete,
+            [
+                (deletions[i:i+self.batch_size],)
+                for i in range(0, len(deletions), self.batch_size)
+            ],
+            "Deleting files... "
+        )
+        self.copies = {}
+        self.deletions = set()
+        if not self.quiet:
+            for path in self.failures:
+                print("Failed to transfer", path, file=sys.stderr)
+        return self.failures
@@ -0,0 +1,50 @@
+import contextlib
+import pytest
+from lapdog.lapdog import WorkspaceManager
+
+class FakeHound(object):
+    """
+    Stands in for the hound client, which would otherwise need the workspace bucket
+    """
+
+    def get_current_reason(self):
+        return None
+
+    def with_reason(self, reason):
+        return contextlib.nullcontext()
+
+    def write_log_entry(self, *args, **kwargs):
+        pass
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """
+    Points the lapdog offline cache at a temporary directory
+    """
+    monkeypatch.setenv('LAPDOG_CACHE', str(tmp_path))
+    return tmp_path
+
+@pytest.fixture
+def make_manager(cache_dir, monkeypatch):
+    """
+    Returns a function which builds offline WorkspaceManagers.
+    Nothing is fetched from FireCloud, so tests must populate the cache
+    """
+    monkeypatch.setattr(WorkspaceManager, 'hound', FakeHound())
+
+    def make(reference='lapdog-test/workspace', **kwargs):
+        manager = WorkspaceManager(reference, workspace_seed_url=None, **kwargs)
+        manager.live = False
+        manager.cache['workspace'] = {
+            'workspace': {
+                'bucketName': 'workspace-bucket',
+                'attributes': {}
+            }
+        }
+        return manager
+
+    return make
+
+@pytest.fixture
+def manager(make_manager):
+    return make_manager()
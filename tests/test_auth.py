@@ -0,0 +1,45 @@
+import time
+import pytest
+from lapdog import auth
+from lapdog.auth import LapdogToken, AuthenticationError
+
+class Stop(Exception):
+    pass
+
+class FakeTime(object):
+    """
+    Records sleeps instead of sleeping. Stops the caller after limit sleeps
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.sleeps = []
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, delay):
+        self.sleeps.append(delay)
+        if len(self.sleeps) >= self.limit:
+            raise Stop()
+
+def test_failed_refreshes_back_off(monkeypatch, capsys):
+    clock = FakeTime(9)
+    monkeypatch.setattr(auth, 'time', clock)
+    token = LapdogToken.__new__(LapdogToken)
+    token.expiry = time.time() - 1
+    attempts = []
+
+    def refresh():
+        attempts.append(len(clock.sleeps))
+        if len(attempts) == 8:
+            token.expiry = time.time() + 3600
+            return
+        raise AuthenticationError("offline")
+
+    token.refresh = refresh
+    with pytest.raises(Stop):
+        token._refresh_loop()
+    assert clock.sleeps == [60, 120, 240, 480, 960, 1920, 3600, 60, 60]
+    assert len(attempts) == 8
+    assert capsys.readouterr().err.count("Unable to refresh the Lapdog token") == 1
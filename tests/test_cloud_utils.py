@@ -0,0 +1,103 @@
+import threading
+import time
+from types import SimpleNamespace
+import google.api_core.exceptions
+import pytest
+from lapdog.cloud import utils
+
+KEY = 'projects/lapdog-test/locations/us/keyRings/lapdog/cryptoKeys/lapdog-sign'
+
+class FakeKMS(object):
+    """
+    KMS client with a single key. Versions in enabled can sign
+    """
+
+    def __init__(self, *enabled):
+        self.enabled = set(enabled)
+        self.listed = 0
+        self.signed = []
+
+    def list_crypto_key_versions(self, name):
+        self.listed += 1
+        return [
+            SimpleNamespace(name='{}/cryptoKeyVersions/{}'.format(name, version), state=1)
+            for version in self.enabled
+        ]
+
+    def asymmetric_sign(self, version, digest):
+        if int(version.split('/')[-1]) not in self.enabled:
+            raise google.api_core.exceptions.FailedPrecondition(version)
+        self.signed.append(version)
+        return SimpleNamespace(signature=version.encode())
+
+@pytest.fixture
+def kms(monkeypatch):
+    kms = FakeKMS(1, 2)
+    monkeypatch.setattr(utils, '_kms_client', lambda credentials: kms)
+    utils._enabled_key_versions.invalidate()
+    yield kms
+    utils._enabled_key_versions.invalidate()
+
+def test_signing_uses_cached_newest_version(kms):
+    assert utils._get_signature(b'data', KEY, None) == (KEY + '/cryptoKeyVersions/2').encode()
+    assert utils._get_signature(b'data', KEY, None) == (KEY + '/cryptoKeyVersions/2').encode()
+    assert kms.listed == 1
+
+def test_signing_refreshes_disabled_versions(kms):
+    utils._get_signature(b'data', KEY, None)
+    kms.enabled.discard(2)
+    assert utils._get_signature(b'data', KEY, None) == (KEY + '/cryptoKeyVersions/1').encode()
+    assert kms.listed == 2
+    # Only one retry
+    kms.enabled.clear()
+    with pytest.raises(IndexError):
+        utils._get_signature(b'data', KEY, None)
+    assert kms.listed == 3
+
+class FakeCredentials(object):
+
+    def __init__(self):
+        self.token = 'token'
+        self.expiry = None
+        self.refreshes = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def refresh(self, request):
+        self.started.set()
+        self.release.wait(10)
+        self.refreshes += 1
+
+    def before_request(self, request, method, url, headers):
+        pass
+
+def test_waiting_refreshes_are_skipped():
+    credentials = utils._serialize_refresh(FakeCredentials())
+    credentials.release.clear()
+    first = threading.Thread(target=credentials.refresh, args=(None,))
+    first.start()
+    credentials.started.wait(10)
+    waiting = [threading.Thread(target=credentials.refresh, args=(None,)) for i in range(4)]
+    for thread in waiting:
+        thread.start()
+    time.sleep(0.1)
+    credentials.release.set()
+    for thread in [first, *waiting]:
+        thread.join(10)
+    assert credentials.refreshes == 1
+    credentials.refresh(None)
+    assert credentials.refreshes == 2
+
+@pytest.mark.parametrize('function', [True, False])
+def test_session_refresher_only_runs_locally(monkeypatch, function):
+    monkeypatch.setattr(utils, '_SESSION_POOL', {})
+    monkeypatch.setattr(utils, '_SESSION_REFRESHER', None)
+    monkeypatch.setattr(utils.google.auth, 'default', lambda scopes=None: (FakeCredentials(), 'lapdog-test'))
+    monkeypatch.delenv('FUNCTION_NAME', raising=False)
+    monkeypatch.delenv('FUNCTION_TARGET', raising=False)
+    if function:
+        monkeypatch.setenv('FUNCTION_NAME', 'submit')
+    session = utils.generate_default_session()
+    assert utils.generate_default_session() is session
+    assert (utils._SESSION_REFRESHER is None) == function
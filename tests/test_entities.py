@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+from lapdog import lapdog as lapdog_module
+from lapdog.lapdog import _compact_entities, _expand_entities, _map_cells, _ARROW_STRING
+
+def entity_table():
+    return pd.DataFrame(
+        {
+            'tumor_type': ['LUAD', 'LUAD', 'LUSC', np.nan, 'LUSC'],
+            'bam': ['gs://bucket/{}.bam'.format(i) for i in range(5)],
+            'reads': [['r1'], ['r2', 'r3'], np.nan, 'r4', 'r5'],
+            'depth': [30.0, 32.5, np.nan, 28.0, 31.0],
+        },
+        index=pd.Index(['s1', 's2', 's3', 's4', 's5'], name='sample_id')
+    ).astype({'tumor_type': object, 'bam': object})
+
+def test_compact_entities():
+    table = _compact_entities(entity_table())
+    assert isinstance(table['tumor_type'].dtype, pd.CategoricalDtype)
+    if _ARROW_STRING is not None:
+        assert table['bam'].dtype == _ARROW_STRING
+    assert table['reads'].dtype == object
+    assert table['depth'].dtype == np.float64
+
+def test_expand_entities():
+    compact = _compact_entities(entity_table())
+    table = _expand_entities(compact)
+    for col in ('tumor_type', 'bam', 'reads'):
+        assert table[col].dtype == object
+    assert table['tumor_type'].tolist()[:3] == ['LUAD', 'LUAD', 'LUSC']
+    assert np.isnan(table['tumor_type'].iloc[3])
+    pd.testing.assert_frame_equal(table, entity_table())
+    # The cached table is untouched
+    assert isinstance(compact['tumor_type'].dtype, pd.CategoricalDtype)
+
+@pytest.mark.skipif(_ARROW_STRING is None, reason="pyarrow is not installed")
+def test_expand_arrow_strings():
+    compact = entity_table()
+    compact['bam'] = compact['bam'].astype(_ARROW_STRING)
+    compact.loc['s4', 'bam'] = pd.NA
+    table = _expand_entities(compact, deep=True)
+    assert table['bam'].dtype == object
+    assert np.isnan(table['bam'].iloc[3])
+
+def test_get_entities_decodes_copies(manager):
+    manager.cache['entities:sample'] = _compact_entities(entity_table())
+    view = manager.get_entities('sample')
+    assert isinstance(view['tumor_type'].dtype, pd.CategoricalDtype)
+    assert (view['tumor_type'] == 'LUAD').sum() == 2
+
+    table = manager.get_entities('sample', copy=True)
+    assert table['tumor_type'].dtype == object
+    table.loc['s1', 'tumor_type'] = 'BRCA'
+    assert table['tumor_type'].tolist()[:3] == ['BRCA', 'LUAD', 'LUSC']
+    # Cells compare and map like any other table
+    assert (table == _map_cells(table, lambda value: value)).loc['s2'].all()
+    cached = manager.cache['entities:sample']
+    assert isinstance(cached['tumor_type'].dtype, pd.CategoricalDtype)
+    assert cached.loc['s1', 'tumor_type'] == 'LUAD'
+
+@pytest.mark.parametrize('copy_on_write', [True, False])
+def test_get_entities_views_are_independent(manager, monkeypatch, copy_on_write):
+    monkeypatch.setattr(lapdog_module, '_copy_on_write', lambda: copy_on_write)
+    manager.cache['entities:sample'] = entity_table()
+    view = manager.get_entities('sample')
+    cached = manager.cache['entities:sample']
+    # Without copy-on-write, views must not share data with the cache
+    assert np.shares_memory(view['depth'].values, cached['depth'].values) == copy_on_write
+    view.loc['s1', 'depth'] = 0.0
+    assert cached.loc['s1', 'depth'] == 30.0
+    cached.loc['s2', 'depth'] = 0.0
+    assert view.loc['s2', 'depth'] == 32.5
@@ -0,0 +1,33 @@
+from types import SimpleNamespace
+from lapdog import gateway
+from lapdog.gateway import Gateway
+
+def test_registration_is_tracked_per_account(cache_dir, monkeypatch):
+    monkeypatch.setattr(gateway, '_GATEWAY_STATE', {})
+    account = ['first@broadinstitute.org']
+    monkeypatch.setattr(gateway, 'get_gcloud_account', lambda: account[0])
+    queries = []
+
+    def call_endpoint(self, method, endpoint, **kwargs):
+        queries.append(account[0])
+        return SimpleNamespace(status_code=200 if account[0].startswith('first') else 403)
+
+    monkeypatch.setattr(Gateway, 'call_endpoint', call_endpoint)
+    # Skip the constructor, which would resolve the project
+    gw = Gateway.__new__(Gateway)
+    gw.namespace = 'lapdog-test'
+    gw.project = 'lapdog-test-project'
+    assert gw.registered
+    assert gw.registered
+    assert queries == ['first@broadinstitute.org']
+
+    account[0] = 'second@broadinstitute.org'
+    assert not gw.registered
+    assert not gw.registered
+    assert queries == ['first@broadinstitute.org'] + ['second@broadinstitute.org'] * 2
+
+    # The verified registration is loaded again from disk
+    monkeypatch.setattr(gateway, '_GATEWAY_STATE', {})
+    account[0] = 'first@broadinstitute.org'
+    assert gw.registered
+    assert len(queries) == 3
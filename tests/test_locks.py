@@ -0,0 +1,173 @@
+import threading
+import pytest
+from lapdog.lapdog import _synchronized_on, _ReadWriteLock
+
+class Locked(object):
+    """
+    Minimal object with the attributes used by _synchronized_on.
+    Records the order in which key locks are taken
+    """
+
+    def __init__(self):
+        self.lock = _ReadWriteLock()
+        self.locks = {}
+        self.acquired = []
+        self.persisted = []
+
+    def key_lock(self, key):
+        self.acquired.append(key)
+        return self.locks.setdefault(key, threading.RLock())
+
+    def _persist(self, keys):
+        self.persisted.append(keys)
+
+    @_synchronized_on('b', 'a', lambda self, extra: extra)
+    def forward(self, extra):
+        return [*self.acquired]
+
+    @_synchronized_on(lambda self, extra: extra, 'b', 'a')
+    def backward(self, extra):
+        return [*self.acquired]
+
+def test_keys_are_locked_in_sorted_order():
+    obj = Locked()
+    assert obj.forward(['d', 'c']) == ['a', 'b', 'c', 'd']
+    assert obj.persisted == [['a', 'b', 'c', 'd']]
+
+def test_keys_are_persisted_on_failure():
+    obj = Locked()
+
+    @_synchronized_on('b', 'a')
+    def fail(self):
+        raise KeyError()
+
+    with pytest.raises(KeyError):
+        fail(obj)
+    assert obj.persisted == [['a', 'b']]
+
+def test_opposite_declarations_do_not_deadlock():
+    obj = Locked()
+    errors = []
+
+    def run(func):
+        try:
+            for i in range(200):
+                func(obj, 'c')
+        except Exception as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=run, args=(func,), daemon=True)
+        for func in (Locked.forward, Locked.backward) * 2
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert not any(thread.is_alive() for thread in threads)
+    assert not errors
+
+class OrderedLock(object):
+    """
+    Wraps a key lock and records acquisitions of a key which sorts before a
+    key already held by the same thread
+    """
+
+    def __init__(self, recorder, key, lock):
+        self.recorder = recorder
+        self.key = key
+        self.lock = lock
+
+    def __enter__(self):
+        held = self.recorder.held()
+        if self.key not in held and any(key > self.key for key in held):
+            self.recorder.violations.append((self.key, [*held]))
+        self.lock.__enter__()
+        held.append(self.key)
+        return self
+
+    def __exit__(self, *args):
+        self.recorder.held().remove(self.key)
+        return self.lock.__exit__(*args)
+
+class LockRecorder(object):
+
+    def __init__(self, key_lock):
+        self.key_lock = key_lock
+        self.local = threading.local()
+        self.violations = []
+
+    def held(self):
+        if not hasattr(self.local, 'held'):
+            self.local.held = []
+        return self.local.held
+
+    def __call__(self, key):
+        return OrderedLock(self, key, self.key_lock(key))
+
+@pytest.fixture
+def recorder(manager, monkeypatch):
+    recorder = LockRecorder(manager.key_lock)
+    monkeypatch.setattr(manager, 'key_lock', recorder)
+    return recorder
+
+def make_config(name):
+    return {
+        'namespace': 'lapdog-test',
+        'name': name,
+        'rootEntityType': 'sample',
+        'methodRepoMethod': {
+            'methodNamespace': 'lapdog-test',
+            'methodName': 'method',
+            'methodVersion': 1,
+        },
+        'inputs': {},
+        'outputs': {},
+        'prerequisites': {},
+        'deleted': False
+    }
+
+def test_config_methods_keep_lock_order(manager, recorder, tmp_path):
+    wdl = tmp_path / 'method.wdl'
+    wdl.write_text('workflow method {}')
+    manager.cache['configs'] = []
+    with pytest.warns(UserWarning):
+        manager.update_config(make_config('first'), wdl=str(wdl))
+    manager.update_config(make_config('second'))
+    assert manager.cache['wdl:lapdog-test/method/-1'] == 'workflow method {}'
+    assert {c['name'] for c in manager.cache['configs']} == {'first', 'second'}
+
+    # Offline, a name-only reference must already be cached
+    manager.cache['config:first'] = manager.cache['config:lapdog-test/first']
+    manager.delete_config('first')
+    assert 'config:first' not in manager.cache
+    assert 'config:lapdog-test/first' not in manager.cache
+    assert [c['name'] for c in manager.cache['configs']] == ['second']
+    assert not recorder.violations
+
+def test_concurrent_config_updates(manager, recorder):
+    manager.cache['configs'] = []
+    for name in ('first', 'second'):
+        manager.update_config(make_config(name))
+    errors = []
+
+    def run(name):
+        try:
+            for i in range(25):
+                manager.update_config(make_config(name))
+                manager.delete_config('lapdog-test/{}'.format(name))
+                manager.update_config(make_config(name))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=run, args=(name,), daemon=True)
+        for name in ('first', 'second')
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    assert not any(thread.is_alive() for thread in threads)
+    assert not errors
+    assert not recorder.violations
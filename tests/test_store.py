@@ -0,0 +1,105 @@
+import pickle
+import dalmatian
+import pandas as pd
+import pytest
+from lapdog.store import WorkspaceStore, PersistentCache
+
+@pytest.fixture
+def store(tmp_path):
+    return WorkspaceStore('lapdog-test', 'workspace', path=str(tmp_path / 'store'))
+
+def test_store_round_trip(store):
+    df = pd.DataFrame(
+        {'bam': ['gs://bucket/a.bam', 'gs://bucket/b.bam'], 'reads': [['r1', 'r2'], 5]},
+        index=pd.Index(['s1', 's2'], name='sample_id')
+    )
+    store.save('entities:sample', df)
+    store.save('configs', [{'namespace': 'ns', 'name': 'config'}])
+    store.save('ids', {'a', 'b'})
+    store.wait()
+    assert sorted(store.keys()) == ['configs', 'entities:sample', 'ids']
+    pd.testing.assert_frame_equal(store.load('entities:sample'), df)
+    assert store.load('configs') == [{'namespace': 'ns', 'name': 'config'}]
+    assert store.load('ids') == {'a', 'b'}
+
+    # A key switching between formats replaces the old file
+    store.save('configs', {'x'})
+    store.delete('ids')
+    store.wait()
+    assert sorted(store.keys()) == ['configs', 'entities:sample']
+    assert store.load('configs') == {'x'}
+    with pytest.raises(KeyError):
+        store.load('ids')
+
+def test_saved_tables_are_snapshots(store):
+    df = pd.DataFrame({'bam': ['a', 'b']}, index=['s1', 's2'])
+    store.save('entities:sample', df)
+    df.loc['s1', 'bam'] = 'changed'
+    store.wait()
+    assert store.load('entities:sample')['bam'].tolist() == ['a', 'b']
+
+def test_persistent_cache(store):
+    store.save('configs', [])
+    store.save('entity_types', {'sample': {}})
+    store.wait()
+    cache = PersistentCache(store)
+    assert cache.unloaded == {'configs', 'entity_types'}
+    assert len(cache) == 2
+    assert cache['configs'] == []
+    assert cache.unloaded == {'entity_types'}
+    assert not len(cache.modified)
+
+    cache['configs'].append('config')
+    cache.touch('configs')
+    cache['workspace'] = {'workspace': {}}
+    del cache['entity_types']
+    assert cache.modified == {'configs', 'workspace', 'entity_types'}
+    assert cache.flush(['configs']) == ['configs']
+    assert sorted(cache.flush()) == ['entity_types', 'workspace']
+    assert not len(cache.modified)
+    store.wait()
+
+    reloaded = PersistentCache(store)
+    assert dict(reloaded.items()) == {'configs': ['config'], 'workspace': {'workspace': {}}}
+
+def test_journal(store):
+    assert store.read_journal() == []
+    store.append_journal(('delete_entity', ('sample', ['s1']), {}, ['entities:sample']))
+    store.append_journal(('delete_config', ('ns/config',), {}, ['configs']))
+    assert [entry[0] for entry in store.read_journal()] == ['delete_entity', 'delete_config']
+
+    # Simulate a crash while appending
+    with open(store.journal_path, 'ab') as w:
+        w.write(pickle.dumps(('update_config', ({},), {}, ['configs']))[:-3])
+    with pytest.warns(UserWarning):
+        entries = store.read_journal()
+    assert len(entries) == 2
+
+    store.write_journal(entries[1:])
+    assert [entry[0] for entry in store.read_journal()] == ['delete_config']
+    store.write_journal([])
+    assert store.read_journal() == []
+
+def test_restore_does_not_contact_firecloud(make_manager, monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        dalmatian.WorkspaceManager,
+        'delete_entity',
+        lambda self, etype, entity_ids: calls.append((etype, entity_ids))
+    )
+    manager = make_manager(persist=True)
+    manager.cache['entities:sample'] = pd.DataFrame(
+        {'bam': ['a', 'b']},
+        index=pd.Index(['s1', 's2'], name='sample_id')
+    )
+    manager._persist()
+    manager.delete_entity('sample', ['s1'])
+    assert calls == [('sample', ['s1'])]
+    assert len(manager.pending_operations) == 1
+    manager._store.wait()
+
+    restored = make_manager(persist=True)
+    assert calls == [('sample', ['s1'])]
+    assert len(restored.pending_operations) == 1
+    assert restored.cache['entities:sample'].index.tolist() == ['s2']
+    assert 'entities:sample' in restored.dirty
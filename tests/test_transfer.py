@@ -0,0 +1,139 @@
+import contextlib
+from types import SimpleNamespace
+import pandas as pd
+import pytest
+from google.api_core.exceptions import Forbidden, NotFound
+from lapdog import transfer
+from lapdog import lapdog as lapdog_module
+from lapdog.transfer import TransferEngine, split_path
+from lapdog.lapdog import _compact_entities
+
+class FakeBlob(object):
+    def __init__(self, storage, bucket, name):
+        self.storage = storage
+        self.bucket_name = bucket
+        self.name = name
+
+    @property
+    def path(self):
+        return 'gs://{}/{}'.format(self.bucket_name, self.name)
+
+    def rewrite(self, src, token=None):
+        if src.path in self.storage.broken:
+            raise Forbidden(src.path)
+        self.storage.objects[self.path] = self.storage.objects[src.path]
+        self.storage.copies.append((src.path, self.path))
+        return None, 1, 1
+
+    def delete(self):
+        if self.path in self.storage.broken:
+            raise Forbidden(self.path)
+        if self.path not in self.storage.objects:
+            raise NotFound(self.path)
+        del self.storage.objects[self.path]
+
+class FakeBucket(object):
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+
+    def blob(self, name):
+        return FakeBlob(self.storage, self.name, name)
+
+    def list_blobs(self, prefix='', fields=None):
+        names = sorted(
+            split_path(path)[1] for path in self.storage.objects
+            if path.startswith('gs://{}/{}'.format(self.name, prefix))
+        )
+        return SimpleNamespace(pages=[[SimpleNamespace(name=name) for name in names]])
+
+class FakeStorage(object):
+    """
+    In-memory GCS client. Paths in broken fail with a 403
+    """
+
+    def __init__(self, *paths):
+        self.objects = {path: path for path in paths}
+        self.copies = []
+        self.broken = set()
+
+    def bucket(self, name, user_project=None):
+        return FakeBucket(self, name)
+
+    def batch(self):
+        return contextlib.nullcontext()
+
+@pytest.fixture
+def storage(monkeypatch):
+    storage = FakeStorage()
+    monkeypatch.setattr(transfer.dog.core, '_getblob_client', lambda credentials: storage)
+    return storage
+
+def test_duplicate_copies_are_queued_once(storage):
+    storage.objects['gs://src/a'] = 'a'
+    engine = TransferEngine(quiet=True)
+    engine.copy('gs://src/a', 'gs://dest/a')
+    engine.copy('gs://src/a', 'gs://dest/a')
+    assert engine.run() == {}
+    assert storage.copies == [('gs://src/a', 'gs://dest/a')]
+
+def test_conflicting_copies_raise(storage):
+    engine = TransferEngine(quiet=True)
+    engine.copy('gs://src-a/a', 'gs://dest/a')
+    with pytest.raises(ValueError):
+        engine.copy('gs://src-b/a', 'gs://dest/a')
+
+def test_deletions_run_after_copies(storage):
+    storage.objects.update({'gs://src/dir/a': 'a', 'gs://src/dir/b': 'b'})
+    engine = TransferEngine(quiet=True)
+    engine.copy_prefix('gs://src/dir', 'gs://dest/moved')
+    engine.delete_prefix('gs://src/dir')
+    assert engine.run() == {}
+    assert storage.objects == {'gs://dest/moved/a': 'a', 'gs://dest/moved/b': 'b'}
+
+def test_failures_are_reported(storage):
+    storage.objects.update({'gs://src/a': 'a', 'gs://src/b': 'b', 'gs://src/c': 'c'})
+    storage.broken.update({'gs://src/a', 'gs://src/c'})
+    engine = TransferEngine(quiet=True)
+    engine.copy('gs://src/a', 'gs://dest/a')
+    engine.copy('gs://src/b', 'gs://dest/b')
+    engine.delete('gs://src/b')
+    engine.delete('gs://src/c')
+    engine.delete('gs://src/missing')
+    failures = engine.run()
+    # Copy failures are keyed by destination. Missing objects are not failures
+    assert sorted(failures) == ['gs://dest/a', 'gs://src/c']
+    assert 'gs://src/b' not in storage.objects
+
+def test_copy_data_skips_conflicting_sources(manager, storage, monkeypatch):
+    storage.objects.update({
+        'gs://bucket-a/data/x.bam': 'a',
+        'gs://bucket-b/data/x.bam': 'b',
+        'gs://bucket-a/data/y.bam': 'y',
+    })
+
+    def getblob(path):
+        bucket, name = split_path(path)
+        return SimpleNamespace(bucket=SimpleNamespace(name=bucket), name=name)
+
+    monkeypatch.setattr(lapdog_module, 'getblob', getblob)
+    manager.cache['entity_types'] = {
+        'sample': {'attributeNames': ['bam', 'cohort'], 'count': 3, 'idName': 'sample_id'}
+    }
+    # The cached cohort column becomes a categorical
+    manager.cache['entities:sample'] = _compact_entities(pd.DataFrame(
+        {
+            'bam': ['gs://bucket-a/data/x.bam', 'gs://bucket-b/data/x.bam', 'gs://bucket-a/data/y.bam'],
+            'cohort': ['LUAD', 'LUAD', 'LUAD'],
+        },
+        index=pd.Index(['s1', 's2', 's3'], name='sample_id')
+    ))
+    with pytest.warns(UserWarning, match='already being copied'):
+        manager.copy_data()
+    assert storage.objects['gs://workspace-bucket/data/x.bam'] == 'a'
+    assert storage.objects['gs://workspace-bucket/data/y.bam'] == 'y'
+    assert manager.cache['entities:sample']['bam'].tolist() == [
+        'gs://workspace-bucket/data/x.bam',
+        'gs://bucket-b/data/x.bam',
+        'gs://workspace-bucket/data/y.bam'
+    ]